@@ -5,8 +5,9 @@ import requests # Added for Resend API
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, PasswordResetForm
 from .models import User, ProfileImage
-from rooms.models import Course
+from rooms.forms import CatalogMultipleChoiceField
 from django.template.loader import render_to_string
+from core.imaging import inspect_upload, ImageRejected
 
 class CustomUserCreationForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
@@ -27,6 +28,16 @@ class ProfileImageForm(forms.ModelForm):
             'image': 'Upload a new picture'
         }
 
+    # Turn away oversized images (decompression bombs) from the header alone
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if image:
+            try:
+                inspect_upload(image)
+            except ImageRejected as e:
+                raise forms.ValidationError(str(e))
+        return image
+
 class ProfileUpdateForm(forms.ModelForm):
     bio = forms.CharField(
         widget=forms.Textarea(attrs={'rows': 4}), 
@@ -47,15 +58,15 @@ class ProfileUpdateForm(forms.ModelForm):
         widget=forms.NumberInput(attrs={'class': 'form-control'})
     )
     
-    interests = forms.ModelMultipleChoiceField(
-        queryset=Course.objects.filter(tag_type='interest').order_by('name'),
+    interests = CatalogMultipleChoiceField(
+        tag_type='interest',
         widget=forms.CheckboxSelectMultiple,
         required=False,
         label='Interests'
     )
 
-    courses = forms.ModelMultipleChoiceField(
-        queryset=Course.objects.filter(tag_type='course').order_by('name'),
+    courses = CatalogMultipleChoiceField(
+        tag_type='course',
         widget=forms.CheckboxSelectMultiple,
         required=False,
         label='Courses'
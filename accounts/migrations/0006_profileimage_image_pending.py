@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_profile_match_age_max_profile_match_age_min'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profileimage',
+            name='image_pending',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_profileimage_image_pending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profileimage',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:29
+
+from django.db import migrations, models
+
+
+# Copies every profile's current main picture onto the profile.
+def copy_main_images(apps, schema_editor):
+    Profile = apps.get_model('accounts', 'Profile')
+    ProfileImage = apps.get_model('accounts', 'ProfileImage')
+    for image in ProfileImage.objects.filter(is_main=True).only('profile_id', 'image', 'image_variants').iterator():
+        Profile.objects.filter(pk=image.profile_id).update(
+            main_image_name=image.image.name, main_image_variants=image.image_variants,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_profileimage_stored_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='main_image_name',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='main_image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(copy_main_images, migrations.RunPython.noop),
+    ]
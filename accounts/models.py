@@ -4,10 +4,6 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from .managers import CustomUserManager
 from rooms.models import Course
-from PIL import Image
-from io import BytesIO
-from django.core.files.base import ContentFile
-import os
 
 class User(AbstractUser):
     username = None
@@ -33,57 +29,52 @@ class Profile(models.Model):
     
     match_age_min = models.PositiveIntegerField(default=18)
     match_age_max = models.PositiveIntegerField(default=99)
-    
+
+    # Copy of the main picture's file name and size variants, so pages that show
+    # many avatars (buddy list, header) don't look up 'ProfileImage' for each one.
+    # Kept up to date by 'refresh_main_image' (see accounts/signals.py).
+    main_image_name = models.CharField(max_length=255, blank=True, editable=False)
+    main_image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    # An unsaved 'ProfileImage' built from the copied fields (no query), for 'responsive_image'
+    @property
+    def main_image(self):
+        if not self.main_image_name:
+            return None
+        return ProfileImage(image=self.main_image_name, image_variants=self.main_image_variants)
+
     @property
     def main_image_url(self):
-        main_image = self.images.filter(is_main=True).first()
+        main_image = self.main_image
         if main_image:
             return main_image.image.url
         return None
 
+    # Copies the current main picture's name and variants onto the profile
+    def refresh_main_image(self):
+        main_image = self.images.filter(is_main=True).values('image', 'image_variants').first()
+        self.main_image_name = main_image['image'] if main_image else ''
+        self.main_image_variants = main_image['image_variants'] if main_image else {}
+        self.save(update_fields=['main_image_name', 'main_image_variants'])
+
     def __str__(self):
         return f'{self.user.email} Profile'
 
 class ProfileImage(models.Model):
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='profile_images/')
+    # True while the uploaded image is still being resized (see core/image_jobs.py)
+    image_pending = models.BooleanField(default=False)
+    # Smaller WebP/JPEG copies of the image: {'width': main width, 'sizes': [[size, width], ...]}
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # The shared processed file this image uses, if any (see core.models.StoredImage)
+    stored_image = models.ForeignKey('core.StoredImage', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
     is_main = models.BooleanField(default=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"Image for {self.profile.user.email}"
 
-    def save(self, *args, **kwargs):
-        if self.image:
-            if hasattr(self.image, 'seek'):
-                self.image.seek(0)
-
-            try:
-                img = Image.open(self.image)
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                max_size = (800, 800)
-                
-                if img.height > max_size[1] or img.width > max_size[0]:
-                    img.thumbnail(max_size, Image.Resampling.LANCZOS)
-                    output = BytesIO()
-                    img.save(output, format='JPEG', quality=75)
-                    output.seek(0)
-                    
-                    new_name = os.path.splitext(self.image.name)[0] + '.jpg'
-                    self.image = ContentFile(output.read(), name=new_name)
-                else:
-                    if hasattr(self.image, 'seek'):
-                        self.image.seek(0)
-
-            except Exception as e:
-                print(f"Error optimizing image: {e}")
-                if hasattr(self.image, 'seek'):
-                    self.image.seek(0)
-
-        super().save(*args, **kwargs)
-
 class Like(models.Model):
     from_user = models.ForeignKey(User, related_name='likes_given', on_delete=models.CASCADE)
     to_user = models.ForeignKey(User, related_name='likes_received', on_delete=models.CASCADE)
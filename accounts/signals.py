@@ -1,11 +1,13 @@
 # accounts/signals.py
 
 # Import post_save from django.db.models.signals because we need to listen for when a model is saved.
-from django.db.models.signals import post_save
+# Import post_delete because removing the main picture changes what the profile shows.
+from django.db.models.signals import post_save, post_delete
 # Import receiver from django.dispatch because it's the decorator used to connect a function to a signal.
 from django.dispatch import receiver
 # Import models from .models because 'User' is the sender of the signal and 'Profile' is what we create.
-from .models import User, Profile
+# Import ProfileImage because the profile keeps a copy of its main picture.
+from .models import User, Profile, ProfileImage
 
 """
 Author: Evan
@@ -20,3 +22,25 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
 
+
+"""
+Author: Evan
+These receivers keep the copy of the main picture on 'Profile' (see
+'Profile.refresh_main_image') in step with 'ProfileImage'. Every
+change of the main picture ends with a save or delete of a main image:
+an upload that becomes the main one, the image worker swapping in the
+resized file, "Set as Main" (the old main is un-flagged with a bulk
+update, then the new one is saved) and deleting the main picture.
+Saves of other pictures can't change the main one, so they are ignored.
+Deletes that are part of deleting the whole profile or account are
+ignored too, since the profile is going away.
+"""
+@receiver(post_save, sender=ProfileImage)
+def refresh_main_image_on_save(sender, instance, **kwargs):
+    if instance.is_main:
+        instance.profile.refresh_main_image()
+
+@receiver(post_delete, sender=ProfileImage)
+def refresh_main_image_on_delete(sender, instance, origin=None, **kwargs):
+    if instance.is_main and not isinstance(origin, (User, Profile)):
+        instance.profile.refresh_main_image()
@@ -38,10 +38,21 @@ from .services import find_matches
 from .models import ProfileImage, SkippedMatch, Like
 # Import Course, Session from rooms.models because 'signup_view' and 'sessions_view' need them.
 from rooms.models import Course, Session
+# Import catalog from rooms.catalog because 'signup_view' and the profile editor look tags up there.
+from rooms.catalog import catalog
 # Import get_or_create_message_thread from messaging.utils because 'check_for_match' and 'profile_view' need them.
-from messaging.utils import get_or_create_message_thread
+# Import get_direct_thread_ids because 'buddies_view' needs a thread for every buddy at once.
+from messaging.utils import get_or_create_message_thread, get_direct_thread_ids
 # Import get_online_user_ids from core.utils because 'buddies_view' needs it.
 from core.utils import get_online_user_ids
+# Import frame_event from core.wire because 'check_for_match' sends pre-encoded notifications.
+from core.wire import frame_event
+# Import store_upload, schedule_image_processing from core.image_jobs because uploaded profile pictures are resized off the request path.
+from core.image_jobs import store_upload, schedule_image_processing
+# Import StoredImage from core.models because profile pictures are deduplicated by content.
+from core.models import StoredImage
+# Import accepts_image_uploads and upload_rejection from core.uploads because picture uploads are checked as they stream in.
+from core.uploads import accepts_image_uploads, upload_rejection
 
 User = get_user_model()
 
@@ -76,11 +87,11 @@ def check_for_match(user1, user2):
         channel_layer = get_channel_layer()
         
         group_name_1 = f'notifications_for_user_{user1.pk}'
-        message_1 = { 'type': 'send_notification', 'message': { 'text': f'You matched with {user2.first_name}!' } }
+        message_1 = frame_event('send_notification', { 'type': 'notification', 'message': { 'text': f'You matched with {user2.first_name}!' } })
         async_to_sync(channel_layer.group_send)(group_name_1, message_1) # RT: Pushes a live notification
         
         group_name_2 = f'notifications_for_user_{user2.pk}'
-        message_2 = { 'type': 'send_notification', 'message': { 'text': f'You matched with {user1.first_name}!' } }
+        message_2 = frame_event('send_notification', { 'type': 'notification', 'message': { 'text': f'You matched with {user1.first_name}!' } })
         async_to_sync(channel_layer.group_send)(group_name_2, message_2) # RT: Pushes a live notification
 
         return True
@@ -188,7 +199,8 @@ green "online" dots next to buddies.
 """
 @login_required
 def buddies_view(request):
-    buddy_list = request.user.buddies.all()
+    # The profile comes along because each row shows the buddy's main picture
+    buddy_list = request.user.buddies.select_related('profile')
     
     # Get filter and search parameters
     search_query = request.GET.get('search', '').strip()
@@ -224,9 +236,10 @@ def buddies_view(request):
     from rooms.models import Course
     user_courses = Course.objects.filter(students=request.user).exclude(slug='hang-out')
     
-    # Get or create message threads for each buddy (simple approach)
+    # Look up (or create) the chat thread with every buddy in one go
+    thread_ids = get_direct_thread_ids(request.user, buddy_list)
     for buddy in buddy_list:
-        buddy.message_thread = get_or_create_message_thread([request.user, buddy])
+        buddy.message_thread_id = thread_ids[buddy.pk]
     
     last_skipped = SkippedMatch.objects.filter(from_user=request.user)[:10]
 
@@ -326,8 +339,8 @@ def signup_view(request):
             user.save()
             
             try:
-                # Get ALL hidden tags
-                hidden_tags = Course.objects.filter(tag_type='hidden')
+                # Get ALL hidden tags (from the course catalog)
+                hidden_tags = catalog.ids_of_type('hidden')
                 user.courses.add(*hidden_tags)
             except Course.DoesNotExist:
                 pass
@@ -452,16 +465,36 @@ def get_profile_editor_context(request):
     profile = request.user.profile
     image_form = ProfileImageForm()
     profile_images = profile.images.order_by('-is_main', '-uploaded_at')
+    # The user's tags in one query; the course catalog says which are interests and which are courses
+    my_tags = set(request.user.courses.values_list('pk', flat=True))
     update_form = ProfileUpdateForm(instance=request.user, initial={
         'bio': profile.bio,
         'match_age_min': profile.match_age_min,
         'match_age_max': profile.match_age_max,
         # Pass both interests and courses to the form initial data
-        'interests': request.user.courses.filter(tag_type='interest'),
-        'courses': request.user.courses.filter(tag_type='course'),
+        'interests': [pk for pk in catalog.ids_of_type('interest') if pk in my_tags],
+        'courses': [pk for pk in catalog.ids_of_type('course') if pk in my_tags],
     })
     return {'image_form': image_form, 'update_form': update_form, 'profile_images': profile_images}
 
+"""
+Author: Evan
+Called by the image worker once a newly uploaded profile picture
+has been resized. It tells the owner's open tabs where the final
+file is, so the thumbnails in the profile editor can switch to it.
+RT: Sends an 'image_ready' message on the user's notification socket.
+"""
+def push_profile_image_ready(profile_image):
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        f'notifications_for_user_{profile_image.profile.user_id}',
+        frame_event('send_notification', {
+            'type': 'image_ready',
+            'image_id': profile_image.pk,
+            'image_url': profile_image.image.url,
+        })
+    )
+
 """
 Author: Evan
 This function handles the "Edit Profile" page. It does two
@@ -473,19 +506,29 @@ RT: When a user selects a picture, it's uploaded via an HTMX
 request, and this function sends back the updated
 HTML for the image gallery.
 """
+@accepts_image_uploads
 @login_required
 def edit_profile_view(request):
     profile = request.user.profile
     if request.method == 'POST':
-        if 'image' in request.FILES: # This is the RT (HTMX) part
+        # Pictures that are too big or not images were already dropped while uploading
+        rejection = upload_rejection(request, 'image')
+        if 'image' in request.FILES or rejection: # This is the RT (HTMX) part
             image_form = ProfileImageForm(request.POST, request.FILES)
-            if image_form.is_valid() and profile.images.count() < 5:
+            image_error = rejection
+            if not rejection and image_form.is_valid() and profile.images.count() < 5:
                 profile_image = image_form.save(commit=False)
                 profile_image.profile = profile
                 if profile.images.count() == 0:
                     profile_image.is_main = True
-                profile_image.save()
+                # Stored as uploaded (or reused if seen before); a worker resizes it after we've answered
+                sha256 = store_upload(profile_image, request.FILES['image'], StoredImage.KIND_PROFILE)
+                if sha256:
+                    schedule_image_processing(profile_image, StoredImage.KIND_PROFILE, sha256, push_profile_image_ready)
+            elif not rejection:
+                image_error = ' '.join(image_form.errors.get('image', []))
             context = get_profile_editor_context(request)
+            context['image_error'] = image_error
             # RT: This sends back an HTML partial for HTMX to swap
             return render(request, 'accounts/partials/profile_editor.html', context)
         else: # This is the standard (non-RT) form part
@@ -7,6 +7,18 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 django_asgi_app = get_asgi_application()
 
+from django.conf import settings
+from core.wire import enable_permessage_deflate
+
+# Compress WebSocket frames (must happen before Daphne builds its factory)
+if settings.WEBSOCKET_PERMESSAGE_DEFLATE:
+    enable_permessage_deflate()
+
+# Delete expired live sessions in the background, if it's switched on
+if settings.SESSION_CLEANUP_INTERVAL:
+    from rooms.cleanup import start_session_cleanup
+    start_session_cleanup(settings.SESSION_CLEANUP_INTERVAL)
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from rooms import routing as rooms_routing
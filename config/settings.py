@@ -57,6 +57,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'messaging.context_processors.pending_invites_count',
+                'core.context_processors.websocket_protocol',
             ],
         },
     },
@@ -78,6 +79,57 @@ CHANNEL_LAYERS = {
     },
 }
 
+# The cache is Redis too, shared by every server process. Besides caching, it
+# holds state that has to be the same everywhere: who is online and unread
+# totals, room viewer counts (rooms/viewers.py), the course catalog version
+# (rooms/catalog.py) and the session cleanup lock (rooms/cleanup.py). The
+# keys that must not be lost are stored without an expiry, so run Redis with
+# maxmemory-policy 'noeviction' or 'volatile-lru'; 'allkeys-*' policies would
+# evict them. (The viewer counts expire on purpose, and open sockets write
+# them again every VIEWER_WINDOW seconds, so losing one costs at most that.)
+# Rendered thread and post HTML (rooms/fragments.py) goes to its own 'fragments'
+# cache, so the many fragment writes never push those keys out. It can point
+# at a separate Redis with FRAGMENT_CACHE_URL; its keys all expire, so any
+# eviction policy works there.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL', 'redis://127.0.0.1:6379'),
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('FRAGMENT_CACHE_URL', os.getenv('REDIS_URL', 'redis://127.0.0.1:6379')),
+        'KEY_PREFIX': 'fragments',
+    },
+}
+
+# WebSocket wire format. Browsers can opt in to compact MessagePack frames
+# when this is on; everyone else keeps getting JSON (see core/wire.py).
+WEBSOCKET_BINARY_PROTOCOL = os.getenv('WEBSOCKET_BINARY_PROTOCOL', '0') == '1'
+# Accept the browser's permessage-deflate offer so frames are compressed.
+WEBSOCKET_PERMESSAGE_DEFLATE = os.getenv('WEBSOCKET_PERMESSAGE_DEFLATE', '1') == '1'
+
+# Chat messages older than this are moved to the archive table by
+# 'python manage.py archive_messages' (see messaging/archive.py).
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv('MESSAGE_ARCHIVE_AFTER_DAYS', '180'))
+
+# How often (in seconds) the ASGI server deletes expired live sessions by
+# itself (see rooms/cleanup.py). 0 leaves it to 'python manage.py cleanup_sessions'.
+SESSION_CLEANUP_INTERVAL = int(os.getenv('SESSION_CLEANUP_INTERVAL', '0'))
+
+# Uploaded images are resized by a small pool of worker processes after the
+# upload request returns (see core/image_jobs.py). Set IMAGE_PROCESSING_ASYNC=0
+# to resize inside the request instead.
+IMAGE_PROCESSING_ASYNC = os.getenv('IMAGE_PROCESSING_ASYNC', '1') == '1'
+IMAGE_WORKER_PROCESSES = int(os.getenv('IMAGE_WORKER_PROCESSES', '2'))
+# Uploads waiting for a worker beyond this are resized in the request.
+IMAGE_QUEUE_LIMIT = int(os.getenv('IMAGE_QUEUE_LIMIT', '32'))
+# Image uploads are checked as they stream in (see core/uploads.py): anything
+# bigger than IMAGE_UPLOAD_MAX_BYTES is dropped, and uploads are kept in memory
+# only up to IMAGE_UPLOAD_MEMORY_SIZE bytes before going to a temporary file.
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv('IMAGE_UPLOAD_MAX_BYTES', str(15 * 1024 * 1024)))
+IMAGE_UPLOAD_MEMORY_SIZE = int(os.getenv('IMAGE_UPLOAD_MEMORY_SIZE', str(256 * 1024)))
+
 AUTH_USER_MODEL = 'accounts.User'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -99,10 +151,16 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media' 
 
+# Where uploaded media lives: 'cloudinary' (hosted), or 'local' to keep files in
+# MEDIA_ROOT, named by content hash and served by core.views.media_view
+# (no network needed, e.g. for development, tests and benchmarks).
+MEDIA_STORAGE = os.getenv('MEDIA_STORAGE', 'cloudinary')
+
 # --- FIX 2: SEPARATE STORAGE CONFIG ---
 STORAGES = {
     "default": {
-        "BACKEND": "cloudinary_storage.storage.MediaCloudinaryStorage",
+        "BACKEND": "core.storage.ContentAddressedStorage" if MEDIA_STORAGE == 'local'
+        else "core.storage_cloudinary.CachedMediaCloudinaryStorage",
     },
     "staticfiles": {
         "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
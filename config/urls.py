@@ -5,11 +5,13 @@ from django.urls import path, include
 from django.conf import settings
 from django.http import HttpResponse
 from .views import home_view
+from core.views import websocket_limits_view, media_view
 from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('healthz/', lambda r: HttpResponse("ok", content_type="text/plain")),
+    path('healthz/ws-limits/', websocket_limits_view, name='websocket_limits'),
     
     # App URLs
     path('', home_view, name='home'),
@@ -19,5 +21,8 @@ urlpatterns = [
 ]
 
 # Local media serving
-if settings.DEBUG:
+if settings.MEDIA_STORAGE == 'local':
+    # Local media is served by Django with far-future cache headers (see core/storage.py)
+    urlpatterns += [path(f"{settings.MEDIA_URL.strip('/')}/<path:name>", media_view, name='media')]
+elif settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -8,9 +8,13 @@ Author: Evan
 This class tells Django that an app named "core" exists.
 This app is often used for essential, project-wide code
 (like the 'utils.py' file) that doesn't belong to just one
-feature like 'accounts' or 'rooms'.
+feature like 'accounts' or 'rooms'. Its "ready" function imports
+'signals.py', which keeps the reference counts of shared image files
+up to date when images are deleted.
 """
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
 
+    def ready(self):
+        import core.signals
@@ -0,0 +1,25 @@
+# core/context_processors.py
+
+# Import the wire settings from .wire because the browser needs the same subprotocol and field codes as the server.
+from .wire import binary_protocol_enabled, MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL, FIELD_CODES, TYPE_CODES
+
+"""
+Author: Evan
+This context processor tells 'base.html' whether the compact
+MessagePack WebSocket protocol is switched on. If it is, the page
+gets the subprotocol names and the short field codes, and 'main.js'
+uses them to open its sockets in binary mode. If not, nothing is
+added and the browser keeps using JSON.
+RT: Passes the real-time wire format settings to the browser.
+"""
+def websocket_protocol(request):
+    if not request.user.is_authenticated or not binary_protocol_enabled():
+        return {}
+    return {
+        'ws_protocol': {
+            'binary': MSGPACK_SUBPROTOCOL,
+            'json': JSON_SUBPROTOCOL,
+            'fields': FIELD_CODES,
+            'types': TYPE_CODES,
+        }
+    }
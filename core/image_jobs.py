@@ -0,0 +1,285 @@
+# core/image_jobs.py
+
+# Import os because processed images get a '.jpg' name built from the upload's name.
+import os
+# Import hashlib because uploads are identified by the SHA-256 of their bytes.
+import hashlib
+# Import threading because the job queue is bounded with a semaphore shared by request threads.
+import threading
+# Import multiprocessing because the worker processes are started with 'spawn' (forking a running server is unsafe).
+import multiprocessing
+# Import the executors from concurrent.futures because decoding runs in processes and bookkeeping in threads.
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+# Import BrokenProcessPool from concurrent.futures.process because a crashed worker leaves the pool unusable.
+from concurrent.futures.process import BrokenProcessPool
+# Import settings from django.conf because the pool size and queue limit are settings.
+from django.conf import settings
+# Import ContentFile from django.core.files.base because processed bytes are saved through the storage backend.
+from django.core.files.base import ContentFile
+# Import connections and transaction from django.db because jobs start after the upload commits and run on their own threads.
+from django.db import connections, transaction
+# Import F from django.db.models because reference counts are changed in the database, not in Python.
+from django.db.models import F
+# Import process_image from .imaging because it is the work done in the worker processes.
+from .imaging import (
+    process_image, derivative_name, image_file_names,
+    PROFILE_IMAGE_MAX_SIZE, PROFILE_IMAGE_SIZES, CHAT_IMAGE_MAX_SIZE, CHAT_IMAGE_SIZES,
+)
+# Import StoredImage from .models because processed files are shared between uploads with the same bytes.
+from .models import StoredImage
+
+# (max size, derivative sizes) for each kind of upload.
+IMAGE_KINDS = {
+    StoredImage.KIND_PROFILE: (PROFILE_IMAGE_MAX_SIZE, PROFILE_IMAGE_SIZES),
+    StoredImage.KIND_CHAT: (CHAT_IMAGE_MAX_SIZE, CHAT_IMAGE_SIZES),
+}
+
+# Created on first use, so processes that never see an upload never start workers.
+process_pool = None
+job_threads = None
+queue_slots = None
+pools_lock = threading.Lock()
+
+
+# Starts the worker processes (and the threads that wait on them) the first time they're needed.
+def get_pools():
+    global process_pool, job_threads, queue_slots
+    with pools_lock:
+        if process_pool is None:
+            workers = settings.IMAGE_WORKER_PROCESSES
+            process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            job_threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-job')
+            queue_slots = threading.BoundedSemaphore(settings.IMAGE_QUEUE_LIMIT)
+    return process_pool, job_threads, queue_slots
+
+
+# Replaces a pool whose worker died (e.g. killed for running out of memory).
+def replace_broken_pool(broken):
+    global process_pool
+    with pools_lock:
+        if process_pool is broken:
+            process_pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_WORKER_PROCESSES, mp_context=multiprocessing.get_context('spawn')
+            )
+        return process_pool
+
+
+# SHA-256 of an uploaded file, read in chunks (the file is rewound afterwards).
+# Files received by core.uploads.ImageUploadHandler were hashed on the way in.
+def hash_upload(upload):
+    if getattr(upload, 'sha256', None):
+        return upload.sha256
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+"""
+Author: Angie
+Saves a new 'ProfileImage' or 'Message' ('instance') with an uploaded
+image. If the same bytes were already processed for this 'kind', the
+row just points at that 'StoredImage' (one more reference) and is
+ready at once. Otherwise the raw upload is stored, the row is marked
+'image_pending', and the upload's hash is returned: the caller then
+passes it to 'schedule_image_processing'. Returns None when reused.
+"""
+def store_upload(instance, upload, kind):
+    sha256 = hash_upload(upload)
+    with transaction.atomic():
+        if reuse_stored_image(instance, sha256, kind):
+            instance.save()
+            return None
+    instance.image = upload
+    instance.image_pending = True
+    instance.save()
+    return sha256
+
+
+# Points 'instance' at the already processed file for 'sha256', if there is one, and
+# takes a reference to it (the caller saves 'instance' in the same transaction).
+def reuse_stored_image(instance, sha256, kind):
+    if not StoredImage.objects.filter(sha256=sha256, kind=kind).update(ref_count=F('ref_count') + 1):
+        return False
+    stored = StoredImage.objects.get(sha256=sha256, kind=kind)
+    instance.image = stored.name
+    instance.image_variants = stored.variants
+    instance.stored_image = stored
+    instance.image_pending = False
+    return True
+
+
+"""
+Author: Angie
+Resizes the image of a saved 'ProfileImage' or 'Message' outside the
+upload request. Once the upload has committed this queues a job that
+decodes, resizes and re-encodes the image in a worker process (along
+with its smaller WebP/JPEG copies, see 'process_image'), swaps the
+result into the row (deleting the raw file), registers it as the
+'StoredImage' for 'sha256' so later uploads of the same bytes can
+reuse it, and then calls 'on_ready(instance)' so the app can push the
+final image to browsers.
+
+At most IMAGE_QUEUE_LIMIT jobs wait at once. When the queue is full,
+or IMAGE_PROCESSING_ASYNC is off, the job runs right here in the
+request instead, which is slower but never loses an image.
+RT: Keeps Pillow off the request path of chat and profile uploads.
+"""
+def schedule_image_processing(instance, kind, sha256, on_ready):
+    model, pk = type(instance), instance.pk
+
+    def submit():
+        if not settings.IMAGE_PROCESSING_ASYNC:
+            run_image_job(model, pk, kind, sha256, on_ready)
+            return
+        _, threads, slots = get_pools()
+        if not slots.acquire(blocking=False):
+            run_image_job(model, pk, kind, sha256, on_ready)
+            return
+        future = threads.submit(run_image_job, model, pk, kind, sha256, on_ready, True)
+        future.add_done_callback(lambda _: slots.release())
+
+    transaction.on_commit(submit)
+
+
+"""
+Does one image job (see 'schedule_image_processing'). The image is
+processed in the worker processes when 'in_pool' is set, otherwise in
+this thread. The derivatives are stored under fixed names next to the
+main image (see 'derivative_name') and listed in 'image_variants',
+together with the names the storage actually saved them under.
+If anything goes wrong the raw upload is kept and shown as it is.
+'sha256' may be None (e.g. when rebuilding derivatives of old images),
+in which case the result isn't registered for reuse.
+"""
+def run_image_job(model, pk, kind, sha256, on_ready, in_pool=False):
+    max_size, sizes = IMAGE_KINDS[kind]
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is None or not instance.image:
+            return  # Deleted before we got to it
+
+        raw_name = instance.image.name
+        # Another upload of the same bytes may have finished while this one waited
+        # (with content-named storage the two even share the raw file)
+        if sha256 and finish_from_stored_image(instance, sha256, kind, raw_name, on_ready):
+            return
+
+        try:
+            with instance.image.open('rb') as source:
+                data = source.read()
+            if in_pool:
+                pool = get_pools()[0]
+                try:
+                    result = pool.submit(process_image, data, max_size, sizes).result()
+                except BrokenProcessPool:
+                    # One retry on a fresh pool; a second crash means it's this image
+                    result = replace_broken_pool(pool).submit(process_image, data, max_size, sizes).result()
+            else:
+                result = process_image(data, max_size, sizes)
+        except FileNotFoundError:
+            # The shared raw file was removed by the job that finished first
+            if sha256 and finish_from_stored_image(instance, sha256, kind, raw_name, on_ready):
+                return
+            print(f"Error optimizing image: {raw_name} is missing")
+            result = None
+        except Exception as e:
+            print(f"Error optimizing image: {e}")
+            result = None
+
+        if result is not None:
+            main, width, copies, made = result
+            if main is not None:
+                new_name = os.path.splitext(os.path.basename(raw_name))[0] + '.jpg'
+                instance.image.save(new_name, ContentFile(main), save=False)
+            files = save_derivatives(instance.image, copies)
+            instance.image_variants = {'width': width, 'sizes': made, 'files': files}
+        instance.image_pending = False
+        duplicate = None
+        if result is not None and sha256:
+            duplicate = register_stored_image(instance, sha256, kind)
+        instance.save(update_fields=['image', 'image_pending', 'image_variants', 'stored_image'])
+        if instance.image.name != raw_name:
+            instance.image.storage.delete(raw_name)
+        if duplicate:
+            delete_image_files(instance.image.storage, *duplicate)
+        on_ready(instance)
+    except Exception as e:
+        print(f"Error finishing image upload: {e}")
+    finally:
+        if in_pool:
+            # Job threads live on between jobs; don't leave their connections open
+            connections.close_all()
+
+
+# Finishes a job by reusing the processed file for 'sha256' if it exists. Returns True if so.
+def finish_from_stored_image(instance, sha256, kind, raw_name, on_ready):
+    with transaction.atomic():
+        if not reuse_stored_image(instance, sha256, kind):
+            return False
+        instance.save(update_fields=['image', 'image_pending', 'image_variants', 'stored_image'])
+    if instance.image.name != raw_name:
+        instance.image.storage.delete(raw_name)
+    on_ready(instance)
+    return True
+
+
+# Writes the derivative files of 'image' (a stored FieldFile) under their fixed names.
+# Returns {'<size>.<fmt>': name saved under}, since the storage may change the name
+# (see core.imaging.stored_derivative_name).
+def save_derivatives(image, copies):
+    storage = image.storage
+    files = {}
+    for (size, fmt), content in copies.items():
+        name = derivative_name(image.name, size, fmt)
+        # Overwrite, so storages that keep names keep exactly this one
+        storage.delete(name)
+        files[f'{size}.{fmt}'] = storage.save(name, ContentFile(content))
+    return files
+
+
+"""
+Records 'instance's freshly processed image as the shared file for
+'sha256' (with one reference). If another upload of the same bytes
+finished first, 'instance' is switched over to that file instead and
+the (name, variants) of its own copy are returned for deletion.
+"""
+def register_stored_image(instance, sha256, kind):
+    stored, created = StoredImage.objects.get_or_create(
+        sha256=sha256, kind=kind,
+        defaults={'name': instance.image.name, 'variants': instance.image_variants, 'ref_count': 1},
+    )
+    instance.stored_image = stored
+    if created:
+        return None
+    StoredImage.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') + 1)
+    duplicate = (instance.image.name, instance.image_variants)
+    instance.image = stored.name
+    instance.image_variants = stored.variants
+    # With content-named storage (core/storage.py) both uploads wrote the same file
+    return duplicate if duplicate[0] != stored.name else None
+
+
+"""
+Drops one reference to a 'StoredImage' (called when a row using it is
+deleted, see core/signals.py). When nothing uses the file any more,
+the row goes and, once that has committed, its files are removed from
+storage.
+"""
+def release_stored_image(stored_image_id, storage):
+    with transaction.atomic():
+        stored = StoredImage.objects.select_for_update().filter(pk=stored_image_id).first()
+        if stored is None:
+            return
+        if stored.ref_count > 1:
+            StoredImage.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') - 1)
+            return
+        stored.delete()
+    transaction.on_commit(lambda: delete_image_files(storage, stored.name, stored.variants))
+
+
+# Deletes a processed image and all of its size variants from storage.
+def delete_image_files(storage, name, variants):
+    for file_name in image_file_names(name, variants):
+        storage.delete(file_name)
@@ -0,0 +1,172 @@
+# core/imaging.py
+
+# Import math because JPEG draft sizes are rounded up, never down.
+import math
+# Import os because derivative file names are built from the main image's name.
+import os
+# Import BytesIO from io because images are decoded from and encoded to bytes in memory.
+from io import BytesIO
+# Import Image and ImageOps from PIL because Pillow does the decoding, resizing, rotating and encoding.
+from PIL import Image, ImageOps
+
+# Longest side of a stored image, by kind of upload.
+PROFILE_IMAGE_MAX_SIZE = (800, 800)
+CHAT_IMAGE_MAX_SIZE = (1024, 1024)
+# Smaller copies made of every upload (longest side in pixels). Avatars in the
+# buddy list and header use 64, cards and thumbnails 256, and chat bubbles 800.
+PROFILE_IMAGE_SIZES = (64, 256)
+CHAT_IMAGE_SIZES = (256, 800)
+# Encoder settings. WebP is what browsers get; JPEG is the fallback.
+JPEG_QUALITY = 75
+WEBP_QUALITY = 72
+# Name of the WebP copy of the full-size image (the others are named by size).
+FULL_SIZE = 'full'
+# Uploads with more pixels than this are refused (a 12MP phone photo is 12,000,000).
+MAX_IMAGE_PIXELS = 40_000_000
+# The only formats uploads may be in.
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+# Non-JPEG images are reduced to no less than this many times their final size
+# before the LANCZOS pass (Pillow's docs: 3 or more looks the same as a full resize).
+REDUCING_GAP = 3
+# EXIF tag that says which way up the camera was held.
+EXIF_ORIENTATION = 0x0112
+
+
+"""
+Author: Angie
+Raised for uploads that are not images Pillow can read (in one of
+ALLOWED_FORMATS), or that have more pixels than MAX_IMAGE_PIXELS.
+Both checks only need the file's header, so a decompression bomb is
+turned away before it is decoded.
+"""
+class ImageRejected(ValueError):
+    pass
+
+
+# The ImageRejected for images over the pixel budget.
+class ImageTooLarge(ImageRejected):
+    pass
+
+
+# Raises ImageTooLarge if a 'width' x 'height' image is over the pixel budget.
+def check_pixel_budget(width, height):
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(f'Image is too large ({width}x{height} pixels).')
+
+
+# Opens an image without decoding it and checks it against the pixel budget.
+def open_image(source):
+    try:
+        img = Image.open(source, formats=ALLOWED_FORMATS)
+    except Image.DecompressionBombError:
+        raise ImageTooLarge('Image is too large.')
+    except OSError as e:
+        raise ImageRejected(f'Not a readable image ({e}).')
+    check_pixel_budget(img.width, img.height)
+    return img
+
+
+# Checks an uploaded file (a Django UploadedFile) before anything is stored. Raises ImageRejected.
+def inspect_upload(upload):
+    try:
+        open_image(upload)
+    finally:
+        upload.seek(0)
+
+
+"""
+Author: Angie
+Decodes an image straight to roughly the size it will be shown at.
+For JPEGs 'draft' makes the decoder itself scale down by 1/2, 1/4 or
+1/8 while decoding (averaging in the DCT domain, like a box filter),
+never below the final size, so a 12MP phone photo never exists in
+memory at full size. Other formats are first shrunk by a whole factor
+('reduce') to no less than REDUCING_GAP times the final size. A
+LANCZOS pass then makes the exact size. EXIF orientation is applied
+once, on the small image, and the EXIF data (which may include the
+GPS position) is not carried over.
+Returns (image that fits inside 'max_size', True if anything changed).
+"""
+def decode_to_size(img, max_size):
+    orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+    too_big = img.width > max_size[0] or img.height > max_size[1]
+    if too_big and img.format == 'JPEG':
+        scale = min(max_size[0] / img.width, max_size[1] / img.height)
+        img.draft('RGB', (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    if img.mode != 'RGB':
+        # Convert to RGB if it's not (e.g. PNG with alpha or CMYK) to save as JPEG/WebP
+        img = img.convert('RGB')
+    if too_big:
+        img.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    if orientation != 1:
+        img = ImageOps.exif_transpose(img)
+    return img, too_big or orientation != 1
+
+
+"""
+Author: Angie
+Turns an uploaded image into everything that gets stored for it:
+  - the main image, shrunk to fit inside 'max_size' and re-encoded as
+    JPEG (None if it was already small and upright enough to keep as
+    uploaded),
+  - a WebP copy of the main image ('full'),
+  - a WebP and a JPEG copy at each of 'sizes' that is smaller than
+    the main image.
+Returns (main JPEG bytes or None, width of the main image,
+{(size, format): bytes}, [[size, width], ...] for the copies made).
+Copies are made from the already shrunk image, largest first, so
+each one only resamples a few hundred pixels.
+Raises ImageRejected for unreadable or oversized images.
+This module only imports Pillow (no Django), because the function
+runs inside the image worker processes (see core/image_jobs.py).
+"""
+def process_image(data, max_size, sizes=()):
+    img, changed = decode_to_size(open_image(BytesIO(data)), max_size)
+    main = encode(img, 'jpg') if changed else None
+    width = img.width
+
+    copies = {(FULL_SIZE, 'webp'): encode(img, 'webp')}
+    made = []
+    for size in sorted(sizes, reverse=True):
+        if size >= max(img.width, img.height):
+            continue
+        img = img.copy()
+        img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        copies[(size, 'webp')] = encode(img, 'webp')
+        copies[(size, 'jpg')] = encode(img, 'jpg')
+        made.append([size, img.width])
+    made.reverse()
+    return main, width, copies, made
+
+
+# Encodes 'img' as 'jpg' or 'webp' with the settings above.
+def encode(img, fmt):
+    output = BytesIO()
+    if fmt == 'webp':
+        img.save(output, format='WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        img.save(output, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+# Storage name of one derivative, next to the main image:
+# 'chat_images/cat_x1.jpg' -> 'chat_images/cat_x1/256.webp'.
+def derivative_name(image_name, size, fmt):
+    return f'{os.path.splitext(image_name)[0]}/{size}.{fmt}'
+
+
+# Storage name one derivative was actually saved under. Storages may store a file
+# under another name than asked (Cloudinary adds a random suffix), so the names
+# 'save()' returned are kept in the variants' 'files'; images processed before
+# that have none, and were stored under 'derivative_name'.
+def stored_derivative_name(image_name, variants, size, fmt):
+    files = (variants or {}).get('files') or {}
+    return files.get(f'{size}.{fmt}') or derivative_name(image_name, size, fmt)
+
+
+# Storage names of a processed image and all of its size variants.
+def image_file_names(image_name, variants):
+    names = [image_name, stored_derivative_name(image_name, variants, FULL_SIZE, 'webp')]
+    for size, _ in (variants or {}).get('sizes', []):
+        names += [stored_derivative_name(image_name, variants, size, fmt) for fmt in ('webp', 'jpg')]
+    return names
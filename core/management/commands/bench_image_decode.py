@@ -0,0 +1,155 @@
+# core/management/commands/bench_image_decode.py
+
+# Import os because the corpus is a folder of JPEG files.
+import os
+# Import time because decode time is measured with perf_counter.
+import time
+# Import resource because it gives peak memory where /proc doesn't exist.
+import resource
+# Import tempfile because a generated corpus is written to a temporary folder.
+import tempfile
+# Import multiprocessing because each pipeline runs in a fresh process, so peak memory isn't shared.
+import multiprocessing
+# Import BytesIO from io because uploads reach the pipeline as bytes.
+from io import BytesIO
+# Import ProcessPoolExecutor from concurrent.futures because it runs one pipeline per fresh worker.
+from concurrent.futures import ProcessPoolExecutor
+# Import Image and ImageFilter from PIL because the corpus is generated and the old pipeline is re-created here.
+from PIL import Image, ImageFilter
+# Import BaseCommand from django.core.management.base because custom management commands are based on it.
+from django.core.management.base import BaseCommand
+# Import the pipeline from core.imaging because the benchmark must measure the code uploads actually use.
+from core.imaging import (
+    open_image, decode_to_size, encode, process_image,
+    CHAT_IMAGE_MAX_SIZE, CHAT_IMAGE_SIZES, JPEG_QUALITY, EXIF_ORIENTATION,
+)
+
+
+# The resize that 'Message.save' used to do: full decode, RGB convert, LANCZOS, JPEG.
+def legacy_resize(data):
+    img = Image.open(BytesIO(data))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.thumbnail(CHAT_IMAGE_MAX_SIZE, Image.Resampling.LANCZOS)
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=JPEG_QUALITY)
+    return output.getvalue()
+
+
+# The same job with decoder-level reduction and EXIF orientation (core.imaging).
+def draft_resize(data):
+    img, _ = decode_to_size(open_image(BytesIO(data)), CHAT_IMAGE_MAX_SIZE)
+    return encode(img, 'jpg')
+
+
+# Everything an upload now goes through, size variants included.
+def full_pipeline(data):
+    return process_image(data, CHAT_IMAGE_MAX_SIZE, CHAT_IMAGE_SIZES)
+
+
+PIPELINES = {
+    'legacy': legacy_resize,
+    'draft': draft_resize,
+    'draft+variants': full_pipeline,
+}
+
+
+# Peak resident memory of this process in KB. Linux's 'ru_maxrss' survives exec, so a
+# spawned worker would report its parent's peak; 'VmHWM' belongs to the worker alone.
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# Runs one pipeline over the corpus inside a worker. Returns (ms per image, baseline KB, peak KB).
+def run_pipeline(name, paths, rounds):
+    pipeline = PIPELINES[name]
+    files = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            files.append(f.read())
+    baseline = peak_rss_kb()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in files:
+            pipeline(data)
+    elapsed = (time.perf_counter() - start) * 1000
+    peak = peak_rss_kb()
+    return elapsed / (rounds * len(files)), baseline, peak
+
+
+# Peak memory (KB above the worker's starting point) of 'process_image' on one upload.
+# Meant to run in a fresh worker, like the image workers that do it for real.
+def process_image_peak_kb(data, max_size, sizes):
+    baseline = peak_rss_kb()
+    process_image(data, max_size, sizes)
+    return peak_rss_kb() - baseline
+
+
+"""
+Author: Angie
+This command measures what resizing a phone photo costs, the old way
+(full decode, then LANCZOS) against the new way in core/imaging.py
+(JPEG draft decode straight to near the target size, then LANCZOS),
+run it with 'python manage.py bench_image_decode'. Point '--corpus'
+at a folder of real photos, or it generates 12MP JPEGs (half of them
+tagged as rotated, like portrait phone shots). Each pipeline runs in
+its own fresh process and reports milliseconds per image and the
+peak resident memory above the process's starting point.
+"""
+class Command(BaseCommand):
+    help = 'Benchmarks full-decode vs draft-decode image resizing (ms per image and peak RSS).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', help='Folder of JPEG files to use instead of generated ones.')
+        parser.add_argument('--count', type=int, default=8, help='Number of images to generate.')
+        parser.add_argument('--width', type=int, default=4000, help='Width of generated images.')
+        parser.add_argument('--height', type=int, default=3000, help='Height of generated images.')
+        parser.add_argument('--rounds', type=int, default=2, help='Times each pipeline goes through the corpus.')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as scratch:
+            if options['corpus']:
+                folder = options['corpus']
+                paths = [
+                    os.path.join(folder, name) for name in sorted(os.listdir(folder))
+                    if name.lower().endswith(('.jpg', '.jpeg'))
+                ]
+            else:
+                paths = self.make_corpus(scratch, options['count'], options['width'], options['height'])
+            if not paths:
+                self.stderr.write('No JPEG files found.')
+                return
+
+            megapixels = sum(Image.open(path).width * Image.open(path).height for path in paths) / len(paths) / 1e6
+            self.stdout.write(f'{len(paths)} images, {megapixels:.1f} MP on average, {options["rounds"]} round(s)')
+            self.stdout.write(f'{"pipeline":<16}{"ms/image":>10}{"peak RSS MB":>14}{"added MB":>10}')
+            context = multiprocessing.get_context('spawn')
+            for name in PIPELINES:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    per_image, baseline, peak = pool.submit(run_pipeline, name, paths, options['rounds']).result()
+                self.stdout.write(f'{name:<16}{per_image:>10.1f}{peak / 1024:>14.1f}{(peak - baseline) / 1024:>10.1f}')
+
+    # Writes 'count' photo-like JPEGs (smooth gradients plus grain) and returns their paths.
+    def make_corpus(self, folder, count, width, height):
+        paths = []
+        for index in range(count):
+            base = Image.merge('RGB', [
+                Image.linear_gradient('L').rotate(index * 40 + band * 120).resize((width, height))
+                for band in range(3)
+            ])
+            grain = Image.effect_noise((width, height), 24).convert('RGB')
+            img = Image.blend(base, grain, 0.15).filter(ImageFilter.SMOOTH)
+            exif = img.getexif()
+            if index % 2:
+                exif[EXIF_ORIENTATION] = 6  # Portrait shot: stored sideways, rotate 90 degrees
+            path = os.path.join(folder, f'photo_{index}.jpg')
+            img.save(path, format='JPEG', quality=90, exif=exif)
+            paths.append(path)
+        return paths
@@ -0,0 +1,333 @@
+# core/management/commands/bench_image_pipeline.py
+
+# Import json because results are written as JSON, to be compared between commits.
+import json
+# Import multiprocessing because memory is measured in fresh 'spawn' workers.
+import multiprocessing
+# Import platform because the results record which Python produced them.
+import platform
+# Import statistics because each timing is the median of several rounds.
+import statistics
+# Import subprocess because the results record the git commit they were measured on.
+import subprocess
+# Import tempfile because processed images are stored in a throwaway media folder.
+import tempfile
+# Import time because latency is measured with perf_counter.
+import time
+# Import BytesIO from io because the corpus is generated in memory.
+from io import BytesIO
+# Import ProcessPoolExecutor from concurrent.futures because each memory measurement gets its own process.
+from concurrent.futures import ProcessPoolExecutor
+# Import PIL and its modules because the corpus is drawn with Pillow and quality is scored with it.
+import PIL
+from PIL import Image, ImageDraw, ImageMath, ImageOps, features
+# Import the management base classes because this is a custom management command.
+from django.core.management.base import BaseCommand, CommandError
+# Import SimpleUploadedFile from django.core.files.uploadedfile because the corpus is handed over like uploads.
+from django.core.files.uploadedfile import SimpleUploadedFile
+# Import transaction from django.db because everything the benchmark writes is rolled back.
+from django.db import transaction
+# Import override_settings from django.test.utils because the benchmark uses its own local media storage.
+from django.test.utils import override_settings
+# Import the models because the benchmark goes through the same rows uploads create.
+from accounts.models import User, ProfileImage
+from messaging.models import Message, MessageThread
+from core.models import StoredImage
+# Import the upload path from core.image_jobs because it is exactly what the views run.
+from core.image_jobs import store_upload, run_image_job, IMAGE_KINDS
+# Import the encoder settings and naming from core.imaging because they are recorded and used to find outputs.
+from core.imaging import (
+    image_file_names, JPEG_QUALITY, WEBP_QUALITY,
+    PROFILE_IMAGE_MAX_SIZE, CHAT_IMAGE_MAX_SIZE, EXIF_ORIENTATION,
+)
+# Import process_image_peak_kb from .bench_image_decode because that module can run in a worker without Django set up.
+from .bench_image_decode import process_image_peak_kb
+
+# SSIM constants for 8-bit images (Wang et al. 2004).
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+# Metrics compared by '--compare', and whether a bigger number is worse.
+COMPARED_METRICS = {
+    'upload_ms': True,
+    'process_ms': True,
+    'peak_rss_kb': True,
+    'output_bytes': True,
+    'ssim_jpeg': False,
+    'ssim_webp': False,
+}
+# Largest SSIM drop '--compare' lets through (the percentage tolerance is for the rest).
+SSIM_TOLERANCE = 0.005
+# Timings that moved by less than this many ms are noise, whatever the percentage.
+TIME_NOISE_MS = 5
+
+
+# Mean SSIM of two images of the same size, on luma, over 8x8 windows (1.0 means identical).
+def ssim(first, second):
+    x = first.convert('L').convert('F')
+    y = second.convert('L').convert('F')
+    windows = (max(x.width // 8, 1), max(x.height // 8, 1))
+
+    def window_mean(img):
+        return img.resize(windows, Image.Resampling.BOX)
+
+    mx, my = window_mean(x), window_mean(y)
+    mxx = window_mean(ImageMath.lambda_eval(lambda a: a['x'] * a['x'], x=x))
+    myy = window_mean(ImageMath.lambda_eval(lambda a: a['y'] * a['y'], y=y))
+    mxy = window_mean(ImageMath.lambda_eval(lambda a: a['x'] * a['y'], x=x, y=y))
+    scores = ImageMath.lambda_eval(
+        lambda a: ((a['mx'] * a['my'] * 2 + SSIM_C1) * ((a['mxy'] - a['mx'] * a['my']) * 2 + SSIM_C2))
+        / ((a['mx'] * a['mx'] + a['my'] * a['my'] + SSIM_C1)
+           * (a['mxx'] - a['mx'] * a['mx'] + a['myy'] - a['my'] * a['my'] + SSIM_C2)),
+        mx=mx, my=my, mxx=mxx, myy=myy, mxy=mxy,
+    )
+    return statistics.fmean(scores.getdata())  # ImageStat doesn't do float images
+
+
+# A detailed, repeatable "photo": a Mandelbrot set in each channel at different zooms.
+def photo(width, height, mode='RGB'):
+    bands = [
+        Image.effect_mandelbrot((width, height), extent, 80)
+        for extent in ((-2.2, -1.2, 1.0, 1.2), (-1.8, -1.0, 0.6, 1.0), (-0.9, -0.4, -0.3, 0.1))
+    ]
+    img = Image.merge('RGB', bands)
+    return img if mode == 'RGB' else img.convert(mode)
+
+
+# Encodes 'img' to bytes in 'fmt' with Pillow's save options 'options'.
+def encode_as(img, fmt, **options):
+    output = BytesIO()
+    img.save(output, format=fmt, **options)
+    return output.getvalue()
+
+
+"""
+Author: Angie
+The generated corpus: (name, content type, bytes) for each kind of
+file people upload. It is the same on every run (no random noise), so
+output sizes and quality scores can be compared between commits.
+"""
+def build_corpus():
+    rotated = Image.Exif()
+    rotated[EXIF_ORIENTATION] = 6  # Portrait phone photo, stored sideways
+
+    alpha = photo(2000, 2000).convert('RGBA')
+    alpha.putalpha(Image.radial_gradient('L').resize((2000, 2000)))
+
+    icon = Image.new('P', (32, 32))
+    ImageDraw.Draw(icon).ellipse((4, 4, 28, 28), fill=1)
+    icon.putpalette([255, 255, 255, 220, 60, 40])
+
+    frames = [photo(400, 300).rotate(angle * 36) for angle in range(10)]
+
+    return [
+        ('photo_12mp.jpg', 'image/jpeg', encode_as(photo(4000, 3000), 'JPEG', quality=90, exif=rotated)),
+        ('photo_1600.webp', 'image/webp', encode_as(photo(1600, 1200), 'WEBP', quality=85)),
+        ('alpha_2000.png', 'image/png', encode_as(alpha, 'PNG')),
+        ('cmyk_2400.jpg', 'image/jpeg', encode_as(photo(2400, 1600, 'CMYK'), 'JPEG', quality=90)),
+        ('icon_32.png', 'image/png', encode_as(icon, 'PNG')),
+        ('animated_400.gif', 'image/gif', encode_as(frames[0], 'GIF', save_all=True, append_images=frames[1:], duration=80, loop=0)),
+    ]
+
+
+# The upright, full-quality version of an upload (what a perfect resize would start from).
+def reference_image(data):
+    img = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    return img.convert('RGB')
+
+
+"""
+Author: Angie
+This command benchmarks the whole image upload path on a generated
+corpus (a 12MP rotated JPEG, a WebP photo, a PNG with transparency, a
+CMYK JPEG, a tiny palette icon and an animated GIF), run it with
+'python manage.py bench_image_pipeline --output before.json'.
+Each file goes through 'store_upload' and 'run_image_job' (exactly
+what the profile and chat upload views do) as both a profile picture
+and a chat image. For each one it records:
+  - upload_ms: the part the upload request waits for,
+  - process_ms: the resize in the image job,
+  - peak_rss_kb: how much memory the resize takes in an image worker
+    (measured in a fresh process, see 'measure_peak_memory'),
+  - output_bytes: the main image plus all its size variants,
+  - ssim_jpeg / ssim_webp: how close the stored main image and its
+    WebP copy are to a full-quality resize of the upload (1.0 = same).
+Timings are the median of '--rounds' runs. Files go to a temporary
+folder and the database work is rolled back, so it can run against a
+development database.
+With '--compare before.json' it prints the change for every metric and
+fails if anything got worse by more than '--tolerance' percent (or the
+quality score dropped by more than SSIM_TOLERANCE).
+"""
+class Command(BaseCommand):
+    help = 'Benchmarks the image upload pipeline (latency, memory, output size, quality) and writes JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=3, help='Times each image is uploaded (timings are medians).')
+        parser.add_argument('--output', help='File to write the JSON results to.')
+        parser.add_argument('--compare', help='Earlier JSON results to compare against.')
+        parser.add_argument('--tolerance', type=float, default=15.0, help='Allowed slowdown/growth in percent.')
+
+    def handle(self, *args, **options):
+        corpus = build_corpus()
+        with tempfile.TemporaryDirectory() as media, override_settings(
+            STORAGES={
+                'default': {'BACKEND': 'core.storage.ContentAddressedStorage', 'OPTIONS': {'location': media}},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            IMAGE_PROCESSING_ASYNC=False,
+        ):
+            with transaction.atomic():
+                results = self.run_corpus(corpus, options['rounds'])
+                transaction.set_rollback(True)
+
+        report = {'environment': self.environment(options['rounds']), 'results': results}
+        self.print_table(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f'Results written to {options["output"]}')
+        if options['compare']:
+            with open(options['compare']) as f:
+                before = json.load(f)
+            self.compare(before['results'], results, options['tolerance'])
+
+    # Uploads every corpus file as each kind of image and measures it.
+    def run_corpus(self, corpus, rounds):
+        user = User.objects.create_user(email='image-bench@example.invalid', password=None, first_name='Bench', last_name='Mark')
+        thread = MessageThread.objects.create()
+        thread.participants.add(user)
+        owners = [
+            (StoredImage.KIND_PROFILE, lambda: ProfileImage(profile=user.profile, is_main=True)),
+            (StoredImage.KIND_CHAT, lambda: Message(thread=thread, sender=user)),
+        ]
+
+        results = []
+        for name, content_type, data in corpus:
+            reference = reference_image(data)
+            for kind, new_owner in owners:
+                upload_ms, process_ms = [], []
+                for round_number in range(rounds):
+                    instance = new_owner()
+                    upload = SimpleUploadedFile(name, data, content_type)
+                    start = time.perf_counter()
+                    sha256 = store_upload(instance, upload, kind)
+                    stored = time.perf_counter()
+                    run_image_job(type(instance), instance.pk, kind, sha256, on_ready=lambda instance: None)
+                    done = time.perf_counter()
+                    upload_ms.append((stored - start) * 1000)
+                    process_ms.append((done - stored) * 1000)
+
+                    instance.refresh_from_db()
+                    if round_number == rounds - 1:
+                        outputs = self.measure_outputs(instance, reference)
+                    # Deleting releases the shared file, so the next round processes it again
+                    instance.delete()
+
+                results.append({
+                    'image': name,
+                    'kind': kind,
+                    'source_bytes': len(data),
+                    'upload_ms': round(statistics.median(upload_ms), 2),
+                    'process_ms': round(statistics.median(process_ms), 2),
+                    'peak_rss_kb': self.measure_peak_memory(data, kind),
+                    **outputs,
+                })
+        return results
+
+    # Peak memory of the resize in a fresh worker process (a long-lived process keeps
+    # freed memory around, so measuring here would only show the first big image).
+    def measure_peak_memory(self, data, kind):
+        max_size, sizes = IMAGE_KINDS[kind]
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            return pool.submit(process_image_peak_kb, data, max_size, sizes).result()
+
+    # Output size and quality of a processed image.
+    def measure_outputs(self, instance, reference):
+        storage = instance.image.storage
+        name = instance.image.name
+        names = image_file_names(name, instance.image_variants)
+        output_bytes = sum(storage.size(file_name) for file_name in names if storage.exists(file_name))
+
+        with storage.open(name) as f:
+            main = Image.open(BytesIO(f.read()))
+            main.load()
+        main = ImageOps.exif_transpose(main).convert('RGB')
+        expected = reference.resize(main.size, Image.Resampling.LANCZOS)
+        ssim_webp = None
+        if storage.exists(names[1]):
+            with storage.open(names[1]) as f:
+                webp = Image.open(BytesIO(f.read())).convert('RGB')
+            ssim_webp = round(ssim(expected, webp), 4)
+        return {
+            'output_format': Image.open(storage.open(name)).format,
+            'output_size': list(main.size),
+            'variants': len(variants.get('sizes', [])),
+            'output_bytes': output_bytes,
+            'ssim_jpeg': round(ssim(expected, main), 4),
+            'ssim_webp': ssim_webp,
+        }
+
+    # What the numbers depend on besides the code: versions and encoder settings.
+    def environment(self, rounds):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            'commit': commit,
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'libjpeg_turbo': features.check_feature('libjpeg_turbo'),
+            'jpeg_quality': JPEG_QUALITY,
+            'webp_quality': WEBP_QUALITY,
+            'profile_max_size': list(PROFILE_IMAGE_MAX_SIZE),
+            'chat_max_size': list(CHAT_IMAGE_MAX_SIZE),
+            'rounds': rounds,
+        }
+
+    def print_table(self, results):
+        self.stdout.write(
+            f'{"image":<18}{"kind":<9}{"upload ms":>10}{"process ms":>11}{"peak MB":>9}'
+            f'{"out KB":>9}{"SSIM jpg":>10}{"SSIM webp":>10}'
+        )
+        for row in results:
+            peak = f'{row["peak_rss_kb"] / 1024:.1f}' if row['peak_rss_kb'] is not None else '-'
+            webp = f'{row["ssim_webp"]:.4f}' if row['ssim_webp'] is not None else '-'
+            self.stdout.write(
+                f'{row["image"]:<18}{row["kind"]:<9}{row["upload_ms"]:>10.1f}{row["process_ms"]:>11.1f}{peak:>9}'
+                f'{row["output_bytes"] / 1024:>9.1f}{row["ssim_jpeg"]:>10.4f}{webp:>10}'
+            )
+
+    # Prints the change in every metric and fails on regressions.
+    def compare(self, before, after, tolerance):
+        earlier = {(row['image'], row['kind']): row for row in before}
+        regressions = []
+        for row in after:
+            old = earlier.get((row['image'], row['kind']))
+            if old is None:
+                continue
+            for metric, bigger_is_worse in COMPARED_METRICS.items():
+                was, now = old.get(metric), row.get(metric)
+                if was is None or now is None:
+                    continue
+                if metric.startswith('ssim'):
+                    change = f'{now - was:+.4f}'
+                    worse = was - now > SSIM_TOLERANCE
+                else:
+                    percent = (now - was) / was * 100 if was else 0.0
+                    change = f'{percent:+.1f}%'
+                    worse = percent > tolerance if bigger_is_worse else -percent > tolerance
+                    if metric.endswith('_ms') and abs(now - was) < TIME_NOISE_MS:
+                        worse = False
+                label = f'{row["image"]} ({row["kind"]}) {metric}: {was} -> {now} ({change})'
+                if worse:
+                    regressions.append(label)
+                    self.stdout.write(self.style.ERROR(f'WORSE  {label}'))
+                else:
+                    self.stdout.write(f'       {label}')
+        if regressions:
+            raise CommandError(f'{len(regressions)} metric(s) got worse than allowed.')
+        self.stdout.write(self.style.SUCCESS('No regressions.'))
@@ -0,0 +1,105 @@
+# core/management/commands/bench_ws_protocol.py
+
+# Import json because JSON is the baseline wire format being measured.
+import json
+# Import random because the traffic mix is generated, not read from a database.
+import random
+# Import time because encoding CPU time is measured with perf_counter.
+import time
+# Import zlib because permessage-deflate is raw DEFLATE with a shared window per connection.
+import zlib
+# Import msgpack because it is the binary wire format being measured.
+import msgpack
+# Import BaseCommand from django.core.management.base because custom management commands are based on it.
+from django.core.management.base import BaseCommand
+# Import compact from core.wire because the benchmark must use the same field codes as the consumers.
+from core.wire import compact
+
+# A reply as it looks after 'post_item.html' is rendered (room broadcasts carry full HTML).
+POST_HTML = """
+<div class="card post-item" id="post-{pk}">
+  <div class="post-meta">
+    <strong>{name} replied:</strong>
+  </div>
+  <div class="post-content">
+    {text}
+  </div>
+</div>
+"""
+
+FIRST_NAMES = ['Ava', 'Ben', 'Chloe', 'Dev', 'Elena', 'Femi', 'Grace', 'Hiro']
+WORDS = 'exam tonight library notes chapter quiz review lab meet group problem set due friday'.split()
+
+
+"""
+Author: Oju
+This command measures what the WebSocket wire formats cost on a
+mixed stream of chat messages, typing events, presence updates and
+course room broadcasts (run it with 'python manage.py bench_ws_protocol').
+For each format it reports the bytes per frame before and after
+permessage-deflate, and the CPU time spent encoding when every
+recipient encodes its own copy (the old way) versus encoding once
+per broadcast (the way 'core.wire.frame_event' does it).
+RT: Benchmark for the real-time wire protocol.
+"""
+class Command(BaseCommand):
+    help = 'Benchmarks JSON vs MessagePack WebSocket frames on mixed chat, presence and room traffic.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--broadcasts', type=int, default=5000, help='Number of broadcasts to generate.')
+        parser.add_argument('--recipients', type=int, default=20, help='Connections that receive each broadcast.')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the traffic mix.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        recipients = options['recipients']
+        traffic = [self.make_payload(rng, seq) for seq in range(1, options['broadcasts'] + 1)]
+
+        encoders = {
+            'json': lambda payload: json.dumps(payload).encode(),
+            'msgpack': lambda payload: msgpack.packb(compact(payload)),
+        }
+
+        self.stdout.write(f'{len(traffic)} broadcasts x {recipients} recipients')
+        self.stdout.write(f'{"format":<10}{"raw B/frame":>14}{"deflate B/frame":>18}{"per-recipient ms":>19}{"once ms":>10}')
+        for name, encode in encoders.items():
+            frames = [encode(payload) for payload in traffic]
+            raw = sum(len(frame) for frame in frames) / len(frames)
+            deflated = self.deflated_size(frames) / len(frames)
+            per_recipient = self.time_encoding(encode, traffic, recipients)
+            once = self.time_encoding(encode, traffic, 1)
+            self.stdout.write(f'{name:<10}{raw:>14.1f}{deflated:>18.1f}{per_recipient:>19.1f}{once:>10.1f}')
+
+    # Builds one payload of the mix: 45% chat, 30% typing, 15% presence, 10% room HTML
+    def make_payload(self, rng, seq):
+        roll = rng.random()
+        name = rng.choice(FIRST_NAMES)
+        sender_id = rng.randint(1, 500)
+        if roll < 0.45:
+            text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 20)))
+            return {'type': 'chat_message', 'message': text, 'image_url': None,
+                    'sender_id': sender_id, 'sender_first_name': name, 'seq': seq}
+        if roll < 0.75:
+            return {'type': 'typing', 'sender_id': sender_id, 'sender_first_name': name}
+        if roll < 0.90:
+            return {'type': 'presence_update', 'user_pk': sender_id, 'status': rng.choice(['online', 'offline'])}
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 60)))
+        html = POST_HTML.format(pk=seq, name=name, text=text)
+        return {'type': 'broadcast_message', 'html': html, 'message_type': 'new_post'}
+
+    # Compresses the frames the way one permessage-deflate connection does: a single
+    # raw DEFLATE stream, flushed after every message, minus the 4 byte flush marker.
+    def deflated_size(self, frames):
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        total = 0
+        for frame in frames:
+            total += len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+        return total
+
+    # Milliseconds spent encoding all of the traffic, each payload 'copies' times.
+    def time_encoding(self, encode, traffic, copies):
+        start = time.perf_counter()
+        for payload in traffic:
+            for _ in range(copies):
+                encode(payload)
+        return (time.perf_counter() - start) * 1000
@@ -0,0 +1,49 @@
+# core/management/commands/build_image_derivatives.py
+
+# Import BaseCommand from django.core.management.base because custom management commands are based on it.
+from django.core.management.base import BaseCommand
+# Import ProfileImage from accounts.models because profile pictures get derivatives.
+from accounts.models import ProfileImage
+# Import Message from messaging.models because chat images get derivatives.
+from messaging.models import Message
+# Import run_image_job from core.image_jobs because it is the same job uploads go through.
+from core.image_jobs import run_image_job
+# Import StoredImage from core.models because its kinds pick the sizes for each model.
+from core.models import StoredImage
+
+"""
+Author: Angie
+This command ('python manage.py build_image_derivatives') makes the
+smaller WebP/JPEG copies for images uploaded before uploads started
+producing them. It goes through the images in id order, one at a
+time, and can be stopped and re-run at any time (images that already
+have their copies are skipped).
+"""
+class Command(BaseCommand):
+    help = 'Creates the WebP/JPEG size variants for older profile and chat images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Images looked up per query.')
+
+    def handle(self, *args, **options):
+        jobs = [
+            (ProfileImage, StoredImage.KIND_PROFILE),
+            (Message, StoredImage.KIND_CHAT),
+        ]
+        for model, kind in jobs:
+            done = 0
+            last_pk = 0
+            while True:
+                pks = list(
+                    model.objects.filter(pk__gt=last_pk, image_variants={}, image_pending=False)
+                    .exclude(image='').exclude(image=None)
+                    .order_by('pk').values_list('pk', flat=True)[:options['batch_size']]
+                )
+                if not pks:
+                    break
+                for pk in pks:
+                    run_image_job(model, pk, kind, None, on_ready=lambda instance: None)
+                done += len(pks)
+                last_pk = pks[-1]
+                self.stdout.write(f'{model.__name__}: processed {done} image(s), up to id {last_pk}')
+            self.stdout.write(self.style.SUCCESS(f'{model.__name__}: done, {done} image(s) processed.'))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64)),
+                ('kind', models.CharField(choices=[('profile', 'Profile image'), ('chat', 'Chat image')], max_length=10)),
+                ('name', models.CharField(max_length=255)),
+                ('variants', models.JSONField(blank=True, default=dict)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('sha256', 'kind'), name='unique_stored_image_hash')],
+            },
+        ),
+    ]
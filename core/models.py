@@ -1,3 +1,42 @@
+# core/models.py
+
+# Import models from django.db because this file defines database models.
 from django.db import models
 
-# Create models here.
+"""
+Author: Angie
+One processed image file, shared by every upload with the same bytes.
+Uploads are hashed (SHA-256) as they come in; if an image with that
+hash was already processed for the same 'kind' (profile pictures and
+chat images are resized differently), the new 'ProfileImage' or
+'Message' simply points at this file and its size variants instead of
+going through Pillow and storage again.
+'ref_count' is how many rows (profile images, live and archived
+messages) point at the file. It only reaches zero when the last one
+is deleted, and only then are the files removed from storage (see
+core/signals.py).
+"""
+class StoredImage(models.Model):
+    KIND_PROFILE = 'profile'
+    KIND_CHAT = 'chat'
+    KIND_CHOICES = (
+        (KIND_PROFILE, 'Profile image'),
+        (KIND_CHAT, 'Chat image'),
+    )
+
+    sha256 = models.CharField(max_length=64)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Storage name of the processed main image
+    name = models.CharField(max_length=255)
+    # Same format as 'image_variants' on the models that use the file
+    variants = models.JSONField(default=dict, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sha256', 'kind'], name='unique_stored_image_hash'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} image {self.sha256[:12]} ({self.ref_count} refs)"
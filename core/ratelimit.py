@@ -0,0 +1,146 @@
+# core/ratelimit.py
+
+# Import time because token buckets refill according to a monotonic clock.
+import time
+# Import Counter from collections because each limit keeps a count of how often it fired.
+from collections import Counter
+
+# Token bucket settings for frames coming *from* the browser, by message type:
+# (tokens added per second, bucket size). Each connection gets its own buckets.
+CONNECTION_LIMITS = {
+    'chat_message': (1, 5),
+    'typing': (10, 20),
+    'read': (4, 10),
+    'resume': (0.2, 3),
+    'webrtc_offer': (0.5, 3),
+    'webrtc_answer': (0.5, 3),
+    'webrtc_ice_candidate': (10, 40),
+    'webrtc_hangup': (0.5, 3),
+}
+# Used for any other message type (they all share the 'other' bucket).
+DEFAULT_CONNECTION_LIMIT = (5, 10)
+
+# Buckets shared by all of a user's connections in this process, so opening
+# more tabs doesn't multiply how much a user can send.
+USER_LIMITS = {
+    'chat_message': (2, 10),
+    'webrtc_ice_candidate': (20, 80),
+}
+
+# Rejected frames are themselves limited: a client may be rejected in bursts
+# of up to REJECTIONS_BEFORE_CLOSE, recovering REJECTIONS_PER_SECOND. Going past
+# that means it ignores the limits, and the connection is closed.
+REJECTIONS_PER_SECOND = 1
+REJECTIONS_BEFORE_CLOSE = 100
+
+# How many times each limit has fired in this process, e.g.
+# 'connection:chat_message', 'user:chat_message' or 'outbound_drop:typing_indicator'.
+limit_hits = Counter()
+
+# Per-user buckets, keyed by (user_pk, message_type).
+user_buckets = {}
+# Idle full buckets are thrown away once the dict grows past this size.
+USER_BUCKETS_PRUNE_AT = 5000
+
+
+"""
+Author: Evan
+A classic token bucket. It holds up to 'capacity' tokens and gains
+'rate' tokens per second. Every frame takes one token; when the
+bucket is empty the frame is rejected. This allows short bursts
+(up to 'capacity') but caps the long-run rate.
+RT: Rate-limits real-time frames.
+"""
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now=None):
+        self.refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    # A full bucket behaves exactly like a new one, so it can be dropped.
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+# Counts one firing of the limit called 'name'.
+def record_limit_hit(name):
+    limit_hits[name] += 1
+
+
+# Returns the hit counters as a plain dict (for the staff stats page).
+def get_limit_counters():
+    return dict(limit_hits)
+
+
+# Gets (or creates) the shared bucket for this user and message type.
+def get_user_bucket(user_pk, message_type):
+    key = (user_pk, message_type)
+    bucket = user_buckets.get(key)
+    if bucket is None:
+        if len(user_buckets) >= USER_BUCKETS_PRUNE_AT:
+            prune_user_buckets()
+        bucket = user_buckets[key] = TokenBucket(*USER_LIMITS[message_type])
+    return bucket
+
+
+# Drops user buckets that have refilled completely.
+def prune_user_buckets():
+    now = time.monotonic()
+    for key in [key for key, bucket in user_buckets.items() if bucket.is_full(now)]:
+        del user_buckets[key]
+
+
+"""
+Author: Evan
+Per-connection rate limiter. A consumer makes one of these when the
+socket opens and asks 'allow(message_type)' for every frame the
+browser sends. The frame has to pass both the connection's own bucket
+for that type and, if the type has one, the user's shared bucket.
+Rejections are counted in 'limit_hits', and 'should_close' turns true
+once a client keeps getting rejected faster than REJECTIONS_PER_SECOND.
+RT: Protects the workers from clients that flood real-time frames.
+"""
+class ConnectionRateLimiter:
+    def __init__(self, user_pk=None):
+        self.user_pk = user_pk
+        self.buckets = {}
+        self.rejections = TokenBucket(REJECTIONS_PER_SECOND, REJECTIONS_BEFORE_CLOSE)
+        self.should_close = False
+
+    def allow(self, message_type):
+        now = time.monotonic()
+        if message_type not in CONNECTION_LIMITS:
+            # Don't let the client invent new buckets and counter names
+            message_type = 'other'
+        bucket = self.buckets.get(message_type)
+        if bucket is None:
+            bucket = self.buckets[message_type] = TokenBucket(
+                *CONNECTION_LIMITS.get(message_type, DEFAULT_CONNECTION_LIMIT)
+            )
+        if not bucket.take(now):
+            return self.reject(f'connection:{message_type}')
+
+        if self.user_pk is not None and message_type in USER_LIMITS:
+            if not get_user_bucket(self.user_pk, message_type).take(now):
+                return self.reject(f'user:{message_type}')
+        return True
+
+    def reject(self, name):
+        record_limit_hit(name)
+        if not self.rejections.take():
+            self.should_close = True
+        return False
@@ -0,0 +1,27 @@
+# core/signals.py
+
+# Import post_delete from django.db.models.signals because a shared image loses a reference when a row using it is deleted.
+from django.db.models.signals import post_delete
+# Import receiver from django.dispatch because it's the decorator used to connect a function to a signal.
+from django.dispatch import receiver
+# Import ProfileImage from accounts.models because profile pictures can use shared image files.
+from accounts.models import ProfileImage
+# Import Message and ArchivedMessage from messaging.models because chat images can use shared image files.
+from messaging.models import Message, ArchivedMessage
+# Import release_stored_image from .image_jobs because it does the reference counting.
+from .image_jobs import release_stored_image
+
+"""
+Author: Angie
+This function is a "signal receiver." It runs every time a profile
+picture or a (live or archived) chat message is deleted, including
+when a whole thread or account is deleted. If the row was using a
+shared 'StoredImage', that file loses one reference, and is removed
+from storage once nothing uses it any more.
+"""
+@receiver(post_delete, sender=ProfileImage)
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=ArchivedMessage)
+def release_image_on_delete(sender, instance, **kwargs):
+    if instance.stored_image_id is not None:
+        release_stored_image(instance.stored_image_id, instance.image.storage)
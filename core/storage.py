@@ -0,0 +1,93 @@
+# core/storage.py
+
+# Import hashlib because files are named after the SHA-256 of their bytes.
+import hashlib
+# Import os because the stored name keeps the upload's folder and extension.
+import os
+# Import re because size variants are recognised by their place inside a hashed folder.
+import re
+# Import lru_cache from functools because URLs are remembered per storage for the life of the process.
+from functools import lru_cache
+# Import File from django.core.files.base because plain file objects are wrapped like Django's own 'save' does.
+from django.core.files.base import File
+# Import FileSystemStorage from django.core.files.storage because the local backend keeps files on disk.
+from django.core.files.storage import FileSystemStorage
+
+# How many names' URLs each storage remembers.
+URL_CACHE_SIZE = 4096
+# A size variant lives in a folder named after its main image's hash ('.../<sha256>/256.webp').
+VARIANT_NAME = re.compile(r'(^|/)[0-9a-f]{64}/[^/]+$')
+# Any name laid out by ContentAddressedStorage (a main image or one of its variants).
+ADDRESSED_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{64}(\.[A-Za-z0-9]+|/[^/]+)$')
+
+
+"""
+Author: Angie
+Remembers the URL of every file name a storage is asked about.
+Building a URL is pure string work, but templates ask for a lot of
+them (a chat page with images asks for several per image, one for
+each size in its 'srcset'), and the Cloudinary SDK's builder is not
+cheap. A name always maps to the same URL, so the answer never goes
+stale, even if the file behind it is replaced.
+"""
+class CachedURLMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cached_url = lru_cache(maxsize=URL_CACHE_SIZE)(super().url)
+
+    def url(self, name):
+        return self.cached_url(name)
+
+
+"""
+Author: Angie
+Local media storage that names every file after its content:
+'chat_images/cat.jpg' is stored as 'chat_images/ab/ab12...ef.jpg',
+where 'ab12...ef' is the SHA-256 of the bytes (the 'ab/' level keeps
+folders small). Saving bytes that are already stored just returns
+the existing name. Because a name can only ever hold one content,
+'media_view' (core/views.py) can tell browsers to cache these files
+forever.
+The size variants of an image are saved under fixed names inside a
+folder named after the main image's hash ('.../ab12...ef/256.webp',
+see core.imaging.derivative_name). Those names are kept as given, and
+they may be overwritten, which is how variants get rebuilt.
+Turn it on with MEDIA_STORAGE=local. Files go to MEDIA_ROOT and are
+served under MEDIA_URL.
+"""
+class ContentAddressedStorage(CachedURLMixin, FileSystemStorage):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(*args, **kwargs)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        if VARIANT_NAME.search(name):
+            return super().save(name, content, max_length)
+
+        name = self.addressed_name(name, content)
+        if self.exists(name):
+            return name  # Same bytes, already stored
+        return super().save(name, content, max_length)
+
+    # 'folder/ab/<sha256>.ext' for 'content' saved as 'folder/anything.ext'
+    def addressed_name(self, name, content):
+        # Uploads from core.uploads.ImageUploadHandler arrive already hashed
+        sha256 = getattr(content, 'sha256', None)
+        if not sha256:
+            digest = hashlib.sha256()
+            for chunk in content.chunks():
+                digest.update(chunk)
+            content.seek(0)
+            sha256 = digest.hexdigest()
+        folder, base = os.path.split(name)
+        extension = os.path.splitext(base)[1].lower()
+        return os.path.join(folder, sha256[:2], sha256 + extension).replace('\\', '/')
+
+
+# True for names that can be cached forever (their bytes never change).
+def is_immutable_name(name):
+    return bool(ADDRESSED_NAME.search(name))
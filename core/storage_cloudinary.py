@@ -0,0 +1,12 @@
+# core/storage_cloudinary.py
+
+# Import MediaCloudinaryStorage from cloudinary_storage.storage because it is the hosted media backend.
+# (It lives in its own module because importing it fails without Cloudinary credentials.)
+from cloudinary_storage.storage import MediaCloudinaryStorage
+# Import CachedURLMixin from .storage because Cloudinary URLs are worth remembering too.
+from .storage import CachedURLMixin
+
+
+# Cloudinary media storage that builds each file's URL only once per process.
+class CachedMediaCloudinaryStorage(CachedURLMixin, MediaCloudinaryStorage):
+    pass
@@ -0,0 +1,47 @@
+# core/templatetags/image_tags.py
+
+# Import template from django because this file registers template tags.
+from django import template
+# Import flatatt from django.forms.utils because extra tag arguments become HTML attributes.
+from django.forms.utils import flatatt
+# Import format_html from django.utils.html because the tag builds HTML around URLs.
+from django.utils.html import format_html
+# Import stored_derivative_name and FULL_SIZE from core.imaging because the copies are found by name, not by query.
+from core.imaging import stored_derivative_name, FULL_SIZE
+
+register = template.Library()
+
+
+"""
+Author: Angie
+Draws the image of a 'ProfileImage' or 'Message' ('owner') so the
+browser downloads the smallest copy that fits. 'sizes' tells it how
+wide the image is shown (e.g. "40px" for a buddy-list avatar); any
+other arguments become attributes of the <img> ('data_x' -> 'data-x').
+Images with copies (see 'image_variants') get a <picture> with a WebP
+'srcset' and the JPEGs as fallback. Images without them (uploaded
+before the copies existed, or still being processed) get a plain <img>.
+Usage: {% responsive_image image sizes="120px" alt="..." class="..." %}
+"""
+@register.simple_tag
+def responsive_image(owner, sizes='100vw', **attrs):
+    image = owner.image
+    if not image:
+        return ''
+    attrs = {name.replace('_', '-'): value for name, value in attrs.items()}
+    variants = getattr(owner, 'image_variants', None)
+    if not variants or getattr(owner, 'image_pending', False):
+        return format_html('<img src="{}"{}>', image.url, flatatt(attrs))
+
+    storage = image.storage
+    webp = [f'{storage.url(stored_derivative_name(image.name, variants, size, "webp"))} {width}w' for size, width in variants['sizes']]
+    webp.append(f'{storage.url(stored_derivative_name(image.name, variants, FULL_SIZE, "webp"))} {variants["width"]}w')
+    jpeg = [f'{storage.url(stored_derivative_name(image.name, variants, size, "jpg"))} {width}w' for size, width in variants['sizes']]
+    jpeg.append(f'{image.url} {variants["width"]}w')
+    return format_html(
+        '<picture class="responsive-image">'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}>'
+        '</picture>',
+        ', '.join(webp), sizes, image.url, ', '.join(jpeg), sizes, flatatt(attrs),
+    )
@@ -1,3 +1,52 @@
-from django.test import TestCase
+# core/tests.py
 
-# Create tests here.
+# Import patch from unittest.mock because the budget's clock is held still, so it doesn't refill mid-test.
+from unittest.mock import patch
+# Import async_to_sync from asgiref.sync because the consumer methods tested here are coroutines.
+from asgiref.sync import async_to_sync
+# Import SimpleTestCase from django.test because these tests don't need a database.
+from django.test import SimpleTestCase
+# Import the wire helpers from .wire because the outgoing budget of a socket is tested here.
+from .wire import OUTBOUND_LOW_PRIORITY_LIMIT, WireWebsocketConsumer, frame_event
+# Import limit_hits from .ratelimit because dropped frames are counted there.
+from .ratelimit import limit_hits
+
+
+# A consumer that records the frames it would have written instead of writing them.
+class RecordingConsumer(WireWebsocketConsumer):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    async def send_frame(self, frame):
+        self.sent.append(frame)
+
+
+"""
+Author: Oju
+Checks the outgoing budget of a socket (core/wire.py): low-priority
+frames past it are dropped and counted, important ones always go out.
+"""
+class OutboundBudgetTests(SimpleTestCase):
+    def setUp(self):
+        limit_hits.clear()
+        clock = patch('core.ratelimit.time.monotonic', return_value=1000.0)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.consumer = RecordingConsumer()
+        self.burst = OUTBOUND_LOW_PRIORITY_LIMIT[1]
+
+    def send(self, handler, count):
+        for n in range(count):
+            async_to_sync(self.consumer.send_frames)(frame_event(handler, {'type': 'presence_update', 'n': n}))
+
+    def test_low_priority_frames_past_the_budget_are_dropped_and_counted(self):
+        self.send('broadcast_presence', self.burst + 5)
+        self.assertEqual(len(self.consumer.sent), self.burst)
+        self.assertEqual(limit_hits['outbound_drop:broadcast_presence'], 5)
+
+    def test_important_frames_are_never_dropped(self):
+        self.send('broadcast_presence', self.burst)
+        self.send('chat_message', 50)
+        self.assertEqual(len(self.consumer.sent), self.burst + 50)
+        self.assertEqual(limit_hits, {})
@@ -0,0 +1,170 @@
+# core/uploads.py
+
+# Import hashlib because uploads are hashed as they arrive, so nobody has to read them again for it.
+import hashlib
+# Import struct because WebP dimensions are read straight from the file's header bytes.
+import struct
+# Import wraps from functools because the decorator below keeps the view's name and docstring.
+from functools import wraps
+# Import BytesIO from io because the header bytes are handed to Pillow as a file.
+from io import BytesIO
+# Import SpooledTemporaryFile from tempfile because small uploads stay in memory and big ones go to disk.
+from tempfile import SpooledTemporaryFile
+# Import settings from django.conf because the size limits are settings.
+from django.conf import settings
+# Import UploadedFile from django.core.files.uploadedfile because it's what request.FILES holds.
+from django.core.files.uploadedfile import UploadedFile
+# Import FileUploadHandler and SkipFile from django.core.files.uploadhandler because this is an upload handler.
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+# Import csrf_exempt and csrf_protect from django.views.decorators.csrf because upload handlers
+# must be set before the CSRF check reads the request body.
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+# Import the checks from .imaging because uploads are held to the same rules as processed images.
+from .imaging import open_image, check_pixel_budget, ImageRejected, ImageTooLarge
+
+# The first bytes of each accepted format (WebP is 'RIFF', 4 size bytes, then 'WEBP').
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+# How far into a file its dimensions may be. JPEGs from phones put their EXIF
+# block (up to 64 KB, with a preview image) before the frame header.
+HEADER_LIMIT = 256 * 1024
+
+
+# The image format 'header' starts with ('JPEG', 'PNG', 'GIF', 'WEBP'), or None.
+def sniff_format(header):
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    for signature, fmt in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return fmt
+    return None
+
+
+# (width, height) from a WebP header, or None if not enough of it has arrived yet.
+# (Pillow only opens complete WebP files.)
+def webp_size(header):
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and len(header) >= 30:
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(header) >= 25:
+        bits = int.from_bytes(header[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(header) >= 30:
+        return int.from_bytes(header[24:27], 'little') + 1, int.from_bytes(header[27:30], 'little') + 1
+    return None
+
+
+"""
+Author: Angie
+An upload handler for image fields. It looks at each file while it
+is still arriving instead of after Django has received all of it:
+  - the first bytes must be a JPEG, PNG, GIF or WebP signature,
+  - as soon as the header holds the dimensions, they are checked
+    against MAX_IMAGE_PIXELS (core/imaging.py),
+  - the file may not grow past IMAGE_UPLOAD_MAX_BYTES.
+A file that fails is dropped on the spot (SkipFile: the rest of it is
+read past without being kept, and the form's other fields still
+arrive), and the reason is left for the view (see 'upload_rejection').
+A file that passes is kept in memory up to IMAGE_UPLOAD_MEMORY_SIZE
+and in a temporary file beyond that, so many big uploads at once
+don't fill the server's memory. Its SHA-256 is worked out on the way
+in and kept as 'upload.sha256' (used by 'hash_upload' and the
+content-addressed storage).
+Use it through the 'accepts_image_uploads' decorator.
+"""
+class ImageUploadHandler(FileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.header = b''
+        self.checked = False
+        self.received = 0
+        self.digest = hashlib.sha256()
+        self.file = SpooledTemporaryFile(max_size=settings.IMAGE_UPLOAD_MEMORY_SIZE)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.reject(f'Image is too large (the limit is {settings.IMAGE_UPLOAD_MAX_BYTES // (1024 * 1024)} MB).')
+        if not self.checked:
+            self.header += raw_data
+            self.check_header(complete=False)
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        return None  # Nothing is left for other handlers
+
+    def file_complete(self, file_size):
+        if not self.checked:
+            try:
+                self.check_header(complete=True)
+            except SkipFile:
+                self.file.close()
+                return None
+        self.file.seek(0)
+        upload = UploadedFile(
+            file=self.file, name=self.file_name, content_type=self.content_type,
+            size=file_size, charset=self.charset, content_type_extra=self.content_type_extra,
+        )
+        upload.sha256 = self.digest.hexdigest()
+        return upload
+
+    # Checks the header received so far; 'complete' means no more bytes are coming.
+    def check_header(self, complete):
+        if len(self.header) < 12 and not complete:
+            return
+        fmt = sniff_format(self.header)
+        if fmt is None:
+            self.reject('Only JPEG, PNG, GIF and WebP images can be uploaded.')
+        try:
+            if fmt == 'WEBP':
+                size = webp_size(self.header)
+                if size is None:
+                    raise ImageRejected('Not a readable image.')
+                check_pixel_budget(*size)
+            else:
+                open_image(BytesIO(self.header))
+        except ImageTooLarge as e:
+            self.reject(str(e))
+        except ImageRejected as e:
+            if complete or len(self.header) >= HEADER_LIMIT:
+                self.reject(str(e))
+            return  # The dimensions haven't arrived yet
+        self.checked = True
+        self.header = b''
+
+    # Drops the file being received and notes why for the view.
+    def reject(self, reason):
+        if not hasattr(self.request, 'rejected_uploads'):
+            self.request.rejected_uploads = {}
+        self.request.rejected_uploads[self.field_name] = reason
+        raise SkipFile()
+
+
+# Why the upload in 'field_name' was turned away by ImageUploadHandler, or None.
+def upload_rejection(request, field_name):
+    request.FILES  # Reading the body is what runs the handler
+    return getattr(request, 'rejected_uploads', {}).get(field_name)
+
+
+"""
+Author: Angie
+Makes a view receive its file uploads through 'ImageUploadHandler'.
+Upload handlers can only be changed before anything reads the request
+body, and Django's CSRF check reads it (for the form's token), so the
+view is exempted from the middleware's check and checked by
+'csrf_protect' instead, after the handler is in place. Put it above
+the other decorators.
+"""
+def accepts_image_uploads(view):
+    protected_view = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [ImageUploadHandler(request)]
+        return protected_view(request, *args, **kwargs)
+    return wrapper
@@ -1,3 +1,76 @@
-from django.shortcuts import render
+import os
+import re
+import mimetypes
+from django.http import JsonResponse, HttpResponse, FileResponse, Http404
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import storages
+from django.views.decorators.http import require_safe
+from .ratelimit import get_limit_counters
+from .storage import is_immutable_name
 
-# Create views here.
+# Files named by their content hash never change, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Anything else (e.g. files stored before the content-hashed layout) is checked hourly
+MUTABLE_CACHE_CONTROL = 'public, max-age=3600'
+# A single byte range, e.g. "bytes=0-1023", "bytes=1024-" or "bytes=-500"
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Shows how often each WebSocket rate limit and outbound drop has fired in this
+# server process (see core/ratelimit.py). Staff only.
+@staff_member_required
+def websocket_limits_view(request):
+    return JsonResponse({'limit_hits': get_limit_counters()})
+
+
+"""
+Author: Angie
+Serves a file of the local media storage (MEDIA_STORAGE=local, see
+core/storage.py). Content-hashed files are sent with a year-long
+'immutable' Cache-Control, so browsers never ask for them again.
+Conditional requests (If-None-Match) get a 304, and a single 'Range'
+gets a 206 with just those bytes (which is what browsers and
+download managers use to resume). Requests for several ranges at
+once get the whole file, which the HTTP spec allows.
+"""
+@require_safe
+def media_view(request, name):
+    storage = storages['default']
+    try:
+        path = storage.path(name)
+    except (SuspiciousFileOperation, NotImplementedError):
+        raise Http404
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise Http404
+
+    size = stat.st_size
+    etag = f'"{int(stat.st_mtime):x}-{size:x}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if is_immutable_name(name) else MUTABLE_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+    if etag in request.headers.get('If-None-Match', ''):
+        return HttpResponse(status=304, headers=headers)
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    byte_range = BYTE_RANGE.match(request.headers.get('Range', ''))
+    if byte_range and request.headers.get('If-Range', etag) == etag:
+        first, last = byte_range.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        elif last:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start, end = size, 0  # "bytes=-" asks for nothing
+        if start >= size or start > end:
+            return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return HttpResponse(data, status=206, content_type=content_type, headers=headers)
+
+    return FileResponse(open(path, 'rb'), content_type=content_type, headers=headers)
@@ -0,0 +1,265 @@
+# core/wire.py
+
+# Import json because JSON is still the default format on every WebSocket.
+import json
+# Import msgpack because it is the compact binary format clients can opt in to (already installed with channels-redis).
+import msgpack
+# Import settings from django.conf because the binary protocol is switched on with WEBSOCKET_BINARY_PROTOCOL.
+from django.conf import settings
+# Import AsyncWebsocketConsumer from channels.generic.websocket because the shared consumer base class extends it.
+from channels.generic.websocket import AsyncWebsocketConsumer
+# Import the rate limiter from .ratelimit because every consumer checks incoming frames against it,
+# and TokenBucket because outgoing low-priority frames have a budget too.
+from .ratelimit import ConnectionRateLimiter, TokenBucket, record_limit_hit
+
+# Subprotocol names the browser offers in 'new WebSocket(url, [...])'. The
+# version is part of the name so the field codes below can change safely.
+JSON_SUBPROTOCOL = 'cc.json'
+MSGPACK_SUBPROTOCOL = 'cc.msgpack.v1'
+
+# Short codes for the field names used in WebSocket payloads. Names that are
+# not listed are sent unchanged. 'static/js/main.js' gets this table from the
+# 'ws-protocol' script tag, so it only needs to be edited here.
+FIELD_CODES = {
+    'type': 't',
+    'message': 'm',
+    'message_html': 'mh',
+    'messages': 'ms',
+    'image_url': 'i',
+    'image_pending': 'ip',
+    'message_id': 'mi',
+    'image_id': 'ii',
+    'sender_id': 's',
+    'sender_first_name': 'n',
+    'seq': 'q',
+    'has_more': 'hm',
+    'html': 'h',
+    'message_type': 'mt',
+    'user_pk': 'u',
+    'status': 'st',
+    'text': 'x',
+    'invite_count': 'ic',
+    'unread_total': 'ut',
+    'offer_sdp': 'o',
+    'answer_sdp': 'a',
+    'candidate': 'c',
+    'viewers': 'v',
+    'thread_id': 'ti',
+    'post_count': 'pc',
+    'last_post': 'lp',
+}
+
+# Short codes for the 'type' values the server sends.
+TYPE_CODES = {
+    'chat_message': 1,
+    'typing': 2,
+    'typing_stopped': 3,
+    'resume': 4,
+    'notification': 5,
+    'presence_update': 6,
+    'broadcast_message': 7,
+    'webrtc_offer': 8,
+    'webrtc_answer': 9,
+    'webrtc_ice_candidate': 10,
+    'webrtc_hangup': 11,
+    'rate_limited': 12,
+    'image_ready': 13,
+}
+
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+# Channel layer handlers whose frames are only "nice to have". Missing a typing,
+# presence or viewer count update is harmless; the next one corrects the screen.
+LOW_PRIORITY_HANDLERS = {'typing_indicator', 'broadcast_presence', 'broadcast_viewers'}
+# Outgoing budget for those frames on one socket: (frames per second, burst).
+# Frames over it are dropped (and counted as 'outbound_drop:<handler>').
+OUTBOUND_LOW_PRIORITY_LIMIT = (5, 20)
+# Close code sent to clients that ignore the limits (4000-4999 is for applications).
+CLOSE_CODE_FLOODING = 4008
+
+
+# Is the MessagePack protocol switched on for this deployment?
+def binary_protocol_enabled():
+    return getattr(settings, 'WEBSOCKET_BINARY_PROTOCOL', False)
+
+
+"""
+Author: Oju
+These two functions swap long field names for their short codes
+and back again. They walk nested dicts and lists, so a 'resume'
+batch or a notification's inner 'message' dict is shortened too.
+RT: Shrinks real-time payloads before they go out as MessagePack.
+"""
+def compact(value):
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            if key == 'type' and item in TYPE_CODES:
+                item = TYPE_CODES[item]
+            out[FIELD_CODES.get(key, key)] = compact(item)
+        return out
+    if isinstance(value, list):
+        return [compact(item) for item in value]
+    return value
+
+
+def expand(value):
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            name = FIELD_NAMES.get(key, key)
+            if name == 'type' and isinstance(item, int):
+                item = TYPE_NAMES.get(item, item)
+            out[name] = expand(item)
+        return out
+    if isinstance(value, list):
+        return [expand(item) for item in value]
+    return value
+
+
+"""
+Author: Oju
+Encodes a payload once in every format a connected browser may be
+using. The result goes into a channel layer event, so a broadcast to
+a group of any size costs one json.dumps (and one msgpack.packb when
+the binary protocol is on) instead of one per recipient.
+RT: Builds pre-encoded frames for real-time broadcasts.
+"""
+def build_frames(payload):
+    frames = {'json': json.dumps(payload)}
+    if binary_protocol_enabled():
+        frames['msgpack'] = msgpack.packb(compact(payload))
+    return frames
+
+
+# Wraps a payload as a channel layer event for the consumer handler named 'handler'.
+def frame_event(handler, payload):
+    return {'type': handler, 'frames': build_frames(payload)}
+
+
+"""
+Author: Oju
+Base class for the site's WebSocket consumers. 'accept_protocol' picks
+the format the browser asked for, 'send_payload' encodes a single
+message for this connection, 'send_frames' forwards a pre-encoded
+broadcast, and 'receive_frame' reads a text or binary frame from the
+browser into a dict after checking it against the rate limits.
+
+Outgoing frames are handed straight to the server. Daphne buffers them
+for the socket itself and tells the application nothing about how far
+behind a client is, so instead of a queue each socket has a budget for
+low-priority frames (typing, presence and viewer counts, see
+OUTBOUND_LOW_PRIORITY_LIMIT). A busy room or a flood of presence
+changes can then only pile up so much in front of a slow client;
+the frames over the budget are dropped, never the important ones.
+RT: Lets every real-time consumer speak JSON or compact MessagePack,
+with rate limiting both ways.
+"""
+class WireWebsocketConsumer(AsyncWebsocketConsumer):
+    wire_format = 'json'
+    rate_limiter = None
+    outbound_budget = None
+
+    async def accept_protocol(self):
+        offered = self.scope.get('subprotocols') or []
+        subprotocol = None
+        if MSGPACK_SUBPROTOCOL in offered and binary_protocol_enabled():
+            self.wire_format = 'msgpack'
+            subprotocol = MSGPACK_SUBPROTOCOL
+        elif JSON_SUBPROTOCOL in offered:
+            subprotocol = JSON_SUBPROTOCOL
+        await self.accept(subprotocol=subprotocol)
+
+    async def send_payload(self, payload):
+        if self.wire_format == 'msgpack':
+            frame = msgpack.packb(compact(payload))
+        else:
+            frame = json.dumps(payload)
+        await self.send_frame(frame)
+
+    async def send_frames(self, event):
+        if event['type'] in LOW_PRIORITY_HANDLERS and not self.take_outbound_budget():
+            record_limit_hit(f"outbound_drop:{event['type']}")
+            return
+        frame = event['frames'].get(self.wire_format)
+        if frame is None:
+            # Encoded before the binary protocol was switched on
+            frame = msgpack.packb(compact(json.loads(event['frames']['json'])))
+        await self.send_frame(frame)
+
+    # Takes one low-priority frame from this socket's outgoing budget; False if it's spent.
+    def take_outbound_budget(self):
+        if self.outbound_budget is None:
+            self.outbound_budget = TokenBucket(*OUTBOUND_LOW_PRIORITY_LIMIT)
+        return self.outbound_budget.take()
+
+    # Writes one encoded frame (text for JSON, bytes for MessagePack) to the socket.
+    async def send_frame(self, frame):
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    """
+    Decodes a frame from the browser and checks it against this
+    connection's rate limits. Returns the message as a dict, or None
+    if it was malformed or over the limit (the caller just ignores it).
+    A client that keeps flooding is disconnected.
+    """
+    async def receive_frame(self, text_data=None, bytes_data=None):
+        try:
+            if bytes_data is not None:
+                data = expand(msgpack.unpackb(bytes_data))
+            else:
+                data = json.loads(text_data)
+        except (ValueError, TypeError):
+            data = None
+        if not isinstance(data, dict):
+            record_limit_hit('malformed')
+            return None
+
+        if self.rate_limiter is None:
+            user = self.scope.get('user')
+            self.rate_limiter = ConnectionRateLimiter(user.pk if user and user.is_authenticated else None)
+        message_type = data.get('type', 'chat_message')
+        if self.rate_limiter.allow(message_type):
+            return data
+        if self.rate_limiter.should_close:
+            await self.close(code=CLOSE_CODE_FLOODING)
+        elif message_type == 'chat_message':
+            # Tell the sender, so the message doesn't just vanish
+            await self.send_payload({'type': 'rate_limited', 'message_type': message_type})
+        return None
+
+
+"""
+Author: Evan
+Turns on the permessage-deflate WebSocket extension in Daphne. Browsers
+always offer it, but Daphne never sets up its factory to accept the
+offer, so every frame goes out uncompressed. This swaps in a factory
+subclass that accepts the offer. It has to run before the server starts,
+which is why 'config/asgi.py' calls it at import time.
+RT: Compresses every real-time frame on the wire.
+"""
+def enable_permessage_deflate():
+    from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+    from daphne import server
+
+    if getattr(server.WebSocketFactory, 'accepts_deflate', False):
+        return
+
+    def accept_deflate(offers):
+        for offer in offers:
+            if isinstance(offer, PerMessageDeflateOffer):
+                return PerMessageDeflateOfferAccept(offer)
+        return None
+
+    class DeflateWebSocketFactory(server.WebSocketFactory):
+        accepts_deflate = True
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.setProtocolOptions(perMessageCompressionAccept=accept_deflate)
+
+    server.WebSocketFactory = DeflateWebSocketFactory
@@ -2,6 +2,8 @@
 
 # Import AppConfig from django.apps because it's the base class for a Django app configuration.
 from django.apps import AppConfig
+# Import post_migrate from django.db.models.signals because the search index is checked after every migrate.
+from django.db.models.signals import post_migrate
 
 """
 Author: Cole
@@ -13,3 +15,18 @@ RT: This app contains the WebSocket consumers for real-time chat.
 class MessagingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'messaging'
+
+    def ready(self):
+        post_migrate.connect(restore_search_index, sender=self)
+
+
+# SQLite drops a table's triggers when a migration rebuilds the table, so after
+# every migrate the message search index is put back if it went missing.
+def restore_search_index(using, **kwargs):
+    from django.db import connections
+    from django.db.migrations.recorder import MigrationRecorder
+    from .search import install_search_index
+
+    connection = connections[using]
+    if MigrationRecorder(connection).migration_qs.filter(app='messaging', name='0009_message_search_index').exists():
+        install_search_index(connection)
@@ -0,0 +1,107 @@
+# messaging/archive.py
+
+# Import Counter from collections because archived images keep their shared files referenced.
+from collections import Counter
+# Import transaction from django.db because each batch is copied and deleted atomically.
+from django.db import transaction
+# Import Prefetch from django.db.models because live invite bubbles need the viewer's own invite.
+# Import F because shared image reference counts are bumped in the database.
+from django.db.models import Prefetch, F
+# Import StoredImage from core.models because archived messages keep using the same image files.
+from core.models import StoredImage
+# Import the models from .models because this module moves rows between 'Message' and 'ArchivedMessage'.
+from .models import Message, ArchivedMessage, SessionInvite
+
+# How many messages one page of chat history shows.
+HISTORY_PAGE_SIZE = 50
+
+
+"""
+Author: Cole
+Moves messages sent before 'cutoff' from the live 'Message' table
+into 'ArchivedMessage', 'batch_size' at a time. Messages are walked
+in id order (which is also the order they were sent), so the walk
+stops at the first message that is still recent. Each batch is
+copied and deleted in its own short transaction: if the job is
+stopped, the finished batches are already gone from 'Message' and
+re-running it continues with the rest (a half-copied batch is
+simply copied again). Session invite messages stay live, because
+their 'SessionInvite' rows point at them.
+Yields (messages archived so far, last id looked at) after each batch.
+"""
+def archive_messages_before(cutoff, batch_size=1000):
+    archived = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            Message.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('pk', 'thread_id', 'sender_id', 'seq', 'content', 'image', 'image_variants', 'stored_image_id',
+                  'timestamp', 'is_session_invite')[:batch_size]
+        )
+        if not batch:
+            return
+
+        old = []
+        reached_recent = False
+        for message in batch:
+            if message.timestamp >= cutoff:
+                reached_recent = True
+                break
+            last_pk = message.pk
+            if not message.is_session_invite:
+                old.append(message)
+
+        if old:
+            with transaction.atomic():
+                ArchivedMessage.objects.bulk_create([
+                    ArchivedMessage(
+                        id=message.pk, thread_id=message.thread_id, sender_id=message.sender_id,
+                        seq=message.seq, content=message.content, image=message.image.name or None,
+                        image_variants=message.image_variants, stored_image_id=message.stored_image_id,
+                        timestamp=message.timestamp,
+                    )
+                    for message in old
+                ], ignore_conflicts=True)
+                # The archived copies reference the shared image files before the
+                # deletes below release the live messages' references
+                shared = Counter(message.stored_image_id for message in old if message.stored_image_id)
+                for stored_image_id, count in shared.items():
+                    StoredImage.objects.filter(pk=stored_image_id).update(ref_count=F('ref_count') + count)
+                Message.objects.filter(pk__in=[message.pk for message in old]).delete()
+            archived += len(old)
+
+        yield archived, last_pk
+        if reached_recent:
+            return
+
+
+"""
+Author: Cole
+Returns one page of a thread's history: the HISTORY_PAGE_SIZE
+messages just before 'before_seq' (or the newest ones if it's None),
+oldest first. The live and archived tables are each asked for one
+page (both lookups use their table's (thread, seq) unique index) and
+the two are merged by 'seq', so the caller never has to know where
+the split is. Merging, rather than reading the archive only below the
+oldest live message, matters because session invites stay live while
+the messages around them are archived.
+Returns (messages, has_more); 'has_more' says if there is anything
+older than this page.
+"""
+def get_history_page(thread, user, before_seq=None, limit=HISTORY_PAGE_SIZE):
+    live = thread.messages.select_related('sender').prefetch_related(
+        Prefetch('invites', queryset=SessionInvite.objects.filter(invitee=user), to_attr='my_invites')
+    )
+    archived = ArchivedMessage.objects.filter(thread=thread).select_related('sender')
+    if before_seq is not None:
+        live = live.filter(seq__lt=before_seq)
+        archived = archived.filter(seq__lt=before_seq)
+
+    page = list(live.order_by('-seq')[:limit + 1])
+    page += archived.order_by('-seq')[:limit + 1]
+    page.sort(key=lambda message: message.seq, reverse=True)
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+    return page, has_more
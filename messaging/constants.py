@@ -6,8 +6,9 @@ This file holds simple, reusable text values (constants)
 that are used in multiple places within the 'messaging' app.
 Using constants like this makes the code easier to update
 if the text needs to change later.
-RT: This constant is used to identify real-time session
-invite messages in the chat.
+RT: Session invites are now stored as 'SessionInvite' rows. This
+prefix is only kept so the data migration can recognise the old
+string-encoded invite messages.
 """
-# This specific text marks a message as being a session invite.
+# This specific text marked a message as being a session invite (legacy format).
 SESSION_INVITE_PREFIX = 'SESSION_INVITE::'
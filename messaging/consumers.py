@@ -1,18 +1,40 @@
 # messaging/consumers.py
 
-# Import json because WebSocket messages are sent as text in JSON format.
-import json
-# Import AsyncWebsocketConsumer from channels.generic.websocket because this is the base class for our real-time consumer.
-from channels.generic.websocket import AsyncWebsocketConsumer
+# Import asyncio because read pointer updates are flushed after a short delay.
+import asyncio
+# Import time because typing events are timed with the wall clock, which every server process shares.
+import time
+# Import WireWebsocketConsumer and frame_event from core.wire because they handle the JSON/MessagePack
+# formats and let each broadcast be encoded once for the whole group.
+from core.wire import WireWebsocketConsumer, frame_event
 # Import get_user_model from django.contrib.auth because we need to get the User who sent a message.
 from django.contrib.auth import get_user_model
+# Import cache from django.core.cache because a sender's typing state is shared by all their connections there.
+from django.core.cache import cache
 # Import sync_to_async from asgiref.sync because it lets our async code safely talk to the sync database.
 from asgiref.sync import sync_to_async
 # Import models from .models because we need to create 'Message' and find 'MessageThread'.
 from .models import Message, MessageThread
+# Import serialize_message from .utils because resumed messages must match the live message format.
+# Import note_new_message, mark_thread_read, push_unread_total from .utils because they keep read state and badges current.
+from .utils import serialize_message, note_new_message, mark_thread_read, push_unread_total
 
 User = get_user_model()
 
+# The most messages a single 'resume' request will replay. A client that missed
+# more than this is told to reload the page instead.
+RESUME_BATCH_LIMIT = 200
+# How long (in seconds) 'read' events are collected before the read pointer is written.
+READ_FLUSH_DELAY = 2
+# A sender's "typing" event is broadcast at most once every this many seconds.
+TYPING_THROTTLE_SECONDS = 2
+# If no keystrokes arrive for this many seconds, the server broadcasts "stopped typing".
+TYPING_STOP_SECONDS = 3
+# Cache key held while a sender's "typing" was broadcast in the last TYPING_THROTTLE_SECONDS.
+TYPING_THROTTLE_KEY = 'typing:{}:{}:throttle'
+# Cache key holding the time of a sender's last keystroke in a thread, until "stopped typing" goes out.
+TYPING_KEY = 'typing:{}:{}'
+
 """
 Author: Oju
 This class is the "brain" for the real-time private chat. It
@@ -21,7 +43,7 @@ manages users connecting, disconnecting, sending messages, and
 receiving messages, all live without a page refresh.
 RT: This entire class is for real-time chat functionality.
 """
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(WireWebsocketConsumer):
     """
     This function runs the moment a user opens a chat window.
     It gets the thread ID from the URL, creates a unique
@@ -32,12 +54,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.thread_id = self.scope['url_route']['kwargs']['thread_id']
         self.room_group_name = f'chat_{self.thread_id}'
+        # Highest seq the browser reported as read, waiting to be written
+        self.pending_read_seq = 0
+        self.read_flush_task = None
+        # This connection's last keystroke and its stop watcher (see 'handle_typing')
+        self.last_typing_at = 0.0
+        self.typing_stop_task = None
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        await self.accept_protocol()
 
     """
     This function runs when the user closes the chat window
@@ -50,75 +78,105 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        # If the user was mid-typing here (and not since in another tab), tell everyone they stopped
+        await self.stop_typing(broadcast=True, only_if_last=True)
+        # Write any read pointer that was still waiting for its delay
+        if self.read_flush_task:
+            self.read_flush_task.cancel()
+            self.read_flush_task = None
+        await self.flush_read_pointer()
 
     """
     This function runs every time the server receives a
     message *from* the user's browser (e.g., they hit "Send"
     or start typing). It checks if the message is a "typing"
-    notification or an actual "chat_message".
+    notification, an actual "chat_message", or a "resume" request
+    sent after the socket reconnects.
     RT: This receives live messages and "typing" notifications
     from the user's browser.
     """
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        # Malformed frames and frames over the rate limit come back as None
+        data = await self.receive_frame(text_data, bytes_data)
+        if data is None:
+            return
         message_type = data.get('type', 'chat_message')
 
         # --- WebRTC Hangup handler ---
         if message_type == 'typing':
-            # If it's a "typing" message, just broadcast it to the group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'typing_indicator',
-                    'sender_id': data['sender_id'],
-                    'sender_first_name': data.get('sender_first_name', 'Someone') # <-- CHANGE HERE
-                }
-            )
+            # Keystrokes are throttled here, not broadcast one by one
+            await self.handle_typing()
         
         elif message_type == 'webrtc_offer':
             # A user is sending an offer. Broadcast it.
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
-                    'type': 'webrtc_receive_offer',
+                frame_event('webrtc_receive_offer', {
+                    'type': 'webrtc_offer',
                     'sender_id': data['sender_id'],
                     'sender_first_name': data['sender_first_name'],
                     'offer_sdp': data['offer_sdp']
-                }
+                })
             )
             
         elif message_type == 'webrtc_answer':
             # A user is sending an answer. Broadcast it.
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
-                    'type': 'webrtc_receive_answer',
+                frame_event('webrtc_receive_answer', {
+                    'type': 'webrtc_answer',
                     'sender_id': data['sender_id'],
                     'answer_sdp': data['answer_sdp']
-                }
+                })
             )
             
         elif message_type == 'webrtc_ice_candidate':
             # A user is sending a new ice candidate. Broadcast it.
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
-                    'type': 'webrtc_receive_ice_candidate',
+                frame_event('webrtc_receive_ice_candidate', {
+                    'type': 'webrtc_ice_candidate',
                     'sender_id': data['sender_id'],
                     'candidate': data['candidate'] # Pass the candidate
-                }
+                })
             )
             
         elif message_type == 'webrtc_hangup':
             # A user is hanging up. Broadcast it.
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
-                    'type': 'webrtc_receive_hangup',
+                frame_event('webrtc_receive_hangup', {
+                    'type': 'webrtc_hangup',
                     'sender_id': data['sender_id']
-                }
+                })
             )
 
+        elif message_type == 'resume':
+            # The browser reconnected and tells us the last message it has seen.
+            # Reply with everything newer in a single batch.
+            try:
+                last_seq = int(data.get('last_seq') or 0)
+            except (TypeError, ValueError):
+                last_seq = 0
+            missed, has_more = await self.get_missed_messages(last_seq)
+            await self.send_payload({
+                'type': 'resume',
+                'messages': missed,
+                'has_more': has_more
+            })
+
+        elif message_type == 'read':
+            # The browser has shown everything up to 'seq'. Only remember the highest
+            # value here; it's written to the database at most once per READ_FLUSH_DELAY.
+            try:
+                seq = int(data.get('seq') or 0)
+            except (TypeError, ValueError):
+                seq = 0
+            if seq > self.pending_read_seq:
+                self.pending_read_seq = seq
+                if self.read_flush_task is None:
+                    self.read_flush_task = asyncio.create_task(self.flush_read_pointer_later())
+
         elif message_type == 'chat_message':
             message_content = data['message']
             sender_id = data['sender_id']
@@ -127,25 +185,113 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 sender = await self.get_user_instance(sender_id)
                 thread = await self.get_thread_instance(self.thread_id)
                 
+                # The message replaces the typing indicator on every screen
+                await self.stop_typing(broadcast=False)
+
                 # Only save content if it's not None
+                new_message = None
                 if message_content:
-                    await self.create_message(thread, sender, message_content)
+                    new_message = await self.create_message(thread, sender, message_content)
                 
 
                 # After saving, broadcast the new message to the group
                 await self.channel_layer.group_send(
                     self.room_group_name,
-                    {
+                    frame_event('chat_message', {
                         'type': 'chat_message', 
                         'message': message_content, 
+                        'message_html': new_message.content_html if new_message else '',
                         'image_url': None,
                         'sender_id': sender_id,
-                        'sender_first_name': sender_first_name
-                    }
+                        'sender_first_name': sender_first_name,
+                        'seq': new_message.seq if new_message else None
+                    })
                 )
             except Exception as e:
                 print(f"ERROR in ChatConsumer: {e}")
 
+    """
+    This function handles a "typing" event from the browser. The
+    browser sends one per keystroke, but the group only hears about
+    it once every TYPING_THROTTLE_SECONDS per sender and thread, however
+    many tabs or devices they type in: the throttle is a key in the
+    shared cache. The sender is the logged-in user of this socket, never
+    whoever the browser claims to be. Each keystroke also writes its time
+    to the cache, and a background task on this connection watches for
+    the keystrokes to stop and then broadcasts one "typing_stopped"
+    event, so other screens can hide the indicator at the right moment.
+    RT: Rate-limits the real-time typing indicator.
+    """
+    async def handle_typing(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            return
+        self.last_typing_at = time.time()
+        await cache.aset(TYPING_KEY.format(self.thread_id, user.pk), self.last_typing_at, TYPING_STOP_SECONDS * 2)
+        if self.typing_stop_task is None:
+            self.typing_stop_task = asyncio.create_task(self.typing_stop_watcher())
+
+        if not await cache.aadd(TYPING_THROTTLE_KEY.format(self.thread_id, user.pk), True, TYPING_THROTTLE_SECONDS):
+            return
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            frame_event('typing_indicator', {
+                'type': 'typing',
+                'sender_id': user.pk,
+                'sender_first_name': user.first_name or 'Someone'
+            })
+        )
+
+    # Sleeps until TYPING_STOP_SECONDS have passed since the sender's last keystroke (in any
+    # of their tabs), then broadcasts "typing_stopped". New keystrokes push the deadline back.
+    async def typing_stop_watcher(self):
+        typing_key = TYPING_KEY.format(self.thread_id, self.scope['user'].pk)
+        try:
+            while True:
+                last_typing_at = await cache.aget(typing_key)
+                if last_typing_at is None:
+                    # Already stopped (by a message, or by another tab's watcher)
+                    self.typing_stop_task = None
+                    return
+                remaining = last_typing_at + TYPING_STOP_SECONDS - time.time()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+        except asyncio.CancelledError:
+            return
+        self.typing_stop_task = None
+        await self.stop_typing(broadcast=True)
+
+    """
+    Clears the sender's typing state in this thread. 'broadcast' sends
+    "typing_stopped" to the group; it's skipped when a chat message is
+    about to hide the indicator anyway. Only the connection that removes
+    the shared keystroke time sends it, so it goes out once however many
+    tabs were watching. With 'only_if_last' (a tab closing), the state is
+    left alone if the sender has typed in another tab since.
+    """
+    async def stop_typing(self, broadcast, only_if_last=False):
+        if self.typing_stop_task:
+            self.typing_stop_task.cancel()
+            self.typing_stop_task = None
+        user = self.scope['user']
+        if not user.is_authenticated:
+            return
+        typing_key = TYPING_KEY.format(self.thread_id, user.pk)
+        if only_if_last and (not self.last_typing_at or await cache.aget(typing_key) != self.last_typing_at):
+            return
+        self.last_typing_at = 0.0
+        was_typing = await cache.adelete(typing_key)
+        await cache.adelete(TYPING_THROTTLE_KEY.format(self.thread_id, user.pk))
+        if broadcast and was_typing:
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                frame_event('typing_stopped_indicator', {
+                    'type': 'typing_stopped',
+                    'sender_id': user.pk
+                })
+            )
+
     """
     This function is called when the server's broadcast
     system (the "group") gets a 'chat_message' to send out.
@@ -155,14 +301,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
     """
     async def chat_message(self, event):
         # Author: Angie
-        # Includes 'image_url' if it exists.
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message', 
-            'message': event.get('message'), 
-            'image_url': event.get('image_url'),
-            'sender_id': event['sender_id'],
-            'sender_first_name': event['sender_first_name']
-        }))
+        # Includes 'image_url' if it exists (the frame was encoded once by the sender).
+        await self.send_frames(event)
 
 
     """
@@ -172,48 +312,56 @@ class ChatConsumer(AsyncWebsocketConsumer):
     RT: This pushes the "is typing" notification to the user's screen.
     """
     async def typing_indicator(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'typing', 
-            'sender_id': event['sender_id'],
-            'sender_first_name': event.get('sender_first_name') # <-- CHANGE HERE
-        }))
+        await self.send_frames(event)
+
+    # Pushes the "stopped typing" notification to the user's screen.
+    async def typing_stopped_indicator(self, event):
+        await self.send_frames(event)
     
     
     # --- WebRTC HANDLERS ---
     
     # Broadcasts the offer to the other user
     async def webrtc_receive_offer(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'webrtc_offer', 
-            'sender_id': event['sender_id'],
-            'sender_first_name': event['sender_first_name'],
-            'offer_sdp': event['offer_sdp']
-        }))
+        await self.send_frames(event)
 
     # Broadcasts the answer back to the original caller
     async def webrtc_receive_answer(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'webrtc_answer',
-            'sender_id': event['sender_id'],
-            'answer_sdp': event['answer_sdp']
-        }))
-        
+        await self.send_frames(event)
+
     # Broadcasts the ICE candidate to the other user
     async def webrtc_receive_ice_candidate(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'webrtc_ice_candidate',
-            'sender_id': event['sender_id'],
-            'candidate': event['candidate']
-        }))
-        
+        await self.send_frames(event)
+
     # Broadcasts the hangup signal to the other user
     async def webrtc_receive_hangup(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'webrtc_hangup',
-            'sender_id': event['sender_id']
-        }))
-        
+        await self.send_frames(event)
+
     # --- END WebRTC HANDLERS ---
+
+    """
+    These two functions save the user's read pointer. 'read' events
+    from the browser only update 'pending_read_seq'; this waits
+    READ_FLUSH_DELAY seconds and then writes the highest value seen,
+    so a burst of messages costs one database write. If the user's
+    unread total changed, the new number is pushed to their header badge.
+    RT: Debounced handling of the real-time 'read' event.
+    """
+    async def flush_read_pointer_later(self):
+        try:
+            await asyncio.sleep(READ_FLUSH_DELAY)
+        except asyncio.CancelledError:
+            return
+        self.read_flush_task = None
+        await self.flush_read_pointer()
+
+    async def flush_read_pointer(self):
+        seq = self.pending_read_seq
+        user = self.scope.get('user')
+        if not seq or not user or not user.is_authenticated:
+            return
+        self.pending_read_seq = 0
+        await self.save_read_pointer(user, seq)
     
     
     """
@@ -225,8 +373,21 @@ class ChatConsumer(AsyncWebsocketConsumer):
     def create_message(self, thread, sender, content):
         new_message = Message.objects.create(thread=thread, sender=sender, content=content)
         thread.save() # Updates message thread's timestamp
+        note_new_message(new_message) # Updates read pointers and unread badges
         return new_message
 
+    """
+    This is a helper function that safely moves the user's read
+    pointer from within the async code, and pushes the new unread
+    total to their badge if it changed.
+    RT: This is an async helper for the real-time 'read' event.
+    """
+    @sync_to_async
+    def save_read_pointer(self, user, seq):
+        total = mark_thread_read(user, self.thread_id, seq)
+        if total is not None:
+            push_unread_total(user.pk, total)
+
     """
     This is a helper function that safely gets a User object
     from the database from within the async code.
@@ -245,3 +406,26 @@ class ChatConsumer(AsyncWebsocketConsumer):
     def get_thread_instance(self, thread_id):
         return MessageThread.objects.get(pk=thread_id)
 
+    """
+    This helper loads the messages of this thread that come after
+    'last_seq', oldest first, capped at RESUME_BATCH_LIMIT. It uses the
+    (thread, seq) index so the cost only depends on how much was missed.
+    Only participants of the thread get anything back.
+    RT: This is an async helper for the real-time 'resume' request.
+    """
+    @sync_to_async
+    def get_missed_messages(self, last_seq):
+        user = self.scope.get('user')
+        if not user or not user.is_authenticated:
+            return [], False
+        if not MessageThread.objects.filter(pk=self.thread_id, participants=user).exists():
+            return [], False
+
+        missed = list(
+            Message.objects.filter(thread_id=self.thread_id, seq__gt=last_seq)
+            .select_related('sender')
+            .order_by('seq')[:RESUME_BATCH_LIMIT + 1]
+        )
+        has_more = len(missed) > RESUME_BATCH_LIMIT
+        return [serialize_message(message) for message in missed[:RESUME_BATCH_LIMIT]], has_more
+
@@ -0,0 +1,37 @@
+# messaging/management/commands/archive_messages.py
+
+# Import timedelta from datetime because the cutoff is a number of days back from now.
+from datetime import timedelta
+# Import settings from django.conf because the default age comes from MESSAGE_ARCHIVE_AFTER_DAYS.
+from django.conf import settings
+# Import BaseCommand from django.core.management.base because custom management commands are based on it.
+from django.core.management.base import BaseCommand
+# Import timezone from django.utils because message timestamps are timezone-aware.
+from django.utils import timezone
+# Import the archiver from messaging.archive because it does the actual batched move.
+from messaging.archive import archive_messages_before
+
+"""
+Author: Cole
+This command ('python manage.py archive_messages') moves chat messages
+older than MESSAGE_ARCHIVE_AFTER_DAYS (or '--days') out of the live
+message table into the archive. It works in small batches, prints
+progress as it goes, and can be stopped and re-run at any time; run
+it from cron (e.g. nightly). Archived messages still show up when
+someone scrolls back through a conversation.
+"""
+class Command(BaseCommand):
+    help = 'Moves old chat messages from the live table into the message archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MESSAGE_ARCHIVE_AFTER_DAYS,
+                            help='Archive messages older than this many days.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Messages moved per batch.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        done = 0
+        for done, last_pk in archive_messages_before(cutoff, batch_size=options['batch_size']):
+            self.stdout.write(f'Archived {done} message(s), up to id {last_pk}')
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {done} message(s) older than {options["days"]} days archived.'))
@@ -0,0 +1,33 @@
+# messaging/management/commands/rerender_messages.py
+
+# Import BaseCommand from django.core.management.base because custom management commands are based on it.
+from django.core.management.base import BaseCommand
+# Import Message from messaging.models because this command rewrites its stored HTML.
+from messaging.models import Message
+# Import the renderer from messaging.rendering because it does the actual batched re-render.
+from messaging.rendering import rerender_stale_messages, RENDERER_VERSION
+
+"""
+Author: Cole
+This command ('python manage.py rerender_messages') rebuilds the
+stored HTML of old chat messages after RENDERER_VERSION has been
+bumped (for example, when the link rules change). It works through
+the messages in small batches so the table is never locked for
+long, prints progress as it goes, and can be stopped and re-run at
+any time without redoing finished messages.
+"""
+class Command(BaseCommand):
+    help = 'Re-renders the stored HTML of messages rendered with an older renderer version.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Messages rendered per batch.')
+
+    def handle(self, *args, **options):
+        done = 0
+        for done, last_pk in rerender_stale_messages(Message, batch_size=options['batch_size']):
+            self.stdout.write(f'Re-rendered {done} message(s), up to id {last_pk}')
+
+        if done:
+            self.stdout.write(self.style.SUCCESS(f'Done: {done} message(s) now use renderer version {RENDERER_VERSION}.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'All messages already use renderer version {RENDERER_VERSION}.'))
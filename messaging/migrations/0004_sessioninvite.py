@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0003_messagethread_name'),
+        ('rooms', '0002_course_tag_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='is_session_invite',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='SessionInvite',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('declined', 'Declined')], default='pending', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('responded_at', models.DateTimeField(blank=True, null=True)),
+                ('invitee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='session_invites', to=settings.AUTH_USER_MODEL)),
+                ('inviter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sent_session_invites', to=settings.AUTH_USER_MODEL)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invites', to='messaging.message')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invites', to='rooms.session')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['invitee', 'status'], name='invite_invitee_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('message', 'invitee'), name='unique_invite_per_message')],
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Converts the old 'SESSION_INVITE::<session_id>::<text>' messages into SessionInvite rows.
+
+from django.db import migrations
+
+from messaging.constants import SESSION_INVITE_PREFIX
+
+
+def forwards(apps, schema_editor):
+    Message = apps.get_model('messaging', 'Message')
+    SessionInvite = apps.get_model('messaging', 'SessionInvite')
+    Session = apps.get_model('rooms', 'Session')
+
+    legacy = Message.objects.filter(content__startswith=SESSION_INVITE_PREFIX).select_related('thread')
+    for message in legacy.iterator():
+        _, session_id, invite_text = message.content.split('::', 2)
+        message.content = invite_text
+
+        session = Session.objects.filter(pk=session_id).first() if session_id.isdigit() else None
+        if session is None:
+            # The session was already cleaned up, so keep the text as a plain message
+            message.save(update_fields=['content'])
+            continue
+
+        message.is_session_invite = True
+        message.save(update_fields=['content', 'is_session_invite'])
+
+        # Everyone in the thread except the sender was invited and hasn't answered yet
+        invitees = message.thread.participants.exclude(pk=message.sender_id)
+        SessionInvite.objects.bulk_create([
+            SessionInvite(session=session, inviter_id=message.sender_id, invitee=invitee, message=message)
+            for invitee in invitees
+            if not session.participants.filter(pk=invitee.pk).exists()
+        ], ignore_conflicts=True)
+
+
+def backwards(apps, schema_editor):
+    Message = apps.get_model('messaging', 'Message')
+
+    for message in Message.objects.filter(is_session_invite=True).prefetch_related('invites').iterator(chunk_size=500):
+        invite = message.invites.all()[:1]
+        if invite:
+            message.content = f"{SESSION_INVITE_PREFIX}{invite[0].session_id}::{message.content}"
+            message.save(update_fields=['content'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0004_sessioninvite'),
+        ('rooms', '0002_course_tag_type'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
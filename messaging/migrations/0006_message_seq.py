@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Numbers the existing messages of every thread in the order they were sent.
+def backfill_seq(apps, schema_editor):
+    MessageThread = apps.get_model('messaging', 'MessageThread')
+    Message = apps.get_model('messaging', 'Message')
+
+    for thread in MessageThread.objects.all().iterator():
+        seq = 0
+        batch = []
+        for message in Message.objects.filter(thread=thread).order_by('timestamp', 'pk').only('pk').iterator():
+            seq += 1
+            message.seq = seq
+            batch.append(message)
+            if len(batch) >= 1000:
+                Message.objects.bulk_update(batch, ['seq'])
+                batch = []
+        Message.objects.bulk_update(batch, ['seq'])
+        MessageThread.objects.filter(pk=thread.pk).update(last_seq=seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0005_migrate_prefixed_invites'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='messagethread',
+            name='last_seq',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_seq, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('thread', 'seq'), name='unique_message_seq_per_thread'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Existing history counts as read, so nobody gets a huge unread badge on deploy.
+def mark_history_read(apps, schema_editor):
+    MessageThread = apps.get_model('messaging', 'MessageThread')
+    ThreadReadState = apps.get_model('messaging', 'ThreadReadState')
+
+    for thread in MessageThread.objects.prefetch_related('participants').iterator(chunk_size=500):
+        ThreadReadState.objects.bulk_create([
+            ThreadReadState(user=user, thread=thread, last_read_seq=thread.last_seq)
+            for user in thread.participants.all()
+        ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0006_message_seq'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_seq', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='messaging.messagethread')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='thread_read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'thread'), name='unique_read_state_per_user_thread')],
+            },
+        ),
+        migrations.RunPython(mark_history_read, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:04
+
+from django.db import migrations, models
+
+from messaging.rendering import rerender_stale_messages
+
+
+# Renders the HTML of every existing message.
+def render_existing(apps, schema_editor):
+    Message = apps.get_model('messaging', 'Message')
+    for _ in rerender_stale_messages(Message, batch_size=1000):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0007_threadreadstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='content_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='content_html_version',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(render_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Adds the full-text index used by message search (see messaging/search.py).
+
+from django.db import migrations
+
+from messaging.search import install_search_index, remove_search_index
+
+
+def forwards(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+
+
+def backwards(apps, schema_editor):
+    remove_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0008_message_content_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
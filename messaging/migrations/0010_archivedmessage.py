@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0009_message_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('seq', models.PositiveIntegerField()),
+                ('content', models.TextField(blank=True)),
+                ('image', models.ImageField(blank=True, null=True, upload_to='chat_images/')),
+                ('timestamp', models.DateTimeField()),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='messaging.messagethread')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('thread', 'seq'), name='unique_archived_seq_per_thread')],
+            },
+        ),
+    ]
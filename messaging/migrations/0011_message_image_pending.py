@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0010_archivedmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='image_pending',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('messaging', '0012_archivedmessage_image_variants_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='stored_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.storedimage'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='stored_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.storedimage'),
+        ),
+    ]
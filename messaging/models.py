@@ -4,12 +4,11 @@
 from django.db import models
 # Import settings from django.conf because 'MessageThread' and 'Message' need to link to the User model.
 from django.conf import settings
-
-# Imports for image processing
-from PIL import Image
-from io import BytesIO
-from django.core.files.base import ContentFile
-import os
+# Import transaction and F because 'MessageThread.allocate_seq' hands out sequence numbers atomically.
+from django.db import transaction
+from django.db.models import F
+# Import the renderer from .rendering because 'Message' stores its text pre-rendered as HTML.
+from .rendering import render_message_html, RENDERER_VERSION
 
 """
 Author: Cole
@@ -26,12 +25,31 @@ class MessageThread(models.Model):
     participants = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='message_threads')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # The sequence number given to the newest message in this thread
+    last_seq = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         if self.name:
             return self.name
         return f"Thread between {self.participants.count()} users"
 
+    # 'last_seq' is only ever changed by 'allocate_seq'. Views call thread.save() after
+    # posting a message to bump 'updated_at', and that must not write back a stale counter.
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'last_seq'
+            ]
+        super().save(*args, **kwargs)
+
+    # Bumps the thread's counter and returns the new value. Must run inside a transaction
+    # so the row stays locked until the message using the number is committed.
+    @classmethod
+    def allocate_seq(cls, thread_id):
+        cls.objects.filter(pk=thread_id).update(last_seq=F('last_seq') + 1)
+        return cls.objects.filter(pk=thread_id).values_list('last_seq', flat=True).get()
+
 """
 Author: Cole
 This class represents a single message within a MessageThread.
@@ -40,62 +58,160 @@ It stores the actual text content of the message, who sent it
 linked back to the specific 'thread' it belongs to.
 RT: New 'Message' objects are created and saved in real-time
 when users send messages via the WebSocket chat. Session invite
-messages also use this model.
+messages also use this model. Every message gets a 'seq' number
+that only ever goes up inside its thread, so a reconnecting chat
+socket can ask for exactly the messages it missed. The text is also
+stored pre-rendered as safe HTML ('content_html'), so pages and live
+broadcasts never have to escape and linkify it again.
 """
 class Message(models.Model):
     thread = models.ForeignKey(MessageThread, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     # MODIFICATION: Allow content to be blank (for image-only messages)
     content = models.TextField(blank=True)
+    # 'content' as escaped HTML with clickable links, filled in on save (see messaging/rendering.py)
+    content_html = models.TextField(blank=True, default='', editable=False)
+    # The RENDERER_VERSION that produced 'content_html'
+    content_html_version = models.PositiveSmallIntegerField(default=0, editable=False)
     # Angie: Added an image field
     image = models.ImageField(upload_to='chat_images/', blank=True, null=True)
+    # True while the uploaded image is still being resized (see core/image_jobs.py)
+    image_pending = models.BooleanField(default=False)
+    # Smaller WebP/JPEG copies of the image: {'width': main width, 'sizes': [[size, width], ...]}
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # The shared processed file this image uses, if any (see core.models.StoredImage)
+    stored_image = models.ForeignKey('core.StoredImage', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+    # Marks the message as a session invite bubble; the invite details live on 'SessionInvite'
+    is_session_invite = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Position of this message inside its thread (1, 2, 3...)
+    seq = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['thread', 'seq'], name='unique_message_seq_per_thread'),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender} in thread {self.thread.id}"
 
-    # Optimization: Auto-resize image before saving
+    # Fills in 'content_html' from 'content' with the current renderer.
+    def render_content(self):
+        self.content_html = render_message_html(self.content)
+        self.content_html_version = RENDERER_VERSION
+
     def save(self, *args, **kwargs):
-        if self.image:
-            # We need to ensure the file pointer is at the start before we do anything
-            if hasattr(self.image, 'seek'):
-                self.image.seek(0)
-
-            # Open the image using Pillow
-            try:
-                img = Image.open(self.image)
-                
-                # Convert to RGB if it's not (e.g. PNG with alpha) to save as JPEG
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Define max size (e.g., 1024x1024 for chat images)
-                max_size = (1024, 1024)
-                
-                # Resize only if larger than max_size
-                if img.height > max_size[1] or img.width > max_size[0]:
-                    img.thumbnail(max_size, Image.Resampling.LANCZOS)
-                    
-                    # Save the resized image to a BytesIO object
-                    output = BytesIO()
-                    img.save(output, format='JPEG', quality=75)
-                    output.seek(0)
-                    
-                    # Replace the image field with the processed content
-                    # We ensure the extension is .jpg since we converted to JPEG
-                    new_name = os.path.splitext(self.image.name)[0] + '.jpg'
-                    self.image = ContentFile(output.read(), name=new_name)
-                else:
-                    # CRITICAL FIX: If we didn't resize, we must reset the pointer 
-                    # because Image.open() might have read from the file.
-                    if hasattr(self.image, 'seek'):
-                        self.image.seek(0)
-
-            except Exception as e:
-                print(f"Error optimizing image: {e}")
-                # If optimization fails, we MUST reset the pointer to save the original
-                if hasattr(self.image, 'seek'):
-                    self.image.seek(0)
+        # Render the HTML once here, whenever the text is being written
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.render_content()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'content_html', 'content_html_version'}
+
+        if self._state.adding and not self.seq:
+            # Allocate the sequence number and insert in one transaction
+            with transaction.atomic():
+                self.seq = MessageThread.allocate_seq(self.thread_id)
+                super().save(*args, **kwargs)
+            # Keep an already-loaded thread object in step with the database
+            if self._meta.get_field('thread').is_cached(self):
+                self.thread.last_seq = self.seq
+            return
 
         super().save(*args, **kwargs)
 
+
+"""
+This class represents a single person's invite to a live study
+'Session'. One row is created for every invited buddy, and they all
+point back at the chat 'message' that shows the invite bubble. The
+'status' tracks whether the invitee has answered yet.
+RT: The (invitee, status) index lets the notification badge count
+pending invites and the accept/decline views find an invite without
+scanning the Message table.
+"""
+class SessionInvite(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_ACCEPTED = 'accepted'
+    STATUS_DECLINED = 'declined'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_ACCEPTED, 'Accepted'),
+        (STATUS_DECLINED, 'Declined'),
+    ]
+
+    session = models.ForeignKey('rooms.Session', on_delete=models.CASCADE, related_name='invites')
+    inviter = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sent_session_invites')
+    invitee = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='session_invites')
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='invites')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    responded_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['invitee', 'status'], name='invite_invitee_status_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'invitee'], name='unique_invite_per_message'),
+        ]
+
+    def __str__(self):
+        return f"Invite for {self.invitee} to session {self.session_id} ({self.status})"
+
+"""
+This class remembers how far a user has read in a thread. It stores
+the 'seq' of the newest message they have seen, so the number of
+unread messages is simply the thread's 'last_seq' minus this value.
+No counting of rows is ever needed.
+RT: Updated (debounced) by the chat WebSocket's 'read' event.
+"""
+class ThreadReadState(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='thread_read_states')
+    thread = models.ForeignKey(MessageThread, on_delete=models.CASCADE, related_name='read_states')
+    last_read_seq = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'thread'], name='unique_read_state_per_user_thread'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} read thread {self.thread_id} up to {self.last_read_seq}"
+
+"""
+This class is the "cold" half of the message history. Messages older
+than MESSAGE_ARCHIVE_AFTER_DAYS are moved here in batches by
+'python manage.py archive_messages', which keeps the live 'Message'
+table (and its indexes) small. A row keeps the original message id
+and 'seq', so links and the history pager work the same either way.
+Only the text is stored; the HTML is rendered when a page is shown.
+RT: Never touched by the real-time chat, only by scrolling far back.
+"""
+class ArchivedMessage(models.Model):
+    # Same id the message had in the 'Message' table
+    id = models.BigIntegerField(primary_key=True)
+    thread = models.ForeignKey(MessageThread, on_delete=models.CASCADE, related_name='archived_messages')
+    sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    seq = models.PositiveIntegerField()
+    content = models.TextField(blank=True)
+    image = models.ImageField(upload_to='chat_images/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    stored_image = models.ForeignKey('core.StoredImage', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+    timestamp = models.DateTimeField()
+
+    # Archived messages are never session invites (those stay in 'Message')
+    is_session_invite = False
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['thread', 'seq'], name='unique_archived_seq_per_thread'),
+        ]
+
+    def __str__(self):
+        return f"Archived message from {self.sender} in thread {self.thread_id}"
+
+    @property
+    def content_html(self):
+        return render_message_html(self.content)
@@ -0,0 +1,64 @@
+# messaging/rendering.py
+
+# Import re because links are found with a regular expression.
+import re
+# Import escape from django.utils.html because message text must be HTML-escaped before links are added.
+from django.utils.html import escape
+
+# Bump this whenever 'render_message_html' changes its output. Messages store the
+# version they were rendered with, and 'python manage.py rerender_messages'
+# re-renders every message rendered with an older version.
+RENDERER_VERSION = 1
+
+# Regex to find URLs
+URL_REGEX = re.compile(
+    r'(https?://\S+|www\.\S+)'
+)
+
+"""
+Author: Cole
+Turns the plain text of a chat message into safe HTML: everything is
+escaped first, then web addresses become clickable links that open in
+a new tab. This runs once when a message is saved (the result lives in
+'Message.content_html'), not every time the inbox is displayed.
+RT: Also used for the HTML sent with live chat messages.
+"""
+def render_message_html(text):
+    if not text:
+        return ''
+    safe_text = escape(text)
+    def replace(match):
+        url = match.group(0)
+        href = url
+        if not href.startswith('http'):
+            href = 'http://' + href
+        return f'<a href="{href}" target="_blank" rel="noopener noreferrer" style="text-decoration: underline; color: inherit;">{url}</a>'
+    return URL_REGEX.sub(replace, safe_text)
+
+
+"""
+Re-renders every message whose 'content_html' was made by an older
+RENDERER_VERSION, 'batch_size' rows at a time, walking the table in
+primary key order. It yields (messages done so far, last pk) after
+each batch so callers can print progress. Finished rows carry the new
+version, so if it's stopped partway, running it again picks up where
+it left off. 'Message' is passed in so migrations can use their
+historical model.
+"""
+def rerender_stale_messages(Message, batch_size=500):
+    done = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            Message.objects.filter(pk__gt=last_pk, content_html_version__lt=RENDERER_VERSION)
+            .order_by('pk').only('pk', 'content')[:batch_size]
+        )
+        if not batch:
+            return
+        for message in batch:
+            message.content_html = render_message_html(message.content)
+            message.content_html_version = RENDERER_VERSION
+        Message.objects.bulk_update(batch, ['content_html', 'content_html_version'])
+        done += len(batch)
+        last_pk = batch[-1].pk
+        yield done, last_pk
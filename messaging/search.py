@@ -0,0 +1,182 @@
+# messaging/search.py
+
+# Import re because search text is split into words before it's handed to SQLite.
+import re
+# Import connection from django.db because the search SQL depends on the database in use.
+from django.db import connection
+# Import escape from django.utils.html because snippets are made from raw message text.
+from django.utils.html import escape
+# Import models from .models because search results are returned as Message objects.
+from .models import Message, MessageThread
+
+# How many results one page of search shows.
+SEARCH_PAGE_SIZE = 20
+# At most this many words of the search text are used.
+MAX_SEARCH_TERMS = 8
+# The database marks matched words with these two private-use characters. They are
+# swapped for <mark> tags only after the snippet has been HTML-escaped.
+SNIPPET_START = '\ue000'
+SNIPPET_END = '\ue001'
+
+# Full-text index objects. PostgreSQL gets a generated tsvector column with a GIN
+# index; SQLite gets an FTS5 table that mirrors 'content' through triggers.
+PG_SEARCH_COLUMN = 'search_vector'
+PG_SEARCH_INDEX = 'messaging_message_search_idx'
+SQLITE_FTS_TABLE = 'messaging_message_fts'
+SQLITE_TRIGGERS = ('messaging_message_fts_ai', 'messaging_message_fts_ad', 'messaging_message_fts_au')
+
+
+"""
+Author: Cole
+Creates the full-text index for chat messages if it isn't there yet.
+It's called by migration 0009 and again after every 'migrate' (see
+apps.py): when SQLite rebuilds the message table during a migration,
+the table's triggers are dropped with it, so they are put back and
+the FTS table is rebuilt from the messages. On PostgreSQL the tsvector
+column is generated by the database, so it can never go out of sync.
+Other databases fall back to a plain text scan.
+"""
+def install_search_index(conn=connection):
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            cursor.execute(
+                f"ALTER TABLE messaging_message ADD COLUMN IF NOT EXISTS {PG_SEARCH_COLUMN} tsvector "
+                f"GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {PG_SEARCH_INDEX} ON messaging_message USING GIN ({PG_SEARCH_COLUMN})"
+            )
+        elif conn.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'messaging_message' "
+                "AND name LIKE 'messaging_message_fts_%'"
+            )
+            if cursor.fetchone()[0] == len(SQLITE_TRIGGERS):
+                return
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5("
+                f"content, content='messaging_message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS messaging_message_fts_ai AFTER INSERT ON messaging_message BEGIN "
+                f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS messaging_message_fts_ad AFTER DELETE ON messaging_message BEGIN "
+                f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS messaging_message_fts_au AFTER UPDATE OF content ON messaging_message BEGIN "
+                f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+                f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END"
+            )
+            # Index whatever was written while the triggers were missing
+            cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+
+
+# Removes the full-text index (used when migration 0009 is reversed).
+def remove_search_index(conn=connection):
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            cursor.execute(f"DROP INDEX IF EXISTS {PG_SEARCH_INDEX}")
+            cursor.execute(f"ALTER TABLE messaging_message DROP COLUMN IF EXISTS {PG_SEARCH_COLUMN}")
+        elif conn.vendor == 'sqlite':
+            for trigger in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            cursor.execute(f"DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}")
+
+
+# Turns search text into an FTS5 query: every word quoted (so punctuation can't be
+# read as query syntax), all words required, and the last one matched as a prefix.
+def build_fts5_query(text):
+    terms = re.findall(r'\w+', text)[:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+    quoted = ['"{}"'.format(term.replace('"', '""')) for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+# Escapes a snippet from the database and turns its match markers into <mark> tags.
+def highlight_snippet(snippet):
+    return escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+
+
+"""
+Author: Cole
+Searches the messages of every thread 'user' belongs to, newest
+first. Paging is by keyset: pass the 'before' id returned with one
+page to get the next, so deep pages cost the same as the first. On
+PostgreSQL and SQLite matches come from the full-text index (never a
+scan of the message table) and the thread check uses the participants
+table.
+
+Returns (results, next_before). The results are Message objects (with
+their sender loaded) carrying a highlighted 'snippet' (safe HTML).
+'next_before' is None on the last page.
+"""
+def search_messages(user, text, before=None, limit=SEARCH_PAGE_SIZE):
+    text = (text or '').strip()
+    if not text:
+        return [], None
+
+    participants_table = MessageThread.participants.through._meta.db_table
+    params = []
+    if connection.vendor == 'postgresql':
+        sql = (
+            f"SELECT m.id, "
+            f"ts_headline('english', m.content, q, %s) "
+            f"FROM messaging_message m, websearch_to_tsquery('english', %s) q "
+            f"WHERE m.{PG_SEARCH_COLUMN} @@ q "
+        )
+        params += [
+            f'StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxWords=24, MinWords=8, MaxFragments=1',
+            text,
+        ]
+    elif connection.vendor == 'sqlite':
+        query = build_fts5_query(text)
+        if query is None:
+            return [], None
+        sql = (
+            f"SELECT m.id, "
+            f"snippet({SQLITE_FTS_TABLE}, 0, %s, %s, '…', 16) "
+            f"FROM {SQLITE_FTS_TABLE} JOIN messaging_message m ON m.id = {SQLITE_FTS_TABLE}.rowid "
+            f"WHERE {SQLITE_FTS_TABLE} MATCH %s "
+        )
+        params += [SNIPPET_START, SNIPPET_END, query]
+    else:
+        # No full-text index on this database; the content itself stands in for the snippet
+        sql = (
+            "SELECT m.id, m.content "
+            "FROM messaging_message m WHERE m.content LIKE %s "
+        )
+        params.append('%' + text.replace('%', '').replace('_', '') + '%')
+
+    # On SQLite, ordering and paging on the FTS table's own rowid lets FTS5 walk its
+    # index newest-first and stop after one page, instead of sorting every match.
+    id_column = f'{SQLITE_FTS_TABLE}.rowid' if connection.vendor == 'sqlite' else 'm.id'
+    sql += f"AND m.thread_id IN (SELECT messagethread_id FROM {participants_table} WHERE user_id = %s) "
+    params.append(user.pk)
+    if before:
+        sql += f"AND {id_column} < %s "
+        params.append(before)
+    sql += f"ORDER BY {id_column} DESC LIMIT %s"
+    params.append(limit + 1)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    has_more = len(rows) > limit
+
+    rows = rows[:limit]
+    messages = Message.objects.select_related('sender').in_bulk([row[0] for row in rows])
+    results = []
+    for pk, snippet in rows:
+        message = messages.get(pk)
+        if message is None:
+            continue  # Deleted since it matched
+        message.snippet = highlight_snippet(snippet or '')
+        results.append(message)
+    # Continue after the last match looked at, even if it has since been deleted
+    next_before = rows[-1][0] if has_more else None
+    return results, next_before
@@ -3,13 +3,14 @@
 # Import path from django.urls because it's needed to define URL routes.
 from django.urls import path
 # Import views from .views because we need to map URLs to these functions.
-from .views import inbox_view, upload_chat_image_view, leave_thread_view
+from .views import inbox_view, upload_chat_image_view, leave_thread_view, search_messages_view, thread_history_view
 
 """
 Author: Cole
 This file defines the web addresses (URLs) for the 'messaging'
 app. It maps the URL for the main inbox page, image uploads,
-leaving threads, and specific conversations to their respective views.
+leaving threads, message search, older message history, and specific conversations to their
+respective views.
 """
 urlpatterns = [
     # Route for the main inbox page (no specific thread selected)
@@ -18,6 +19,12 @@ urlpatterns = [
     # Route for handling image uploads
     path('upload-image/<int:thread_id>/', upload_chat_image_view, name='upload_chat_image'),
     
+    # Route for searching your conversations (HTMX)
+    path('search/', search_messages_view, name='search_messages'),
+
+    # Route for loading older messages of a conversation (HTMX)
+    path('<int:thread_id>/history/', thread_history_view, name='thread_history'),
+
     # Route for leaving a group chat
     path('leave/<int:thread_id>/', leave_thread_view, name='leave_thread'),
 
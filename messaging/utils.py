@@ -1,9 +1,22 @@
 # messaging/utils.py
 
 # Import Count from django.db.models because 'get_or_create_message_thread' needs it to count participants.
-from django.db.models import Count
+# Import F, OuterRef, Subquery, Sum because 'compute_unread_total' derives unread counts from sequence numbers.
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db import transaction
+# Import cache from django.core.cache because the header's unread total is kept there.
+from django.core.cache import cache
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+from core.wire import frame_event
 # Import MessageThread from .models because 'get_or_create_message_thread' needs it to find or create threads.
-from .models import MessageThread
+# Import SessionInvite from .models because 'get_pending_invites_count' needs it to count open invites.
+# Import ThreadReadState from .models because the unread helpers move users' read pointers.
+from .models import MessageThread, SessionInvite, ThreadReadState
+
+# Cache key for a user's total number of unread messages (formatted with the user's ID).
+UNREAD_TOTAL_CACHE_KEY = 'unread_total_{}'
 
 """
 Author: Cole
@@ -37,3 +50,183 @@ def get_or_create_message_thread(participants):
     thread = MessageThread.objects.create()
     thread.participants.set(participants)
     return thread
+
+"""
+Author: Cole
+The same as calling 'get_or_create_message_thread([user, other])' for
+every user in 'others', but with one query for all of them instead of
+several per person (the buddy list shows a "Message" button for each
+buddy). Only people who have no one-on-one thread with 'user' yet go
+through 'get_or_create_message_thread'. When there is more than one
+such thread, the oldest is used, like 'get_or_create_message_thread'.
+Returns {other user's ID: thread ID}.
+"""
+def get_direct_thread_ids(user, others):
+    two_person_threads = MessageThread.objects.annotate(
+        num_participants=Count('participants')
+    ).filter(num_participants=2).filter(participants=user)
+    Participant = MessageThread.participants.through
+    rows = Participant.objects.filter(
+        messagethread__in=two_person_threads.values('pk'), user__in=others
+    ).order_by('-messagethread_id').values_list('user_id', 'messagethread_id')
+    thread_ids = dict(rows)  # Later (older) threads overwrite newer ones
+
+    for other in others:
+        if other.pk not in thread_ids:
+            thread_ids[other.pk] = get_or_create_message_thread([user, other]).pk
+    return thread_ids
+
+"""
+This helper counts how many session invites are still waiting
+for an answer from the given user. It only touches the
+(invitee, status) index on 'SessionInvite', so it is cheap enough
+to run on every page load.
+RT: Used to keep the red notification badge in the header up to date.
+"""
+def get_pending_invites_count(user):
+    return SessionInvite.objects.filter(
+        invitee=user,
+        status=SessionInvite.STATUS_PENDING
+    ).count()
+
+"""
+This helper turns a saved 'Message' into the small dictionary the
+chat WebSocket sends to the browser. Keeping it in one place means
+live messages and replayed (resumed) messages look exactly the same
+to 'main.js'.
+RT: Used by the chat consumer and the image upload view.
+"""
+def serialize_message(message):
+    return {
+        'type': 'chat_message',
+        'message': message.content or None,
+        'message_html': message.content_html,
+        'image_url': message.image.url if message.image and not message.image_pending else None,
+        'image_pending': message.image_pending,
+        'message_id': message.pk,
+        'sender_id': message.sender_id,
+        'sender_first_name': message.sender.first_name,
+        'seq': message.seq,
+    }
+
+"""
+This helper works out how many unread messages a user has across
+all of their threads, straight from the database. For each thread it
+takes 'last_seq' minus the user's read pointer (a missing pointer
+means nothing was read yet). It is only used when the cached total
+is missing, e.g. right after a server restart.
+"""
+def compute_unread_total(user):
+    read_seq = ThreadReadState.objects.filter(user=user, thread=OuterRef('pk')).values('last_read_seq')[:1]
+    total = MessageThread.objects.filter(participants=user).annotate(
+        unread=F('last_seq') - Coalesce(Subquery(read_seq), 0)
+    ).aggregate(total=Sum('unread'))['total']
+    return max(total or 0, 0)
+
+"""
+This helper returns the user's unread message total for the header
+badge. Normally it is a single cache read; the total is kept up to
+date by 'note_new_message' and 'mark_thread_read' adding and
+subtracting as things happen, so page loads never run an aggregate.
+RT: Powers the unread part of the "Messages" notification badge.
+"""
+def get_unread_total(user):
+    key = UNREAD_TOTAL_CACHE_KEY.format(user.pk)
+    total = cache.get(key)
+    if total is None:
+        total = compute_unread_total(user)
+        cache.set(key, total, timeout=None)
+    return total
+
+# Adds 'delta' to a cached unread total. Returns the new total, or None if it isn't
+# cached (the next 'get_unread_total' call rebuilds it from the database).
+def adjust_unread_total(user_id, delta):
+    key = UNREAD_TOTAL_CACHE_KEY.format(user_id)
+    try:
+        total = cache.incr(key, delta)
+    except ValueError:
+        return None
+    if total < 0:
+        # Out of sync somehow, drop it so it gets recomputed
+        cache.delete(key)
+        return None
+    return total
+
+# Pushes a new unread total to every open tab of the user (updates the header badge).
+def push_unread_total(user_id, total):
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        f'notifications_for_user_{user_id}',
+        frame_event('send_notification', {'type': 'notification', 'message': {'unread_total': total}})
+    )
+
+"""
+This helper moves a user's read pointer in a thread forward to 'seq'
+(never backwards, and never past the newest message). The difference
+is taken off the user's cached unread total. Returns the new total,
+or None if nothing changed or the total isn't cached.
+RT: Called when the chat WebSocket flushes a 'read' event and when a
+thread is opened or a message is sent.
+"""
+def mark_thread_read(user, thread_id, seq):
+    with transaction.atomic():
+        last_seq = MessageThread.objects.filter(pk=thread_id, participants=user).values_list('last_seq', flat=True).first()
+        if last_seq is None:
+            return None  # Not a participant (or the thread is gone)
+        seq = min(seq, last_seq)
+        state, _ = ThreadReadState.objects.select_for_update().get_or_create(user=user, thread_id=thread_id)
+        if seq <= state.last_read_seq:
+            return None
+        delta = seq - state.last_read_seq
+        state.last_read_seq = seq
+        state.save(update_fields=['last_read_seq', 'updated_at'])
+    return adjust_unread_total(user.pk, -delta)
+
+"""
+This helper takes a thread the user is leaving off their cached
+unread total: whatever they hadn't read there stops counting. Call it
+before they are removed from the thread (their read pointer goes with
+the thread if it's deleted). Returns the new total, or None if there
+was nothing to take off or the total isn't cached.
+"""
+def forget_thread_unread(user, thread):
+    last_read_seq = ThreadReadState.objects.filter(user=user, thread=thread).values_list('last_read_seq', flat=True).first()
+    unread = thread.last_seq - (last_read_seq or 0)
+    if unread <= 0:
+        return None
+    return adjust_unread_total(user.pk, -unread)
+
+"""
+This helper is called right after a new message is saved. The sender
+has obviously read their own thread, so their pointer moves up to the
+new message. Every other participant gets +1 on their unread total,
+and the new total is pushed to their header badge.
+RT: Keeps unread badges live without any counting queries.
+"""
+def note_new_message(message):
+    mark_thread_read(message.sender, message.thread_id, message.seq)
+    recipient_ids = MessageThread.participants.through.objects.filter(
+        messagethread_id=message.thread_id
+    ).exclude(user_id=message.sender_id).values_list('user_id', flat=True)
+    for user_id in recipient_ids:
+        total = adjust_unread_total(user_id, 1)
+        if total is not None:
+            push_unread_total(user_id, total)
+
+"""
+This helper tells everyone in a chat that an uploaded image has
+finished processing, so the "Processing image..." placeholder in its
+bubble can be swapped for the final picture.
+RT: Passed to 'schedule_image_processing' by the image upload view.
+"""
+def push_chat_image_ready(message):
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        f'chat_{message.thread_id}',
+        frame_event('chat_message', {
+            'type': 'image_ready',
+            'message_id': message.pk,
+            'seq': message.seq,
+            'image_url': message.image.url,
+        })
+    )
@@ -2,9 +2,18 @@
 
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from .models import MessageThread, Message
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import MessageThread, Message, ThreadReadState
+from .utils import mark_thread_read, note_new_message, push_unread_total, push_chat_image_ready, serialize_message, forget_thread_unread
 from .forms import MessageForm
+from .search import search_messages
+from .archive import get_history_page
 from core.utils import get_online_user_ids
+from core.wire import frame_event
+from core.image_jobs import store_upload, schedule_image_processing
+from core.models import StoredImage
+from core.uploads import accepts_image_uploads, upload_rejection
 from django.http import HttpResponse, HttpResponseForbidden
 from django.views.decorators.http import require_POST
 from channels.layers import get_channel_layer
@@ -13,24 +22,37 @@ import json
 
 @login_required
 def inbox_view(request, thread_id=None):
-    # Get all message threads the user is part of, newest first
-    my_threads = request.user.message_threads.all().order_by('-updated_at')
-    
-    # For each thread, find the other participants (not the logged-in user)
-    for thread in my_threads:
-        thread.other_participants = thread.participants.exclude(id=request.user.id)
-
     selected_thread = None
     messages = []
+    has_more = False
+    is_group = False
     form = MessageForm()
     
     if thread_id:
         selected_thread = get_object_or_404(MessageThread, pk=thread_id)
         if request.user not in selected_thread.participants.all():
             return redirect('inbox') 
+
+        # Opening a thread reads everything in it (and updates the badge in other tabs)
+        unread_total = mark_thread_read(request.user, selected_thread.pk, selected_thread.last_seq)
+        if unread_total is not None:
+            push_unread_total(request.user.pk, unread_total)
         
         selected_thread.other_participants = selected_thread.participants.exclude(id=request.user.id)
-        messages = selected_thread.messages.all().order_by('timestamp')
+        is_group = selected_thread.participants.count() > 2
+        # Only the newest page is rendered; older pages load on demand (see thread_history_view)
+        messages, has_more = get_history_page(selected_thread, request.user)
+
+    # Get all message threads the user is part of, newest first.
+    # Unread count per thread is last_seq minus the user's read pointer (no COUNT queries).
+    read_seq = ThreadReadState.objects.filter(user=request.user, thread=OuterRef('pk')).values('last_read_seq')[:1]
+    my_threads = request.user.message_threads.annotate(
+        unread_count=F('last_seq') - Coalesce(Subquery(read_seq), 0)
+    ).order_by('-updated_at')
+    
+    # For each thread, find the other participants (not the logged-in user)
+    for thread in my_threads:
+        thread.other_participants = thread.participants.exclude(id=request.user.id)
 
     online_user_ids = get_online_user_ids()
     
@@ -38,6 +60,8 @@ def inbox_view(request, thread_id=None):
         'my_threads': my_threads,
         'selected_thread': selected_thread,
         'messages': messages,
+        'has_more': has_more,
+        'is_group': is_group,
         'form': form,
         'online_user_ids': online_user_ids,
         'online_user_ids_json': json.dumps(list(online_user_ids)),
@@ -45,6 +69,26 @@ def inbox_view(request, thread_id=None):
     return render(request, 'messaging/inbox.html', context)
 
 
+@login_required
+def thread_history_view(request, thread_id):
+    thread = get_object_or_404(MessageThread, pk=thread_id)
+    if not thread.participants.filter(pk=request.user.pk).exists():
+        return HttpResponseForbidden()
+    try:
+        before_seq = int(request.GET.get('before_seq') or 0) or None
+    except ValueError:
+        before_seq = None
+    messages, has_more = get_history_page(thread, request.user, before_seq=before_seq)
+    context = {
+        'selected_thread': thread,
+        'messages': messages,
+        'has_more': has_more,
+        'is_group': thread.participants.count() > 2,
+    }
+    return render(request, 'messaging/partials/history_page.html', context)
+
+
+@accepts_image_uploads
 @login_required
 @require_POST
 def upload_chat_image_view(request, thread_id):
@@ -52,47 +96,62 @@ def upload_chat_image_view(request, thread_id):
     if request.user not in thread.participants.all():
         return HttpResponseForbidden()
 
+    # Uploads that are too big or not images were dropped while they arrived
+    rejection = upload_rejection(request, 'image')
+    if rejection:
+        return HttpResponse(rejection, status=400)
+
     if 'image' in request.FILES:
         image = request.FILES['image']
         
-        # Create the new message object with the image.
-        # .create() automatically calls .save(), triggering your optimization logic.
-        new_message = Message.objects.create(
-            thread=thread,
-            sender=request.user,
-            image=image
-        )
-        # Save to get the image URL (create() already saves, but we need the URL)
-        new_message.save()
+        # Store the upload as it is and answer straight away; a worker resizes it
+        # and then swaps the final image into the bubble (see core/image_jobs.py).
+        # An image that was uploaded before just reuses the processed file.
+        new_message = Message(thread=thread, sender=request.user)
+        sha256 = store_upload(new_message, image, StoredImage.KIND_CHAT)
         thread.save()  # Update thread's timestamp for sorting
+        note_new_message(new_message)  # Update read pointers and unread badges
 
         # --- Real-Time Broadcast ---
+        # Everyone sees a placeholder bubble until the image is ready
         channel_layer = get_channel_layer()
         room_group_name = f'chat_{thread.id}'
-        
-        broadcast_data = {
-            'type': 'chat_message',
-            'message': None,
-            'image_url': new_message.image.url,
-            'sender_id': request.user.id,
-            'sender_first_name': request.user.first_name,
-        }
+        broadcast_data = frame_event('chat_message', serialize_message(new_message))
         
         async_to_sync(channel_layer.group_send)(room_group_name, broadcast_data)
+        if sha256:
+            schedule_image_processing(new_message, StoredImage.KIND_CHAT, sha256, push_chat_image_ready)
         
         return HttpResponse(status=204)
     
     return HttpResponse("No image provided.", status=400)
 
+# HTMX: searches the user's own conversations and returns one page of results.
+# 'before' is the id of the last result already shown (keyset paging).
+@login_required
+def search_messages_view(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        before = int(request.GET.get('before') or 0) or None
+    except ValueError:
+        before = None
+    results, next_before = search_messages(request.user, query, before=before)
+    context = {'query': query, 'results': results, 'next_before': next_before, 'is_next_page': before is not None}
+    return render(request, 'messaging/partials/search_results.html', context)
+
 @login_required
 @require_POST
 def leave_thread_view(request, thread_id):
     thread = get_object_or_404(MessageThread, pk=thread_id)
     
     if request.user in thread.participants.all():
+        # The thread's unread messages stop counting towards the header badge
+        total = forget_thread_unread(request.user, thread)
         thread.participants.remove(request.user)
         if thread.participants.count() == 0:
             thread.delete()
+        if total is not None:
+            push_unread_total(request.user.pk, total)
         return redirect('inbox')
     
     return HttpResponseForbidden()
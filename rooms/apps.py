@@ -2,14 +2,35 @@
 
 # Import AppConfig from django.apps because it's the base class for a Django app configuration.
 from django.apps import AppConfig
+# Import post_migrate from django.db.models.signals because the search index is checked after every migrate.
+from django.db.models.signals import post_migrate
 
 """
 Author: Angie
 This class tells Django that an app named "rooms" exists.
 This app handles the course rooms, discussion threads/posts,
-and live study sessions features.
+and live study sessions features. Its "ready" function imports
+"signals.py", which keeps each thread's post count and last
+activity time up to date, and makes sure the search index is in
+place after every migrate.
 """
 # tells Django about this app: its name and default ID field type
 class RoomsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rooms'
+
+    def ready(self):
+        import rooms.signals
+        post_migrate.connect(restore_search_index, sender=self)
+
+
+# SQLite drops a table's triggers when a migration rebuilds the table, so after
+# every migrate the course search index is put back if it went missing.
+def restore_search_index(using, **kwargs):
+    from django.db import connections
+    from django.db.migrations.recorder import MigrationRecorder
+    from .search import install_search_index
+
+    connection = connections[using]
+    if MigrationRecorder(connection).migration_qs.filter(app='rooms', name='0005_search_index').exists():
+        install_search_index(connection)
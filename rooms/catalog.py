@@ -0,0 +1,164 @@
+# rooms/catalog.py
+
+# Import time because each process re-reads the shared activity counts (and, now and then, the courses) once they expire.
+import time
+# Import uuid4 from uuid because every catalog version gets a name no earlier version had.
+from uuid import uuid4
+# Import Lock from threading because several request threads share the catalog.
+from threading import Lock
+# Import get_user_model from django.contrib.auth because course members are counted through 'User.courses'.
+from django.contrib.auth import get_user_model
+# Import cache from django.core.cache because the catalog version and the counts are shared between server processes there.
+from django.core.cache import cache
+# Import Count from django.db.models because the counts are grouped by course in the database.
+from django.db.models import Count
+# Import timezone from django.utils because active sessions are the ones started recently.
+from django.utils import timezone
+# Import the models from .models because the catalog holds courses and counts their threads and sessions.
+from .models import Course, Thread, Session
+# Import SESSION_LIFETIME from .cleanup because a session counts as active until it would be cleaned up.
+from .cleanup import SESSION_LIFETIME
+
+# Shared cache key holding the name of the current catalog version (see 'bump_catalog_version').
+CATALOG_VERSION_KEY = 'course_catalog:version'
+# How long (in seconds) a process keeps its courses even if the version never
+# changes, in case a bump was missed (a course changed with '.update()', which
+# sends no signal, or the cache was cleared at the wrong moment).
+CATALOG_MAX_AGE = 10 * 60
+# Shared cache key holding the per-course counts.
+CATALOG_STATS_KEY = 'course_catalog:stats'
+# How long (in seconds) the per-course counts are kept before they are counted again.
+CATALOG_STATS_TIMEOUT = 5 * 60
+# The counts of a course with no members, threads or sessions yet.
+EMPTY_STATS = {'students': 0, 'threads': 0, 'sessions': 0}
+
+
+# Marks every process's catalog as out of date; called whenever a course is saved or deleted (rooms/signals.py).
+def bump_catalog_version():
+    cache.set(CATALOG_VERSION_KEY, uuid4().hex, None)
+
+
+# The name of the current catalog version, naming the first one if there is none (or it was evicted).
+def current_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, uuid4().hex, None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+"""
+Author: Angie
+Counts each course's students, threads and active sessions (ones
+started within SESSION_LIFETIME), with one grouped query each.
+Returns {course id: {'students': n, 'threads': n, 'sessions': n}};
+courses with nothing to count are left out.
+"""
+def count_course_activity():
+    stats = {}
+    memberships = get_user_model().courses.through.objects
+    since = timezone.now() - SESSION_LIFETIME
+    counted = {
+        'students': memberships.values('course_id').annotate(n=Count('pk')),
+        'threads': Thread.objects.values('course_id').annotate(n=Count('pk')),
+        'sessions': Session.objects.filter(created_at__gte=since).values('course_id').annotate(n=Count('pk')),
+    }
+    for name, rows in counted.items():
+        for row in rows.order_by():
+            stats.setdefault(row['course_id'], dict(EMPTY_STATS))[name] = row['n']
+    return stats
+
+
+"""
+Author: Angie
+Every course and tag, kept in each server process so the course
+list, the profile and session forms, and sign-up can find them
+without asking the database. The 'Course' table is small and only
+changes from the admin, so the whole table is loaded at once and kept
+until the shared catalog version changes (any course saved or
+deleted anywhere bumps it), or CATALOG_MAX_AGE has passed. Lookups
+by slug or by tag type are then plain dictionary hits.
+The per-course activity counts are shared through the cache too, and
+counted again every CATALOG_STATS_TIMEOUT seconds by whichever
+process first finds them missing, so showing them never runs a
+COUNT of its own.
+The courses handed out are shared by every request in the process,
+so they must not be changed.
+"""
+class CourseCatalog:
+    def __init__(self):
+        self.version = None
+        self.loaded_at = 0
+        self.courses = []   # every course, in id order
+        self.by_name = []   # every course, by name
+        self.by_slug = {}   # slug -> course
+        self.by_type = {}   # tag type -> courses, by name
+        self.stats = {}
+        self.stats_expire_at = 0
+        self.lock = Lock()
+
+    # Reloads the courses if another process (or this one) changed them since they were loaded, or they are too old.
+    def refresh(self):
+        version = current_catalog_version()
+        if version == self.version and self.fresh():
+            return
+        with self.lock:
+            if version == self.version and self.fresh():
+                return
+            courses = list(Course.objects.order_by('pk'))
+            by_name = sorted(courses, key=lambda course: course.name)
+            by_type = {tag_type: [] for tag_type, _ in Course.TAG_TYPE_CHOICES}
+            for course in by_name:
+                by_type.setdefault(course.tag_type, []).append(course)
+            self.courses = courses
+            self.by_name = by_name
+            self.by_slug = {course.slug: course for course in courses}
+            self.by_type = by_type
+            self.version = version
+            self.loaded_at = time.monotonic()
+
+    # True while the loaded courses are younger than CATALOG_MAX_AGE.
+    def fresh(self):
+        return time.monotonic() - self.loaded_at < CATALOG_MAX_AGE
+
+    # Every course and tag, in id order.
+    def all(self):
+        self.refresh()
+        return self.courses
+
+    # The course with this slug, or None.
+    def get(self, slug):
+        self.refresh()
+        return self.by_slug.get(slug)
+
+    # The courses with this tag type (every course and tag if None), by name.
+    def of_type(self, tag_type=None):
+        self.refresh()
+        if tag_type is None:
+            return self.by_name
+        return self.by_type.get(tag_type, [])
+
+    # The ids of the courses with this tag type.
+    def ids_of_type(self, tag_type):
+        return [course.pk for course in self.of_type(tag_type)]
+
+    # {course id: counts} as of the last count (see 'count_course_activity').
+    def activity(self):
+        if self.stats_expire_at > time.monotonic():
+            return self.stats
+        with self.lock:
+            if self.stats_expire_at <= time.monotonic():
+                stats = cache.get(CATALOG_STATS_KEY)
+                if stats is None:
+                    stats = count_course_activity()
+                    cache.set(CATALOG_STATS_KEY, stats, CATALOG_STATS_TIMEOUT)
+                self.stats = stats
+                self.stats_expire_at = time.monotonic() + CATALOG_STATS_TIMEOUT
+        return self.stats
+
+    # The counts of one course.
+    def activity_of(self, course):
+        return self.activity().get(course.pk, EMPTY_STATS)
+
+
+catalog = CourseCatalog()
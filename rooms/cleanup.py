@@ -0,0 +1,108 @@
+# rooms/cleanup.py
+
+# Import threading because the periodic cleanup runs on a background thread of the ASGI server.
+import threading
+# Import timedelta from datetime because sessions expire a fixed time after they start.
+from datetime import timedelta
+# Import cache from django.core.cache because server processes take turns through a shared lock there.
+from django.core.cache import cache
+# Import connection and transaction from django.db because each batch is deleted atomically, and the
+# cleanup thread closes its connection between runs.
+from django.db import connection, transaction
+# Import timezone from django.utils because session timestamps are timezone-aware.
+from django.utils import timezone
+# Import Session from .models because this module deletes expired sessions.
+from .models import Session
+
+# Live sessions are deleted this long after they start.
+SESSION_LIFETIME = timedelta(hours=12)
+# Cache key held by the server process whose cleanup thread is running this round.
+CLEANUP_LOCK_KEY = 'session_cleanup:lock'
+
+# The periodic cleanup thread, once 'start_session_cleanup' has started it.
+cleanup_thread = None
+
+
+"""
+Author: Evan
+Deletes the sessions created before 'cutoff', 'batch_size' at a
+time. Sessions are walked in id order (which is also the order they
+were created), so the walk stops at the first one that is still
+recent. Each batch is deleted in its own short transaction, together
+with its participant rows and invites, so no delete holds the tables
+for long. If the job is stopped, the finished batches are already gone
+and running it again continues with the rest.
+Yields (sessions deleted so far, last id looked at) after each batch.
+"""
+def delete_sessions_before(cutoff, batch_size=500):
+    deleted = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            Session.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'created_at')[:batch_size]
+        )
+        if not batch:
+            return
+
+        old = []
+        reached_recent = False
+        for pk, created_at in batch:
+            if created_at >= cutoff:
+                reached_recent = True
+                break
+            last_pk = pk
+            old.append(pk)
+
+        if old:
+            with transaction.atomic():
+                Session.objects.filter(pk__in=old).delete()
+            deleted += len(old)
+
+        yield deleted, last_pk
+        if reached_recent:
+            return
+
+
+# Deletes every session older than SESSION_LIFETIME and returns how many there were.
+def delete_expired_sessions(batch_size=500):
+    deleted = 0
+    for deleted, _ in delete_sessions_before(timezone.now() - SESSION_LIFETIME, batch_size=batch_size):
+        pass
+    return deleted
+
+
+"""
+Author: Evan
+Starts a background thread in this server process that deletes
+expired sessions every 'interval' seconds, so they go away on time
+without anyone running 'cleanup_sessions' or opening the maintenance
+page. It's started from config/asgi.py when SESSION_CLEANUP_INTERVAL
+is set. When several server processes run it, only the one that gets
+the lock works in each round; the lock is a key in the default cache,
+which is the Redis every process shares (see CACHES in
+config/settings.py). The thread is a daemon, so it never holds up the
+server shutting down.
+"""
+def start_session_cleanup(interval):
+    global cleanup_thread
+    if cleanup_thread is not None:
+        return
+    cleanup_thread = threading.Thread(
+        target=run_session_cleanup, args=(interval,), name='session-cleanup', daemon=True,
+    )
+    cleanup_thread.start()
+
+
+# The cleanup thread's loop: wait, then clean up if no other process is doing this round.
+def run_session_cleanup(interval):
+    stopped = threading.Event()  # never set; waits without busy-looping
+    while not stopped.wait(interval):
+        try:
+            if cache.add(CLEANUP_LOCK_KEY, True, interval):
+                delete_expired_sessions()
+        except Exception as e:
+            # Keep the thread alive; the next round tries again
+            print(f"Session cleanup failed: {e}")
+        finally:
+            # The thread lives on between rounds; don't leave its connection open
+            connection.close()
@@ -1,15 +1,24 @@
 # rooms/consumers.py
 
-# Import json because WebSocket messages are sent as text in JSON format.
-import json
-# Import asyncio because 'delayed_disconnect' needs it for 'sleep'.
+# Import asyncio because 'delayed_disconnect' and 'RoomConsumer.heartbeat' need it for 'sleep'.
 import asyncio
-# Import AsyncWebsocketConsumer from channels.generic.websocket because this is the base class for our real-time consumers.
-from channels.generic.websocket import AsyncWebsocketConsumer
+# Import random because room heartbeats are spread out over the start of each window.
+import random
+# Import time because a room heartbeat waits for the next viewer window.
+import time
+# Import WireWebsocketConsumer and frame_event from core.wire because they handle the JSON/MessagePack
+# formats and let each broadcast be encoded once for the whole group.
+from core.wire import WireWebsocketConsumer, frame_event
 # Import database_sync_to_async from channels.db because it lets our async code safely talk to the sync database cache.
 from channels.db import database_sync_to_async
 # Import cache from django.core.cache because 'update_online_users_cache' needs it.
 from django.core.cache import cache
+# Import the viewer helpers from .viewers because 'RoomConsumer' counts who is watching each room.
+from .viewers import (
+    VIEWER_WINDOW, room_group_name, thread_group_name, add_viewer, refresh_viewer, remove_viewer,
+)
+# Import Course and Thread from .models because a room socket is only accepted for a course (or thread) that exists.
+from .models import Course, Thread
 
 # A global group name for broadcasting presence updates (who is online/offline) to everyone.
 PRESENCE_GROUP_NAME = 'global_presence'
@@ -28,7 +37,7 @@ It manages two key real-time features:
     updates (for the green online dots).
 RT: This entire class handles real-time notifications and user presence updates.
 """
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(WireWebsocketConsumer):
     """
     Runs when a user first connects to the site (opens a tab).
     It checks if they are logged in. If so, it adds them to their
@@ -57,7 +66,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             # Add user to their personal group and the global group
             await self.channel_layer.group_add(self.group_name, self.channel_name)
             await self.channel_layer.group_add(PRESENCE_GROUP_NAME, self.channel_name)
-            await self.accept() # Accept the WebSocket connection
+            await self.accept_protocol() # Accept the WebSocket connection
 
             # Mark user as online and tell others
             await self.update_user_presence(is_online=True)
@@ -111,7 +120,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     """
     async def send_notification(self, event):
         # receives notifications from channel layer and sends to browser
-        await self.send(text_data=json.dumps({'type': 'notification', 'message': event['message']}))
+        await self.send_frames(event)
     
     """
     Receives a presence update message (someone went online/offline)
@@ -121,11 +130,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     """
     async def broadcast_presence(self, event):
         # receives presence updates (someone went online/offline) and sends to browser
-        await self.send(text_data=json.dumps({
-            'type': 'presence_update',
-            'user_pk': event['user_pk'],
-            'status': event['status']
-        }))
+        await self.send_frames(event)
 
     """
     Updates the central list of online users (stored in the cache)
@@ -139,7 +144,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         # Tell everyone else about the status change
         await self.channel_layer.group_send(
             PRESENCE_GROUP_NAME,
-            {'type': 'broadcast_presence', 'user_pk': self.user.pk, 'status': 'online' if is_online else 'offline'}
+            frame_event('broadcast_presence', {
+                'type': 'presence_update', 'user_pk': self.user.pk, 'status': 'online' if is_online else 'offline'
+            })
         )
     
     """
@@ -163,34 +170,109 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 This class handles the real-time updates within a specific
 course room page (the page showing discussion threads). It allows
 newly created threads and posts to appear instantly for everyone
-viewing that room without needing to refresh the page.
+viewing that room without needing to refresh the page. It also
+counts the sockets watching each room (rooms/viewers.py), which is
+shown on the page as "N viewing" and lets the views skip broadcasts
+to rooms nobody is watching. A socket follows either the whole room
+(the course page: new threads, and threads that got a reply) or one
+thread (the thread page: that thread's replies), so replies only go
+to the people reading the thread.
 RT: This entire class is for real-time updates in course room discussions.
 """
-class RoomConsumer(AsyncWebsocketConsumer):
+class RoomConsumer(WireWebsocketConsumer):
+    room_group_name = None
+    viewer_windows = None   # the viewer windows this socket has marked, once counted
+    heartbeat_task = None
+
     """
-    Runs when a user opens a specific course room page. It gets the
-    room's unique identifier ('slug') from the URL, creates a unique
-    group name for that room, and adds the user's connection to that
-    group.
+    Runs when a user opens a specific course room page (or one of its
+    threads). It gets the room's unique identifier ('slug'), and the
+    thread's id if there is one, from the URL, creates a unique group
+    name for that room or thread, and adds the user's connection to
+    that group. The connection is counted as one more viewer of the room
+    (and keeps itself counted with 'heartbeat' while it's open), and
+    everyone in it gets the new count. Sockets of logged-out users,
+    or for a course or thread that doesn't exist (or a thread of another
+    course), are closed without joining or being counted.
     RT: Connects the user to the specific course room's live update channel.
     """
     # Handles live course-room messages
     async def connect(self):
         self.room_slug = self.scope['url_route']['kwargs']['room_slug']
-        self.room_group_name = f'course_room_{self.room_slug}'
+        thread_pk = self.scope['url_route']['kwargs'].get('thread_pk')
+        if not self.scope['user'].is_authenticated or not await self.room_exists(thread_pk):
+            await self.close()
+            return
+        if thread_pk is None:
+            self.room_group_name = room_group_name(self.room_slug)
+        else:
+            self.room_group_name = thread_group_name(self.room_slug, thread_pk)
         # Add user to the group for this specific course room
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept() # Accept the WebSocket connection
+        await self.accept_protocol() # Accept the WebSocket connection
+        self.viewer_windows, count = await database_sync_to_async(add_viewer)(self.room_group_name)
+        self.heartbeat_task = asyncio.create_task(self.heartbeat(asyncio.current_task()))
+        await self.announce_viewers(count)
 
     """
     Runs when the user leaves the course room page or disconnects.
     It removes their connection from the course room's group so they
-    no longer receive live updates for that room.
+    no longer receive live updates for that room, and tells the ones
+    still there how many are left.
     RT: Disconnects the user from the course room's live update channel.
     """
     async def disconnect(self, close_code):
+        if self.room_group_name is None:
+            return  # Closed in 'connect', never joined
         # Remove user from the course room group
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        if self.viewer_windows is not None:
+            windows, self.viewer_windows = self.viewer_windows, None
+            count = await database_sync_to_async(remove_viewer)(self.room_group_name, windows)
+            if count:
+                await self.announce_viewers(count)
+
+    # Does the course (and the thread, if one was asked for, within that course) exist?
+    @database_sync_to_async
+    def room_exists(self, thread_pk):
+        if thread_pk is None:
+            return Course.objects.filter(slug=self.room_slug).exists()
+        return Thread.objects.filter(pk=thread_pk, course__slug=self.room_slug).exists()
+
+    """
+    Author: Oju
+    Keeps this socket counted as a viewer of its room: early in every
+    viewer window (at a random moment in its first third, so the sockets
+    don't all write at once) it marks the window in the shared cache.
+    If the server stops without running 'disconnect', the marks simply
+    stop, and the socket stops being counted within two windows. It
+    also stops once 'connection_task' (the task running this consumer)
+    is over, in case that was cancelled without 'disconnect'.
+    """
+    async def heartbeat(self, connection_task):
+        while True:
+            until_next_window = VIEWER_WINDOW - time.time() % VIEWER_WINDOW
+            await asyncio.sleep(until_next_window + random.uniform(0, VIEWER_WINDOW / 3))
+            if self.viewer_windows is None or connection_task.done():
+                return
+            try:
+                self.viewer_windows = await database_sync_to_async(refresh_viewer)(
+                    self.room_group_name, self.viewer_windows,
+                )
+            except Exception as e:
+                # Keep the heartbeat going; the next window tries again
+                print(f"Room heartbeat failed: {e}")
+
+    # Sends the room's viewer count ("N viewing") to everyone in it.
+    async def announce_viewers(self, count):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            frame_event('broadcast_viewers', {
+                'type': 'broadcast_message', 'message_type': 'viewers', 'viewers': count,
+            })
+        )
 
     """
     Receives a message (containing HTML for a new thread or post)
@@ -201,5 +283,8 @@ class RoomConsumer(AsyncWebsocketConsumer):
     """
     async def broadcast_message(self, event):
         # when server broadcasts a new thread/post, sends it straight to browser
-        await self.send(text_data=json.dumps(event))
+        await self.send_frames(event)
 
+    # Forwards the room's viewer count to the browser.
+    async def broadcast_viewers(self, event):
+        await self.send_frames(event)
@@ -4,6 +4,10 @@
 from django import forms # helper to make HTML forms and validate input
 # Import Course
 from .models import Thread, Post, Session, Course # our database tables
+# Import ModelChoiceIterator because the course choices are listed from the catalog
+from django.forms.models import ModelChoiceIterator
+# Import catalog because courses and tags are kept in memory there
+from .catalog import catalog
 
 """
 Author: Angie
@@ -46,6 +50,44 @@ class BuddyChoiceField(forms.ModelMultipleChoiceField):
     def label_from_instance(self, obj):
         return f"{obj.first_name} {obj.last_name}"
 
+"""
+Author: Angie
+These classes list the choices of a course or tag field from the
+course catalog (rooms/catalog.py) instead of the database, so showing
+a form with them runs no query. 'tag_type' picks which tags are
+offered (every course and tag if None). What is submitted is still
+checked against the database through 'queryset', like any other
+model choice field.
+"""
+class CatalogChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for course in catalog.of_type(self.field.tag_type):
+            yield self.choice(course)
+
+    def __len__(self):
+        return len(catalog.of_type(self.field.tag_type)) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(catalog.of_type(self.field.tag_type))
+
+class CatalogChoiceField(forms.ModelChoiceField):
+    iterator = CatalogChoiceIterator
+
+    def __init__(self, tag_type=None, **kwargs):
+        self.tag_type = tag_type
+        queryset = Course.objects.filter(tag_type=tag_type) if tag_type else Course.objects.all()
+        super().__init__(queryset=queryset, **kwargs)
+
+class CatalogMultipleChoiceField(forms.ModelMultipleChoiceField):
+    iterator = CatalogChoiceIterator
+
+    def __init__(self, tag_type=None, **kwargs):
+        self.tag_type = tag_type
+        queryset = Course.objects.filter(tag_type=tag_type) if tag_type else Course.objects.all()
+        super().__init__(queryset=queryset, **kwargs)
+
 """
 Author: Angie
 This class defines the form used for creating a new live study
@@ -68,6 +110,9 @@ class SessionCreateForm(forms.ModelForm):
         }
     )
 
+    # Show ALL tags (Courses, Interests, Hidden) in the dropdown
+    course = CatalogChoiceField()
+
     class Meta:
         model = Session
         fields = ['course', 'topic', 'buddies_to_invite']
@@ -81,6 +126,3 @@ class SessionCreateForm(forms.ModelForm):
             # Set the list of choices for 'buddies_to_invite' to be the user's buddies,
             # excluding themselves from the list.
             self.fields['buddies_to_invite'].queryset = user.buddies.exclude(pk=user.pk)
-
-        # Show ALL tags (Courses, Interests, Hidden) in the dropdown
-        self.fields['course'].queryset = Course.objects.all().order_by('name')
@@ -0,0 +1,128 @@
+# rooms/fragments.py
+
+# Import time because entries in the local cache expire like the shared ones.
+import time
+# Import OrderedDict from collections because the local cache drops the least recently used entry first.
+from collections import OrderedDict
+# Import Lock from threading because several request threads share the local cache.
+from threading import Lock
+# Import caches from django.core.cache because rendered fragments are shared between server processes in the 'fragments' cache.
+from django.core.cache import caches
+# Import render_to_string from django.template.loader because fragments are rendered from the partial templates.
+from django.template.loader import render_to_string
+# Import the models from .models because each kind of fragment belongs to one of them.
+from .models import Thread, Post
+# Import thread_cursor from .listing because a thread's last activity is already written as whole microseconds there.
+from .listing import thread_cursor
+
+# How long (in seconds) a rendered fragment is kept. Versions make sure changed
+# threads and posts are rendered again; this only bounds things the versions don't
+# cover (an author changing their name).
+FRAGMENT_TIMEOUT = 60 * 60
+# How many fragments each server process keeps in memory in front of the shared cache.
+LOCAL_FRAGMENT_LIMIT = 2000
+# Partial template and context name of each kind of fragment.
+FRAGMENT_TEMPLATES = {
+    Thread: ('rooms/partials/thread_item.html', 'thread'),
+    Post: ('rooms/partials/post_item.html', 'post'),
+}
+
+
+"""
+Author: Angie
+A small in-process LRU cache in front of the shared one, so a page
+full of fragments that were just shown doesn't even need a round trip
+to the shared cache. Entries expire after FRAGMENT_TIMEOUT like the
+shared ones, and only the LOCAL_FRAGMENT_LIMIT most recently used are
+kept.
+"""
+class LocalFragmentCache:
+    def __init__(self, limit):
+        self.limit = limit
+        self.entries = OrderedDict()  # key -> (expires_at, html)
+        self.lock = Lock()
+
+    # {key: html} for the keys that are here and not expired.
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] < now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = entry[1]
+        return found
+
+    def set_many(self, fragments):
+        expires_at = time.monotonic() + FRAGMENT_TIMEOUT
+        with self.lock:
+            for key, html in fragments.items():
+                self.entries[key] = (expires_at, html)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.limit:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+local_fragments = LocalFragmentCache(LOCAL_FRAGMENT_LIMIT)
+
+
+# Cache key of the rendered HTML of a thread or post, including its version.
+# A thread's item shows its post count and last activity, which change with
+# every new or deleted post (rooms/signals.py), so those are its version.
+def fragment_key(obj):
+    if isinstance(obj, Thread):
+        return f'room_fragment:thread:{obj.pk}:{obj.post_count}:{thread_cursor(obj)}'
+    return f'room_fragment:post:{obj.pk}:{obj.version}'
+
+
+"""
+Author: Angie
+Returns the HTML of 'thread_item.html' or 'post_item.html' for each
+of 'objects' (threads or posts), in order. Fragments are looked up in
+the local cache, then the shared cache (one 'get_many' for all that
+are missing), and only the rest are rendered, then stored in both.
+Fragments are the same for everyone who sees them (nothing in them
+depends on the request), which is what lets the course and thread
+pages, and the room broadcasts, all share them. The shared copies live in their
+own 'fragments' cache (see CACHES in config/settings.py), apart from
+the state kept in the default cache.
+"""
+def render_fragments(objects):
+    keys = [fragment_key(obj) for obj in objects]
+    found = local_fragments.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        shared = caches['fragments'].get_many(missing)
+        local_fragments.set_many(shared)
+        found.update(shared)
+
+    rendered = {}
+    for obj, key in zip(objects, keys):
+        if key not in found:
+            template_name, context_name = FRAGMENT_TEMPLATES[type(obj)]
+            found[key] = rendered[key] = render_to_string(template_name, {context_name: obj})
+    if rendered:
+        caches['fragments'].set_many(rendered, FRAGMENT_TIMEOUT)
+        local_fragments.set_many(rendered)
+    return [found[key] for key in keys]
+
+
+# The HTML of one thread or post (see 'render_fragments').
+def render_fragment(obj):
+    return render_fragments([obj])[0]
+
+
+# Drops the cached HTML of a thread or post that is being deleted.
+def forget_fragment(obj):
+    key = fragment_key(obj)
+    local_fragments.delete(key)
+    caches['fragments'].delete(key)
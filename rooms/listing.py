@@ -0,0 +1,81 @@
+# rooms/listing.py
+
+# Import datetime, timedelta and timezone from datetime because page cursors carry a time as whole microseconds.
+from datetime import datetime, timedelta, timezone
+# Import Q from django.db.models because the keyset condition is "older, or as old with a smaller id".
+from django.db.models import Q
+
+# How many threads one page of a course shows.
+THREAD_PAGE_SIZE = 25
+# How many replies one page of a thread shows.
+REPLY_PAGE_SIZE = 50
+# Cursor times are counted in microseconds from here.
+CURSOR_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+# The cursor that continues a listing after 'thread': '<last_post_at in microseconds>_<id>'.
+def thread_cursor(thread):
+    micros = (thread.last_post_at - CURSOR_EPOCH) // timedelta(microseconds=1)
+    return f'{micros}_{thread.pk}'
+
+
+# (last_post_at, id) from a cursor made by 'thread_cursor', or None if it's missing or malformed.
+def parse_thread_cursor(cursor):
+    try:
+        micros, pk = (int(part) for part in (cursor or '').split('_'))
+        return CURSOR_EPOCH + timedelta(microseconds=micros), pk
+    except (ValueError, OverflowError):
+        return None
+
+
+"""
+Author: Angie
+Returns one page of a course's threads, most recently active first
+(by the newest post, see 'Thread.last_post_at'). Paging is by keyset:
+pass the 'before' cursor returned with one page to get the next, and
+the database walks the (course, last_post_at, id) index from there,
+so every page costs the same however many threads the course has
+(the "events" course keeps growing with every 'import_events').
+Post counts come from 'Thread.post_count' and the author is joined
+in, so showing the page runs no more queries.
+Returns (threads, next_before); 'next_before' is None on the last page.
+"""
+def get_thread_page(course, before=None, limit=THREAD_PAGE_SIZE):
+    threads = course.threads.select_related('author').order_by('-last_post_at', '-pk')
+    position = parse_thread_cursor(before)
+    if position:
+        last_post_at, pk = position
+        threads = threads.filter(Q(last_post_at__lt=last_post_at) | Q(last_post_at=last_post_at, pk__lt=pk))
+
+    page = list(threads[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    next_before = thread_cursor(page[-1]) if has_more else None
+    return page, next_before
+
+
+"""
+Author: Angie
+Returns a thread's posts one page at a time, oldest first, with the
+author joined in. The first page ('after' is None) also carries the
+original post, so the thread page needs one query for both: it asks
+for the first REPLY_PAGE_SIZE + 2 posts (the original post, a page of
+replies and one more to tell if there is another page). Later pages
+start after the id of the last reply shown (keyset paging on the
+thread's posts, which are numbered in the order they were written).
+Returns (original_post or None, replies, next_after); 'original_post'
+is only looked up for the first page and 'next_after' is None on the
+last page.
+"""
+def get_post_page(thread, after=None, limit=REPLY_PAGE_SIZE):
+    posts = thread.posts.select_related('author').order_by('pk')
+    if after is None:
+        page = list(posts[:limit + 2])
+        original_post, replies = (page[0], page[1:]) if page else (None, [])
+    else:
+        original_post, replies = None, list(posts.filter(pk__gt=after)[:limit + 1])
+
+    has_more = len(replies) > limit
+    replies = replies[:limit]
+    next_after = replies[-1].pk if has_more else None
+    return original_post, replies, next_after
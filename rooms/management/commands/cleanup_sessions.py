@@ -6,8 +6,8 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 # Import timedelta from datetime because we need to calculate a time difference (12 hours ago).
 from datetime import timedelta
-# Import Session from rooms.models because this command needs to find and delete old Session objects.
-from rooms.models import Session
+# Import the cleanup helpers from rooms.cleanup because they do the actual batched delete.
+from rooms.cleanup import SESSION_LIFETIME, delete_sessions_before
 
 """
 Author: Evan
@@ -15,26 +15,32 @@ This class defines a custom command that can be run from the
 server's command line (using 'python manage.py cleanup_sessions').
 Its purpose is to automatically clean up the database by finding
 and deleting any live study sessions that were created more
-than 12 hours ago. This helps keep the session list from
-getting cluttered with old, inactive sessions.
+than 12 hours ago (or '--hours'). This helps keep the session list
+from getting cluttered with old, inactive sessions. It deletes in
+small batches, prints progress as it goes, and can be stopped and
+re-run at any time. The ASGI server can also do this by itself
+every few minutes (see SESSION_CLEANUP_INTERVAL).
 """
 class Command(BaseCommand):
     help = 'Deletes sessions older than 12 hours.'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=SESSION_LIFETIME // timedelta(hours=1),
+                            help='Delete sessions started more than this many hours ago.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Sessions deleted per batch.')
+
+    def handle(self, *args, **options):
         # Calculate the time 12 hours ago from now
-        twelve_hours_ago = timezone.now() - timedelta(hours=12)
-        
-        # Finds all sessions created more than 12 hours ago - maybe
-        old_sessions = Session.objects.filter(created_at__lt=twelve_hours_ago)
-        
-        # Get the count of old sessions found
-        count = old_sessions.count()
-        
-        # If any old sessions were found
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+
+        count = 0
+        for deleted, last_pk in delete_sessions_before(cutoff, batch_size=options['batch_size']):
+            # Only report batches that deleted something
+            if deleted > count:
+                self.stdout.write(f'Deleted {deleted} session(s), up to id {last_pk}')
+            count = deleted
+
         if count > 0:
-            # Delete them all
-            old_sessions.delete()
             # Print a success message to the command line
             self.stdout.write(self.style.SUCCESS(f'Successfully deleted {count} old session(s).'))
         else:
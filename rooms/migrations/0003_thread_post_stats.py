@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:47
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+# Counts every thread's posts and notes when the newest was written.
+def count_posts(apps, schema_editor):
+    Thread = apps.get_model('rooms', 'Thread')
+    threads = Thread.objects.annotate(posts_made=Count('posts'), newest_post=Max('posts__created_at'))
+    for thread in threads.iterator():
+        Thread.objects.filter(pk=thread.pk).update(
+            post_count=thread.posts_made, last_post_at=thread.newest_post or thread.created_at,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0002_course_tag_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='last_post_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['course', '-last_post_at', '-id'], name='thread_course_activity_idx'),
+        ),
+        migrations.RunPython(count_posts, migrations.RunPython.noop),
+    ]
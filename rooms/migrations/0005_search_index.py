@@ -0,0 +1,24 @@
+# Adds the full-text indexes used by course search (see rooms/search.py).
+
+from django.db import migrations
+
+from rooms.search import install_search_index, remove_search_index
+
+
+def forwards(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+
+
+def backwards(apps, schema_editor):
+    remove_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0004_post_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
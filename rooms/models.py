@@ -4,6 +4,8 @@
 from django.db import models
 # Import settings from django.conf because 'Thread', 'Post', and 'Session' need to link to the User model.
 from django.conf import settings
+# Import timezone from django.utils because a new thread's last activity is when it was made.
+from django.utils import timezone
 
 """
 Author: Angie
@@ -48,9 +50,34 @@ class Thread(models.Model):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # How many posts the thread has and when the newest was written, so the
+    # course page can list and sort threads without counting their posts.
+    # Kept up to date by rooms/signals.py.
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+    last_post_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # One page of a course's threads, most recently active first (see rooms/listing.py)
+            models.Index(fields=['course', '-last_post_at', '-id'], name='thread_course_activity_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
+    # Posts other than the original one
+    @property
+    def reply_count(self):
+        return max(self.post_count - 1, 0)
+
+    # Recounts the posts (after one is deleted, when the newest may have gone).
+    def refresh_post_stats(self):
+        posts = self.posts.order_by('-created_at')
+        self.post_count = posts.count()
+        newest = posts.values_list('created_at', flat=True).first()
+        self.last_post_at = newest or self.created_at
+        self.save(update_fields=['post_count', 'last_post_at'])
+
 """
 Author: Angie
 This class represents a single message or reply within a
@@ -63,6 +90,8 @@ class Post(models.Model):
     content = models.TextField()
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Raised on every edit, so the cached HTML of the old text is never used again (see rooms/fragments.py)
+    version = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return f'Post by {self.author} in {self.thread.title}'
@@ -19,4 +19,6 @@ websocket_urlpatterns = [
     path("ws/notifications/", consumers.NotificationConsumer.as_asgi()),
     # WebSocket path for a specific course room, identified by its 'slug'. Handles live thread/post broadcasts.
     path("ws/course_room/<slug:room_slug>/", consumers.RoomConsumer.as_asgi()),
+    # WebSocket path for one thread of a course room. Handles live replies to that thread only.
+    path("ws/course_room/<slug:room_slug>/thread/<int:thread_pk>/", consumers.RoomConsumer.as_asgi()),
 ]
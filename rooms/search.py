@@ -0,0 +1,243 @@
+# rooms/search.py
+
+# Import re because tags are taken out of snippets of HTML posts (snippets can end inside a tag).
+import re
+# Import connection from django.db because the search SQL depends on the database in use.
+from django.db import connection
+# Import escape from django.utils.html because snippets are made from raw post text.
+from django.utils.html import escape
+# Import Truncator from django.utils.text because snippets are kept short.
+from django.utils.text import Truncator
+# Import build_fts5_query and the snippet markers from messaging.search because room search reads search text the same way.
+from messaging.search import build_fts5_query, SNIPPET_START, SNIPPET_END
+# Import Post from .models because search results are returned as Post objects.
+from .models import Post
+
+# How many results one page of search shows.
+SEARCH_PAGE_SIZE = 20
+# Results are ranked, so later pages are found by skipping the earlier ones; this
+# many pages is as deep as it goes.
+MAX_SEARCH_PAGES = 10
+# How much more a match in a thread's title counts than a match in a post.
+TITLE_WEIGHT = 2.0
+# On SQLite only this many of the newest matches are ranked. Ranking means scoring
+# every candidate, and a common word can be in most of a big course's posts.
+SEARCH_CANDIDATES = 2000
+
+# Full-text index objects. PostgreSQL gets generated tsvector columns on posts and
+# threads, each with a GIN index. SQLite gets one FTS5 table with a row per post,
+# filled by triggers (see 'install_search_index').
+PG_SEARCH_COLUMN = 'search_vector'
+PG_SEARCH_INDEXES = {'rooms_post': 'rooms_post_search_idx', 'rooms_thread': 'rooms_thread_search_idx'}
+PG_SEARCHED_COLUMNS = {'rooms_post': 'content', 'rooms_thread': 'title'}
+SQLITE_FTS_TABLE = 'rooms_post_fts'
+SQLITE_TRIGGERS = ('rooms_post_fts_ai', 'rooms_post_fts_ad', 'rooms_post_fts_au', 'rooms_post_fts_tu')
+# bm25() weights of the FTS5 table's columns (course, title, content).
+SQLITE_COLUMN_WEIGHTS = f'0.0, {TITLE_WEIGHT}, 1.0'
+
+# An HTML tag, or the start or end of one cut off by a snippet.
+HTML_TAG = re.compile(r'</?[A-Za-z][^>]*>?|^[^<>\s]*>')
+
+# What goes into the FTS5 table for a post: its course as a word ('c12', so the
+# search can be limited to one course inside the index), its thread's title if it's
+# the thread's first post (so a title matches once, not once per reply), and its text.
+# '{post}' is the post's table alias, 't' its thread.
+SQLITE_POST_ROW = (
+    "{post}.id, 'c' || t.course_id, "
+    "CASE WHEN NOT EXISTS (SELECT 1 FROM rooms_post p2 WHERE p2.thread_id = {post}.thread_id AND p2.id < {post}.id) "
+    "THEN t.title ELSE '' END, "
+    "{post}.content"
+)
+
+
+"""
+Author: Angie
+Creates the full-text indexes for posts and thread titles if they
+aren't there yet, like messaging/search.py does for chat messages.
+It's called by migration 0005 and again after every 'migrate' (see
+apps.py), since SQLite drops a table's triggers when a migration
+rebuilds it.
+On PostgreSQL the tsvector columns are generated by the database.
+On SQLite the FTS5 table keeps its own copy of what it indexes, so
+that the course and the title can be in the same row as the text.
+Triggers keep it in step with new, edited and deleted posts and with
+renamed threads.
+"""
+def install_search_index(conn=connection):
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            for table, column in PG_SEARCHED_COLUMNS.items():
+                cursor.execute(
+                    f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {PG_SEARCH_COLUMN} tsvector "
+                    f"GENERATED ALWAYS AS (to_tsvector('english', coalesce({column}, ''))) STORED"
+                )
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {PG_SEARCH_INDEXES[table]} ON {table} USING GIN ({PG_SEARCH_COLUMN})"
+                )
+        elif conn.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'rooms_post_fts_%'"
+            )
+            if cursor.fetchone()[0] == len(SQLITE_TRIGGERS):
+                return
+            # The last search word is matched as a prefix while people type; prefix indexes for
+            # 2 to 4 letters keep that fast even when the prefix starts many different words
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5("
+                f"course, title, content, prefix='2 3 4', tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS rooms_post_fts_ai AFTER INSERT ON rooms_post BEGIN "
+                f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, course, title, content) "
+                f"SELECT {SQLITE_POST_ROW.format(post='new')} FROM rooms_thread t WHERE t.id = new.thread_id; END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS rooms_post_fts_ad AFTER DELETE ON rooms_post BEGIN "
+                f"DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = old.id; END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS rooms_post_fts_au AFTER UPDATE OF content ON rooms_post BEGIN "
+                f"UPDATE {SQLITE_FTS_TABLE} SET content = new.content WHERE rowid = new.id; END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS rooms_post_fts_tu AFTER UPDATE OF title ON rooms_thread BEGIN "
+                f"UPDATE {SQLITE_FTS_TABLE} SET title = new.title "
+                f"WHERE rowid = (SELECT min(id) FROM rooms_post WHERE thread_id = new.id); END"
+            )
+            # Index everything again, in case posts were written while the triggers were missing
+            cursor.execute(f"DELETE FROM {SQLITE_FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, course, title, content) "
+                f"SELECT {SQLITE_POST_ROW.format(post='p')} FROM rooms_post p JOIN rooms_thread t ON t.id = p.thread_id"
+            )
+
+
+# Removes the full-text indexes (used when migration 0005 is reversed).
+def remove_search_index(conn=connection):
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            for table, index in PG_SEARCH_INDEXES.items():
+                cursor.execute(f"DROP INDEX IF EXISTS {index}")
+                cursor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {PG_SEARCH_COLUMN}")
+        elif conn.vendor == 'sqlite':
+            for trigger in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            cursor.execute(f"DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}")
+
+
+# Escapes a snippet from the database and turns its match markers into <mark> tags.
+# Tags from HTML posts (imported events) are dropped first, and it's kept short
+# (only PostgreSQL and SQLite shorten snippets themselves).
+def highlight_snippet(snippet):
+    text = Truncator(' '.join(HTML_TAG.sub(' ', snippet).split())).words(40)
+    return escape(text).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+
+
+"""
+Author: Angie
+Returns the (post id, snippet) of one page of ranked matches in a
+course.
+On SQLite it's FTS5 queries only: the course word, and the search
+words in the title or text, are all matched inside the index. The
+first query finds where the SEARCH_CANDIDATES newest matches start
+(FTS5 walks its index newest-first and stops there), the second ranks
+those by bm25(), with the title counting TITLE_WEIGHT times as much,
+and takes the snippets from the same rows.
+On PostgreSQL posts are matched on their own text and threads on
+their title (each through its GIN index), a title match counting for
+the thread's first post, and only the page's posts get a headline
+(building them is the slow part).
+"""
+def fetch_ranked_matches(course, text, offset, limit):
+    if connection.vendor == 'sqlite':
+        match = f'course : "c{course.pk}" AND {{title content}} : ({build_fts5_query(text)})'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s "
+                f"ORDER BY rowid DESC LIMIT 1 OFFSET %s",
+                [match, SEARCH_CANDIDATES - 1],
+            )
+            oldest = cursor.fetchone()
+            cursor.execute(
+                f"SELECT rowid, snippet({SQLITE_FTS_TABLE}, 2, %s, %s, '…', 16) FROM {SQLITE_FTS_TABLE} "
+                f"WHERE {SQLITE_FTS_TABLE} MATCH %s AND rowid >= %s "
+                f"ORDER BY bm25({SQLITE_FTS_TABLE}, {SQLITE_COLUMN_WEIGHTS}), rowid DESC LIMIT %s OFFSET %s",
+                [SNIPPET_START, SNIPPET_END, match, oldest[0] if oldest else 0, limit, offset],
+            )
+            return cursor.fetchall()
+
+    first_post = "(SELECT min(p2.id) FROM rooms_post p2 WHERE p2.thread_id = t.id)"
+    if connection.vendor == 'postgresql':
+        post_matches = (
+            f"SELECT p.id AS post_id, ts_rank(p.{PG_SEARCH_COLUMN}, q) AS score "
+            f"FROM rooms_post p JOIN rooms_thread t ON t.id = p.thread_id, websearch_to_tsquery('english', %s) q "
+            f"WHERE p.{PG_SEARCH_COLUMN} @@ q AND t.course_id = %s"
+        )
+        title_matches = (
+            f"SELECT {first_post} AS post_id, %s * ts_rank(t.{PG_SEARCH_COLUMN}, q) AS score "
+            f"FROM rooms_thread t, websearch_to_tsquery('english', %s) q "
+            f"WHERE t.{PG_SEARCH_COLUMN} @@ q AND t.course_id = %s"
+        )
+        params = [text, course.pk, TITLE_WEIGHT, text, course.pk]
+        snippet = "ts_headline('english', p.content, websearch_to_tsquery('english', %s), %s)"
+        snippet_params = [text, f'StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxWords=24, MinWords=8, MaxFragments=1']
+    else:
+        # No full-text index on this database; matches are found by a plain text scan, unranked
+        pattern = '%' + text.replace('%', '').replace('_', '') + '%'
+        post_matches = (
+            "SELECT p.id AS post_id, 1.0 AS score FROM rooms_post p JOIN rooms_thread t ON t.id = p.thread_id "
+            "WHERE p.content LIKE %s AND t.course_id = %s"
+        )
+        title_matches = (
+            f"SELECT {first_post} AS post_id, %s AS score FROM rooms_thread t "
+            f"WHERE t.title LIKE %s AND t.course_id = %s"
+        )
+        params = [pattern, course.pk, TITLE_WEIGHT, pattern, course.pk]
+        snippet, snippet_params = "p.content", []
+
+    sql = (
+        f"SELECT p.id, {snippet} FROM ("
+        f"SELECT post_id, max(score) AS best FROM ({post_matches} UNION ALL {title_matches}) matches "
+        f"WHERE post_id IS NOT NULL GROUP BY post_id ORDER BY best DESC, post_id DESC LIMIT %s OFFSET %s"
+        f") page JOIN rooms_post p ON p.id = page.post_id ORDER BY page.best DESC, p.id DESC"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, snippet_params + params + [limit, offset])
+        return cursor.fetchall()
+
+
+"""
+Author: Angie
+Searches the threads and posts of one course (imported event posts
+included), best matches first. A post matches on its own text, and
+a thread's first post also matches on the thread's title (which
+counts TITLE_WEIGHT times as much). Matches come from the full-text
+indexes, never a scan of the post table (see 'fetch_ranked_matches';
+on SQLite only the SEARCH_CANDIDATES newest matches are ranked).
+Since results are ranked there is no keyset to page on, so 'page'
+(from 1) skips the earlier pages, up to MAX_SEARCH_PAGES.
+
+Returns (results, next_page). The results are Post objects (with
+their author and thread loaded) carrying a highlighted 'snippet'
+(safe HTML). 'next_page' is None on the last page.
+"""
+def search_course(course, text, page=1, limit=SEARCH_PAGE_SIZE):
+    text = (text or '').strip()
+    if not text or not 1 <= page <= MAX_SEARCH_PAGES:
+        return [], None
+    if connection.vendor == 'sqlite' and build_fts5_query(text) is None:
+        return [], None
+
+    rows = fetch_ranked_matches(course, text, (page - 1) * limit, limit + 1)
+    has_more = len(rows) > limit and page < MAX_SEARCH_PAGES
+
+    rows = rows[:limit]
+    posts = Post.objects.select_related('author', 'thread').in_bulk([row[0] for row in rows])
+    results = []
+    for pk, snippet in rows:
+        post = posts.get(pk)
+        if post is None:
+            continue  # Deleted since it was ranked
+        post.snippet = highlight_snippet(snippet or '')
+        results.append(post)
+    return results, page + 1 if has_more else None
@@ -0,0 +1,53 @@
+# rooms/signals.py
+
+# Import post_save and post_delete from django.db.models.signals because every new or deleted post changes its thread's numbers.
+from django.db.models.signals import post_save, post_delete
+# Import receiver from django.dispatch because it's the decorator used to connect a function to a signal.
+from django.dispatch import receiver
+# Import F from django.db.models because the count is raised in the database, so two posts at once both count.
+# Import QuerySet because bulk deletes of posts say so through the signal's 'origin'.
+from django.db.models import F, QuerySet
+# Import models from .models because 'Post' is the sender and 'Thread' holds the numbers, and 'Course' changes reach the catalog.
+from .models import Course, Thread, Post
+# Import bump_catalog_version from .catalog because every process's course catalog is out of date once a course changes.
+from .catalog import bump_catalog_version
+
+"""
+Author: Angie
+These receivers keep 'Thread.post_count' and 'Thread.last_post_at'
+in step with the thread's posts, wherever the posts come from (the
+thread and reply forms, 'import_events', the admin). A new post
+raises the count with a single UPDATE. A deleted post recounts, since
+it may have been the newest one. This includes posts that go because
+their author's account is deleted. Only deletes that are part of
+deleting the whole thread (or its course) are ignored, since the
+thread is going away.
+"""
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, **kwargs):
+    if created:
+        Thread.objects.filter(pk=instance.thread_id).update(
+            post_count=F('post_count') + 1, last_post_at=instance.created_at,
+        )
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, origin=None, **kwargs):
+    # 'origin' is what '.delete()' was called on: a post, a user, a thread, a course, or a queryset of them.
+    # Posts only go with a thread or course when that thread is among the ones being deleted.
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model in (Thread, Course):
+        return
+    thread = Thread.objects.filter(pk=instance.thread_id).first()
+    if thread:
+        thread.refresh_post_stats()
+
+"""
+Author: Angie
+Any course or tag that is added, changed or deleted (from the admin,
+'import_events' or a fixture) makes every server process load the
+course catalog (rooms/catalog.py) again the next time it's used.
+"""
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def refresh_course_catalog(sender, **kwargs):
+    bump_catalog_version()
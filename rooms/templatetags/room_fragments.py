@@ -0,0 +1,15 @@
+# rooms/templatetags/room_fragments.py
+
+# Import template from django because this file registers template tags.
+from django import template
+# Import mark_safe from django.utils.safestring because fragments are already-rendered HTML.
+from django.utils.safestring import mark_safe
+# Import render_fragments from rooms.fragments because the cached HTML lives there.
+from rooms.fragments import render_fragments
+
+register = template.Library()
+
+# {% fragments threads %}: the cached 'thread_item.html' / 'post_item.html' of each, in order.
+@register.simple_tag
+def fragments(objects):
+    return mark_safe(''.join(render_fragments(list(objects))))
@@ -1,3 +1,281 @@
-from django.test import TestCase
+# rooms/tests.py
 
-# Create tests here.
+# Import timedelta from datetime because the tests move posts and sessions back in time.
+from datetime import timedelta
+# Import patch from unittest.mock because the viewer tests move the clock forward.
+from unittest.mock import patch
+# Import cache from django.core.cache because the viewer tests clear it.
+from django.core.cache import cache
+# Import TestCase and override_settings from django.test because the tests run against a test database,
+# with local stand-ins for the Redis cache and channel layer.
+from django.test import TestCase, override_settings
+# Import get_user_model from django.contrib.auth because posts, threads and sessions all have an author or host.
+from django.contrib.auth import get_user_model
+# Import timezone from django.utils because post and session timestamps are timezone-aware.
+from django.utils import timezone
+# Import the models from .models because these tests create courses, threads, posts and sessions.
+from .models import Course, Thread, Post, Session
+# Import the listing helpers from .listing because their cursors are tested here.
+from .listing import get_thread_page, get_post_page, thread_cursor
+# Import delete_sessions_before from .cleanup because its batching and resuming are tested here.
+from .cleanup import delete_sessions_before
+# Import the viewer helpers from .viewers because counting viewers (and forgetting the ones gone) is tested here.
+from .viewers import VIEWER_WINDOW, add_viewer, refresh_viewer, remove_viewer, viewer_count, has_viewers
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'fragments': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragments'},
+}
+LOCAL_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+"""
+Author: Angie
+Checks that 'Thread.post_count' and 'Thread.last_post_at' follow the
+thread's posts (rooms/signals.py): new posts, a deleted post, a bulk
+delete, and the posts that go with a deleted user.
+"""
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class PostCountTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.author = User.objects.create_user(email='author@uah.edu', password='x', first_name='Author')
+        self.replier = User.objects.create_user(email='replier@uah.edu', password='x', first_name='Replier')
+        self.course = Course.objects.create(name='Course', slug='course')
+        self.thread = Thread.objects.create(course=self.course, title='Thread', author=self.author)
+        self.original = Post.objects.create(thread=self.thread, author=self.author, content='original')
+
+    def test_new_posts_are_counted(self):
+        reply = Post.objects.create(thread=self.thread, author=self.replier, content='reply')
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.post_count, 2)
+        self.assertEqual(self.thread.last_post_at, reply.created_at)
+
+    def test_deleting_the_newest_post_goes_back_to_the_one_before(self):
+        reply = Post.objects.create(thread=self.thread, author=self.replier, content='reply')
+        reply.delete()
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.post_count, 1)
+        self.assertEqual(self.thread.last_post_at, self.original.created_at)
+
+    def test_bulk_delete_is_counted(self):
+        for n in range(3):
+            Post.objects.create(thread=self.thread, author=self.replier, content=f'reply {n}')
+        Post.objects.filter(author=self.replier).delete()
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.post_count, 1)
+        self.assertEqual(self.thread.last_post_at, self.original.created_at)
+
+    def test_deleting_a_user_recounts_the_threads_they_replied_to(self):
+        Post.objects.create(thread=self.thread, author=self.replier, content='reply')
+        self.replier.delete()
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.post_count, 1)
+        self.assertEqual(self.thread.last_post_at, self.original.created_at)
+
+    def test_deleting_the_thread_deletes_its_posts(self):
+        Post.objects.create(thread=self.thread, author=self.replier, content='reply')
+        self.thread.delete()
+        self.assertFalse(Post.objects.exists())
+
+    def test_deleting_the_course_deletes_its_threads(self):
+        self.course.delete()
+        self.assertFalse(Thread.objects.exists())
+        self.assertFalse(Post.objects.exists())
+
+
+"""
+Author: Angie
+Checks the keyset paging of 'get_thread_page' and 'get_post_page'
+(rooms/listing.py) at its edges: threads active at the same moment,
+the last page, cursors that aren't ours, and empty listings.
+"""
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ListingTests(TestCase):
+    def setUp(self):
+        self.author = get_user_model().objects.create_user(email='author@uah.edu', password='x', first_name='Author')
+        self.course = Course.objects.create(name='Course', slug='course')
+
+    def make_threads(self, count):
+        return [Thread.objects.create(course=self.course, title=f'Thread {n}', author=self.author) for n in range(count)]
+
+    # Walks every page of the course's threads and returns them in the order they were shown.
+    def all_thread_pages(self, limit):
+        shown, before = [], None
+        while True:
+            page, before = get_thread_page(self.course, before=before, limit=limit)
+            shown.extend(page)
+            if before is None:
+                return shown
+
+    def test_threads_active_at_the_same_moment_are_each_shown_once(self):
+        threads = self.make_threads(5)
+        Thread.objects.update(last_post_at=timezone.now())
+        shown = self.all_thread_pages(limit=2)
+        self.assertEqual([thread.pk for thread in shown], [thread.pk for thread in reversed(threads)])
+
+    def test_threads_are_shown_most_recently_active_first(self):
+        threads = self.make_threads(3)
+        now = timezone.now()
+        for n, thread in enumerate(threads):
+            Thread.objects.filter(pk=thread.pk).update(last_post_at=now - timedelta(minutes=n))
+        shown = self.all_thread_pages(limit=1)
+        self.assertEqual([thread.pk for thread in shown], [thread.pk for thread in threads])
+
+    def test_a_full_last_page_has_no_next_cursor(self):
+        self.make_threads(4)
+        page, before = get_thread_page(self.course, limit=2)
+        self.assertEqual(len(page), 2)
+        self.assertEqual(before, thread_cursor(page[-1]))
+        page, before = get_thread_page(self.course, before=before, limit=2)
+        self.assertEqual(len(page), 2)
+        self.assertIsNone(before)
+
+    def test_a_malformed_cursor_gives_the_first_page(self):
+        self.make_threads(3)
+        first_page, _ = get_thread_page(self.course, limit=2)
+        for cursor in ('', 'abc', '1_2_3', '12', f'{10 ** 30}_1'):
+            page, _ = get_thread_page(self.course, before=cursor, limit=2)
+            self.assertEqual(page, first_page, cursor)
+
+    def test_a_course_without_threads(self):
+        self.assertEqual(get_thread_page(self.course), ([], None))
+
+    def test_a_thread_without_posts(self):
+        thread = self.make_threads(1)[0]
+        self.assertEqual(get_post_page(thread), (None, [], None))
+
+    def test_the_first_post_page_carries_the_original_post(self):
+        thread = self.make_threads(1)[0]
+        posts = [Post.objects.create(thread=thread, author=self.author, content=f'post {n}') for n in range(6)]
+        original, replies, after = get_post_page(thread, limit=2)
+        self.assertEqual(original, posts[0])
+        self.assertEqual(replies, posts[1:3])
+        self.assertEqual(after, posts[2].pk)
+        original, replies, after = get_post_page(thread, after=after, limit=2)
+        self.assertIsNone(original)
+        self.assertEqual(replies, posts[3:5])
+        self.assertEqual(after, posts[4].pk)
+        original, replies, after = get_post_page(thread, after=after, limit=2)
+        self.assertEqual(replies, posts[5:])
+        self.assertIsNone(after)
+
+    def test_a_full_first_post_page_has_no_next_cursor(self):
+        thread = self.make_threads(1)[0]
+        for n in range(3):
+            Post.objects.create(thread=thread, author=self.author, content=f'post {n}')
+        original, replies, after = get_post_page(thread, limit=2)
+        self.assertEqual(len(replies), 2)
+        self.assertIsNone(after)
+
+
+"""
+Author: Evan
+Checks that 'delete_sessions_before' (rooms/cleanup.py) deletes old
+sessions in batches, stops at the first recent one, and that a run
+stopped part way is finished by the next one.
+"""
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class SessionCleanupTests(TestCase):
+    def setUp(self):
+        self.host = get_user_model().objects.create_user(email='host@uah.edu', password='x', first_name='Host')
+        self.course = Course.objects.create(name='Course', slug='course')
+        self.cutoff = timezone.now() - timedelta(hours=12)
+
+    # Creates 'count' sessions, backdated to before the cutoff if 'old'.
+    def make_sessions(self, count, old):
+        sessions = [Session.objects.create(course=self.course, host=self.host, topic=f'Session {n}') for n in range(count)]
+        if old:
+            Session.objects.filter(pk__in=[s.pk for s in sessions]).update(created_at=self.cutoff - timedelta(hours=1))
+        return sessions
+
+    def test_old_sessions_are_deleted_in_batches(self):
+        old = self.make_sessions(5, old=True)
+        recent = self.make_sessions(2, old=False)
+        progress = list(delete_sessions_before(self.cutoff, batch_size=2))
+        self.assertEqual(progress, [(2, old[1].pk), (4, old[3].pk), (5, old[4].pk)])
+        self.assertEqual(list(Session.objects.order_by('pk')), recent)
+
+    def test_a_stopped_run_is_finished_by_the_next_one(self):
+        old = self.make_sessions(5, old=True)
+        recent = self.make_sessions(1, old=False)
+        run = delete_sessions_before(self.cutoff, batch_size=2)
+        self.assertEqual(next(run), (2, old[1].pk))
+        run.close()
+        self.assertEqual(Session.objects.count(), 4)
+        progress = list(delete_sessions_before(self.cutoff, batch_size=2))
+        self.assertEqual(progress[-1], (3, old[4].pk))
+        self.assertEqual(list(Session.objects.order_by('pk')), recent)
+
+    def test_the_walk_stops_at_the_first_recent_session(self):
+        recent = self.make_sessions(1, old=False)
+        self.make_sessions(2, old=True)
+        progress = list(delete_sessions_before(self.cutoff, batch_size=2))
+        self.assertEqual(progress, [(0, 0)])
+        self.assertEqual(Session.objects.count(), 3)
+        self.assertEqual(Session.objects.order_by('pk').first(), recent[0])
+
+    def test_nothing_to_delete(self):
+        self.assertEqual(list(delete_sessions_before(self.cutoff)), [])
+
+
+"""
+Author: Oju
+Checks the room viewer counts (rooms/viewers.py): sockets are counted
+while they keep marking their windows, leave cleanly, or are forgotten
+on their own when they stop without leaving (a server restart).
+"""
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ViewerCountTests(TestCase):
+    group = 'course_room_course'
+
+    def setUp(self):
+        cache.clear()
+        self.now = 1000 * VIEWER_WINDOW
+        clock = patch('rooms.viewers.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        # Counts are known once the cache has kept marks for two windows
+        viewer_count(self.group)
+        self.wait_windows(2)
+
+    def wait_windows(self, count):
+        self.now += count * VIEWER_WINDOW
+
+    def test_the_count_is_unknown_for_two_windows_after_the_cache_is_cleared(self):
+        self.assertEqual(viewer_count(self.group), 0)
+        cache.clear()
+        self.assertIsNone(viewer_count(self.group))
+        self.assertTrue(has_viewers(self.group))
+        self.wait_windows(1)
+        self.assertIsNone(viewer_count(self.group))
+        self.wait_windows(1)
+        self.assertEqual(viewer_count(self.group), 0)
+        self.assertFalse(has_viewers(self.group))
+
+    def test_sockets_are_counted_while_they_refresh(self):
+        first, count = add_viewer(self.group)
+        self.assertEqual(count, 1)
+        second, count = add_viewer(self.group)
+        self.assertEqual(count, 2)
+        for _ in range(4):
+            self.wait_windows(1)
+            first = refresh_viewer(self.group, first)
+            second = refresh_viewer(self.group, second)
+            self.assertEqual(len(first), 2)
+        self.assertEqual(viewer_count(self.group), 2)
+        self.assertEqual(remove_viewer(self.group, first), 1)
+        self.assertEqual(remove_viewer(self.group, second), 0)
+        self.assertFalse(has_viewers(self.group))
+
+    def test_sockets_that_stop_without_leaving_are_forgotten(self):
+        add_viewer(self.group)
+        staying, _ = add_viewer(self.group)
+        self.wait_windows(1)
+        staying = refresh_viewer(self.group, staying)
+        self.assertEqual(viewer_count(self.group), 2)
+        self.wait_windows(1)
+        staying = refresh_viewer(self.group, staying)
+        self.assertEqual(viewer_count(self.group), 1)
+        self.assertEqual(remove_viewer(self.group, staying), 0)
+        self.assertFalse(has_viewers(self.group))
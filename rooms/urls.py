@@ -4,7 +4,8 @@
 from django.urls import path
 # Import views from .views because all the functions that handle page loads and HTMX requests are here.
 from .views import (
-    course_list_view, course_detail_view, thread_detail_view,
+    course_list_view, course_detail_view, course_threads_view, course_search_view,
+    thread_detail_view, thread_replies_view,
     create_session_view, accept_session_invite, decline_session_invite,
     session_detail_view, delete_session_view, leave_session_view,
     session_participants_view,
@@ -20,7 +21,9 @@ threads, posts, and sessions to the correct Python function
 (a "view") that handles the request.
 RT: This file defines several URLs used for HTMX requests, such
 as editing/deleting posts, accepting/declining session invites,
-and getting the updated participant list for a session.
+loading more of a course's threads or a thread's replies,
+searching a course, and getting the updated
+participant list for a session.
 """
 urlpatterns = [
     # Main page showing the list of all course rooms
@@ -46,5 +49,8 @@ urlpatterns = [
     
     # Generic slug-based paths for course rooms and threads
     path('<slug:slug>/', course_detail_view, name='course_detail'), # Page for a specific course room (shows threads)
+    path('<slug:slug>/threads/', course_threads_view, name='course_threads'), # RT: HTMX URL for the next page of threads
+    path('<slug:slug>/search/', course_search_view, name='course_search'), # RT: HTMX URL for searching a course's threads and posts
     path('<slug:slug>/<int:pk>/', thread_detail_view, name='thread_detail'), # Page for a specific discussion thread (shows posts)
+    path('<slug:slug>/<int:pk>/replies/', thread_replies_view, name='thread_replies'), # RT: HTMX URL for the next page of replies
 ]
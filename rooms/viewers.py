@@ -0,0 +1,120 @@
+# rooms/viewers.py
+
+# Import time because viewers are counted in windows of wall-clock time, the same on every server.
+import time
+# Import cache from django.core.cache because the viewer counts are shared between the web and WebSocket workers there.
+from django.core.cache import cache
+
+# Sockets are counted in windows of this many seconds. Each open socket marks
+# every window once (see 'RoomConsumer.heartbeat'), so one that went away without
+# disconnecting (a server restart or crash) stops being counted within two windows.
+VIEWER_WINDOW = 30
+# Cache key of the number of sockets that marked a room group in one window.
+ROOM_VIEWERS_KEY = 'room_viewers:{}:{}'
+# Cache key of the first window the marks were kept from (stored without an
+# expiry, so it's only missing when the cache was cleared).
+VIEWERS_SINCE_KEY = 'room_viewers:since'
+
+
+# The channel layer group of a course room's live updates (new threads, and threads with new replies).
+def room_group_name(slug):
+    return f'course_room_{slug}'
+
+
+# The channel layer group of one thread's live updates (its new replies).
+def thread_group_name(slug, thread_pk):
+    return f'course_room_{slug}_thread_{thread_pk}'
+
+
+# The number of the viewer window we are in.
+def current_window():
+    return int(time.time() // VIEWER_WINDOW)
+
+
+# Counts one more socket in 'group_name' for 'window'; 'incr' is atomic in the shared cache.
+def mark_viewer(group_name, window):
+    key = ROOM_VIEWERS_KEY.format(group_name, window)
+    # Kept until the window after next has begun, the last time it's read
+    if cache.add(key, 1, VIEWER_WINDOW * 3):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Expired between the two calls
+        cache.add(key, 1, VIEWER_WINDOW * 3)
+
+
+# How many sockets marked 'group_name' in this window or the one before, whichever is more.
+def counted_viewers(group_name, window):
+    keys = [ROOM_VIEWERS_KEY.format(group_name, w) for w in (window, window - 1)]
+    return max([0, *cache.get_many(keys).values()])
+
+
+"""
+Author: Oju
+Counts one more socket watching 'group_name', in this window and the
+one before (so it's counted right away, before the windows turn over),
+and returns (the windows it marked, the new count). The socket marks
+each new window while it's open, and hands the windows back to
+'remove_viewer' when it leaves.
+RT: Called by 'RoomConsumer' when a socket joins a room.
+"""
+def add_viewer(group_name):
+    window = current_window()
+    cache.add(VIEWERS_SINCE_KEY, window, None)
+    windows = {window - 1, window}
+    for w in windows:
+        mark_viewer(group_name, w)
+    return windows, counted_viewers(group_name, window)
+
+
+# Marks the current window for a socket still watching 'group_name' and returns the windows it has marked that still count.
+def refresh_viewer(group_name, windows):
+    window = current_window()
+    if window not in windows:
+        mark_viewer(group_name, window)
+    return {w for w in windows | {window} if w >= window - 1}
+
+
+# Uncounts a socket that stopped watching 'group_name' from the windows it marked, and returns the new count.
+def remove_viewer(group_name, windows):
+    window = current_window()
+    for w in windows:
+        if w >= window - 1:
+            try:
+                cache.decr(ROOM_VIEWERS_KEY.format(group_name, w))
+            except ValueError:
+                pass  # Already expired
+    return counted_viewers(group_name, window)
+
+
+"""
+Author: Oju
+How many sockets are watching 'group_name', or None if that isn't
+known. The marks of a window are only complete once every open socket
+has had a whole window to mark it, so for two windows after the cache
+was cleared (or the first socket ever joined) the count is unknown.
+"""
+def viewer_count(group_name):
+    window = current_window()
+    since = cache.get(VIEWERS_SINCE_KEY)
+    if since is None:
+        cache.add(VIEWERS_SINCE_KEY, window, None)
+        return None
+    if window < since + 2:
+        return None
+    return counted_viewers(group_name, window)
+
+
+"""
+Author: Oju
+Tells the views whether a broadcast to 'group_name' could reach
+anyone. Only a count that is known to be zero skips it; an unknown
+count (a cleared cache) broadcasts anyway, so a lost count can only
+cost a wasted broadcast, never a missed update. Sockets that went
+away without disconnecting stop being counted within two windows
+(VIEWER_WINDOW), so a quiet room gets back to zero on its own.
+"""
+def has_viewers(group_name):
+    count = viewer_count(group_name)
+    return count is None or count > 0
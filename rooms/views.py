@@ -3,34 +3,33 @@
 import json 
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.template.loader import render_to_string
 from django.http import HttpResponse, HttpResponseForbidden
 from django.views.decorators.http import require_POST
-from django.db.models import Count
+from django.db.models import Count, F
 from django.core.management import call_command
 from django.contrib.admin.views.decorators import staff_member_required
 
 
 from .models import Course, Thread, Post, Session 
-from messaging.models import MessageThread, Message 
-from messaging.utils import get_or_create_message_thread 
-from messaging.constants import SESSION_INVITE_PREFIX 
+from .listing import get_thread_page, get_post_page
+from .fragments import render_fragment, forget_fragment
+from .search import search_course
+from .catalog import catalog
+from .viewers import room_group_name, thread_group_name, has_viewers
+from django.utils import timezone
+from django.template.defaultfilters import date as date_filter
+from messaging.models import MessageThread, Message, SessionInvite 
+from messaging.utils import get_or_create_message_thread, get_pending_invites_count, note_new_message 
 from .forms import ThreadForm, PostForm, SessionCreateForm 
 from channels.layers import get_channel_layer 
 from asgiref.sync import async_to_sync 
 from core.utils import get_online_user_ids 
+from core.wire import frame_event
 
-# Helper: count how many session invite messages this user has (not sent by them).
-def get_pending_invites_count(user):
-    return Message.objects.filter(
-        thread__participants=user,
-        content__startswith=SESSION_INVITE_PREFIX
-    ).exclude(sender=user).count()
-
-# Shows list of all courses except 'hang-out'
+# Shows list of all courses except 'hang-out', with their members and activity (from the course catalog)
 @login_required
 def course_list_view(request):
-    courses = Course.objects.exclude(slug='hang-out')
+    courses = [(course, catalog.activity_of(course)) for course in catalog.all() if course.slug != 'hang-out']
     return render(request, 'rooms/course_list.html', {'courses': courses})
 
 # For maintenance
@@ -63,38 +62,64 @@ def course_detail_view(request, slug):
 
             # Create the first post in the new thread
             Post.objects.create(thread=thread, content=form.cleaned_data['content'], author=request.user)
+            thread.refresh_from_db(fields=['post_count', 'last_post_at']) # Counted by rooms/signals.py
             
             # --- Real-Time Broadcast ---
-            # Build HTML for the new thread item
-            channel_layer = get_channel_layer()
-            html = render_to_string("rooms/partials/thread_item.html", {'thread': thread, 'course': course})
-            # Send the HTML to everyone in the course room's WebSocket group
-            async_to_sync(channel_layer.group_send)(
-                f'course_room_{course.slug}',
-                {
-                    'type': 'broadcast_message', # The type of message for the consumer
-                    'html': html, # The HTML content to broadcast
-                    'message_type': 'new_thread' # Specific type for client-side JS
-                }
-            )
+            # Only if someone is watching the room (counted by RoomConsumer)
+            group_name = room_group_name(course.slug)
+            if has_viewers(group_name):
+                # Build HTML for the new thread item (cached, so the next page views reuse it)
+                channel_layer = get_channel_layer()
+                html = render_fragment(thread)
+                # Send the HTML to everyone in the course room's WebSocket group
+                async_to_sync(channel_layer.group_send)(
+                    group_name,
+                    frame_event('broadcast_message', { # The type of message for the consumer
+                        'type': 'broadcast_message',
+                        'html': html, # The HTML content to broadcast
+                        'message_type': 'new_thread' # Specific type for client-side JS
+                    })
+                )
             # --- End Real-Time ---
             
             # Redirect user to the new thread's detail page
             return redirect('thread_detail', slug=course.slug, pk=thread.pk)
     
     # If not POST, just display the page
-    threads = course.threads.all() # Get all threads for this course
+    threads, next_before = get_thread_page(course) # First page, most recently active first
     form = ThreadForm() # Create an empty form for starting a new thread
-    context = { 'course': course, 'threads': threads, 'form': form, }
+    context = { 'course': course, 'threads': threads, 'next_before': next_before, 'form': form, }
     return render(request, 'rooms/course_detail.html', context)
 
+# HTMX: returns the next page of a course's threads.
+# 'before' is the cursor of the last thread already shown (keyset paging).
+@login_required
+def course_threads_view(request, slug):
+    course = get_object_or_404(Course, slug=slug)
+    threads, next_before = get_thread_page(course, before=request.GET.get('before'))
+    context = {'course': course, 'threads': threads, 'next_before': next_before}
+    # RT: Returns HTML partial for HTMX swap
+    return render(request, 'rooms/partials/thread_page.html', context)
+
+# HTMX: searches the course's threads and posts and returns one page of results.
+# 'page' counts from 1 (results are ranked, so there is no keyset to page on).
+@login_required
+def course_search_view(request, slug):
+    course = get_object_or_404(Course, slug=slug)
+    query = request.GET.get('q', '').strip()
+    try:
+        page = int(request.GET.get('page') or 1)
+    except ValueError:
+        page = 1
+    results, next_page = search_course(course, query, page=page)
+    context = {'course': course, 'query': query, 'results': results, 'next_page': next_page, 'is_next_page': page > 1}
+    # RT: Returns HTML partial for HTMX swap
+    return render(request, 'rooms/partials/search_results.html', context)
+
 # Shows a thread page, lists posts, and handles replies
 @login_required
 def thread_detail_view(request, slug, pk):
-    thread = get_object_or_404(Thread, pk=pk, course__slug=slug)
-    posts = thread.posts.order_by('created_at') # Get all posts, oldest first
-    original_post = posts.first() # The very first post
-    replies = posts[1:] # All other posts are replies
+    thread = get_object_or_404(Thread.objects.select_related('author', 'course'), pk=pk, course__slug=slug)
     
     # Handle form submission for posting a reply
     if request.method == 'POST':
@@ -106,27 +131,58 @@ def thread_detail_view(request, slug, pk):
             post.save() # Save the new reply
 
             # --- Real-Time Broadcast ---
-            # broadcasts new post to course group (live update)
             channel_layer = get_channel_layer()
-            html = render_to_string("rooms/partials/post_item.html", {'post': post})
-            # Send the HTML to everyone in the course room's WebSocket group
-            async_to_sync(channel_layer.group_send)(
-                f'course_room_{slug}', # Use the course slug for the group name
-                {
-                    'type': 'broadcast_message', # Message type for the consumer
-                    'html': html, # HTML content to broadcast
-                    'message_type': 'new_post' # Specific type for client-side JS
-                }
-            )
+            # broadcasts new post to the thread's group (live update), if someone is reading the thread
+            group_name = thread_group_name(slug, thread.pk)
+            if has_viewers(group_name):
+                html = render_fragment(post) # Cached, so the next page views reuse it
+                # Send the HTML to everyone on the thread page
+                async_to_sync(channel_layer.group_send)(
+                    group_name,
+                    frame_event('broadcast_message', { # Message type for the consumer
+                        'type': 'broadcast_message',
+                        'html': html, # HTML content to broadcast
+                        'message_type': 'new_post' # Specific type for client-side JS
+                    })
+                )
+            # tells the course page the thread has a new post (no HTML, just the new numbers)
+            group_name = room_group_name(slug) # Use the course slug for the group name
+            if has_viewers(group_name):
+                thread.refresh_from_db(fields=['post_count']) # Counted in the database by rooms/signals.py
+                async_to_sync(channel_layer.group_send)(
+                    group_name,
+                    frame_event('broadcast_message', {
+                        'type': 'broadcast_message',
+                        'message_type': 'thread_bumped',
+                        'thread_id': thread.pk,
+                        'post_count': thread.post_count,
+                        'last_post': date_filter(timezone.localtime(post.created_at), 'M j, g:i A'), # As 'thread_item.html' shows it
+                    })
+                )
             # --- End Real-Time ---
             # Redirect back to the same thread page (to clear the form)
             return redirect('thread_detail', slug=slug, pk=pk)
             
     # If not POST, just display the page
+    original_post, replies, next_after = get_post_page(thread) # The first post and first page of replies, in one query
     form = PostForm() # Create an empty form for posting a reply
-    context = { 'thread': thread, 'original_post': original_post, 'replies': replies, 'form': form, }
+    context = { 'thread': thread, 'original_post': original_post, 'replies': replies, 'next_after': next_after, 'form': form, }
     return render(request, 'rooms/thread_detail.html', context)
 
+# HTMX: returns the next page of a thread's replies.
+# 'after' is the id of the last reply already shown (keyset paging).
+@login_required
+def thread_replies_view(request, slug, pk):
+    thread = get_object_or_404(Thread.objects.select_related('course'), pk=pk, course__slug=slug)
+    try:
+        after = int(request.GET.get('after') or 0) or None
+    except ValueError:
+        after = None
+    original_post, replies, next_after = get_post_page(thread, after=after)
+    context = {'thread': thread, 'replies': replies, 'next_after': next_after}
+    # RT: Returns HTML partial for HTMX swap
+    return render(request, 'rooms/partials/reply_page.html', context)
+
 # Edits a post
 @login_required
 def edit_post_view(request, pk):
@@ -138,10 +194,15 @@ def edit_post_view(request, pk):
     if request.method == 'POST':
         form = PostForm(request.POST, instance=post) # Load form with submitted data and existing post
         if form.is_valid():
+            post.version = F('version') + 1 # New version, so the cached HTML of the old text isn't used
             form.save() # Save the changes
+            post.refresh_from_db(fields=['version'])
             # Return the updated HTML for the post item
             # RT: Returns HTML partial for HTMX swap
-            return render(request, 'rooms/partials/post_item.html', {'post': post})
+            return HttpResponse(render_fragment(post))
+    elif request.GET.get('cancel'): # Handle "Cancel" on the edit form
+        # RT: Returns the post's (cached) HTML for HTMX swap
+        return HttpResponse(render_fragment(post))
     else: # Handle initial request to show the edit form
         form = PostForm(instance=post) # Load form with existing post data
         # Return the HTML for the edit form itself
@@ -152,12 +213,12 @@ def edit_post_view(request, pk):
 @login_required
 @require_POST # Ensure this view only accepts POST requests
 def delete_post_view(request, pk):
-    post = get_object_or_404(Post, pk=pk)
+    post = get_object_or_404(Post.objects.select_related('thread__course'), pk=pk)
     # Security check: only the author can delete
     if request.user != post.author: return HttpResponseForbidden()
     
-    # Check if this is the last post in the thread
-    if post.thread.posts.count() == 1:
+    # Check if this is the last post in the thread (counted by rooms/signals.py)
+    if post.thread.post_count <= 1:
         thread = post.thread
         course = thread.course
         thread.delete() # Delete the entire thread
@@ -167,6 +228,7 @@ def delete_post_view(request, pk):
         return response
         
     # If not the last post, just delete the post
+    forget_fragment(post) # Its cached HTML is never shown again
     post.delete()
     # RT: Returns empty response for HTMX to delete the post item
     return HttpResponse('')
@@ -194,10 +256,15 @@ def create_session_view(request):
             # ---------------------------------------
             
             # --- Create Invite Message ---
-            # Uses the constant to build the invite string
-            invite_content = f"{SESSION_INVITE_PREFIX}{session.id}::{request.user.first_name} invited you to a session for {session.course.name} on the topic: {session.topic}"
-            new_message = Message.objects.create(thread=thread, sender=request.user, content=invite_content)
+            # The chat bubble holds the readable text, each buddy gets their own invite row
+            invite_content = f"{request.user.first_name} invited you to a session for {session.course.name} on the topic: {session.topic}"
+            new_message = Message.objects.create(thread=thread, sender=request.user, content=invite_content, is_session_invite=True)
+            SessionInvite.objects.bulk_create([
+                SessionInvite(session=session, inviter=request.user, invitee=buddy, message=new_message)
+                for buddy in invited_buddies
+            ])
             thread.save()  # Update thread's timestamp for sorting
+            note_new_message(new_message)  # Update read pointers and unread badges
             # --- End Invite Message ---
             
             # --- Real-Time Broadcasts ---
@@ -206,12 +273,15 @@ def create_session_view(request):
             room_group_name = f'chat_{thread.id}'
             async_to_sync(channel_layer.group_send)(
                 room_group_name,
-                {
-                    'type': 'chat_message', # Message type for the chat consumer
+                frame_event('chat_message', { # Message type for the chat consumer
+                    'type': 'chat_message',
                     'message': new_message.content,
+                    'message_html': new_message.content_html,
+                    'image_url': None,
                     'sender_id': request.user.id,
                     'sender_first_name': request.user.first_name,
-                }
+                    'seq': new_message.seq,
+                })
             )
             
             # Sends a small notification to each invited buddy for notification badge
@@ -219,13 +289,13 @@ def create_session_view(request):
                 group_name = f'notifications_for_user_{buddy.pk}'
                 # Get the updated count *after* the new invite is created
                 updated_invite_count = get_pending_invites_count(buddy)
-                message = {
-                    'type': 'send_notification', # Message type for the notification consumer
+                message = frame_event('send_notification', { # Message type for the notification consumer
+                    'type': 'notification',
                     'message': {
                         'text': f'{request.user.first_name} invited you to a new session!',
                         'invite_count': updated_invite_count # Send the correct count
                     }
-                }
+                })
                 async_to_sync(channel_layer.group_send)(group_name, message)
             # --- End Real-Time ---
 
@@ -235,60 +305,49 @@ def create_session_view(request):
         form = SessionCreateForm(user=request.user) # Pass the user to the form
     return render(request, 'rooms/create_session.html', {'form': form})
 
-# Accepts an invite: adds user to session and updates the invite message
-@login_required
-@require_POST
-def accept_session_invite(request, session_id, message_id):
-    session = get_object_or_404(Session, pk=session_id)
-    message = get_object_or_404(Message, pk=message_id)
-    session.participants.add(request.user) # Add user to the session
-    # Update the message content
-    message.content = f"{request.user.first_name} accepted the invite."
-    message.save()
+# Helper: marks the user's invite on a message as accepted/declined and pushes the new badge count.
+def respond_to_session_invite(request, session_id, message_id, status):
+    # Point lookup on the (message, invitee) unique constraint
+    invite = get_object_or_404(
+        SessionInvite.objects.select_related('session', 'message'),
+        message_id=message_id, invitee=request.user, session_id=session_id
+    )
+    if invite.status == SessionInvite.STATUS_PENDING:
+        invite.status = status
+        invite.responded_at = timezone.now()
+        invite.save(update_fields=['status', 'responded_at'])
+        if status == SessionInvite.STATUS_ACCEPTED:
+            invite.session.participants.add(request.user) # Add user to the session
 
     # --- Real-Time Badge Update ---
     # updates the user's notification badge real-time
     channel_layer = get_channel_layer()
     group_name = f'notifications_for_user_{request.user.pk}'
-    # Get the count *after* accepting (should decrease)
+    # Get the count *after* answering (should decrease)
     updated_invite_count = get_pending_invites_count(request.user)
     async_to_sync(channel_layer.group_send)(
         group_name,
-        {
-            'type': 'send_notification', # Message type for notification consumer
+        frame_event('send_notification', { # Message type for notification consumer
+            'type': 'notification',
             'message': {'invite_count': updated_invite_count} # Send updated count
-        }
+        })
     )
     # --- End Real-Time ---
     
     # RT: Return the updated HTML content for the message bubble via HTMX
-    return render(request, 'messaging/partials/message_content.html', {'message': message})
+    return render(request, 'messaging/partials/message_content.html', {'message': invite.message, 'invite': invite})
 
-# Declines an invite: updates message and notifies user
+# Accepts an invite: adds user to session and updates the invite status
+@login_required
+@require_POST
+def accept_session_invite(request, session_id, message_id):
+    return respond_to_session_invite(request, session_id, message_id, SessionInvite.STATUS_ACCEPTED)
+
+# Declines an invite: updates the invite status and notifies user
 @login_required
 @require_POST
 def decline_session_invite(request, session_id, message_id):
-    message = get_object_or_404(Message, pk=message_id)
-    # Update the message content
-    message.content = f"{request.user.first_name} declined the invite."
-    message.save()
-    
-    # --- Real-Time Badge Update ---
-    channel_layer = get_channel_layer()
-    group_name = f'notifications_for_user_{request.user.pk}'
-    # Get the count *after* declining (should decrease)
-    updated_invite_count = get_pending_invites_count(request.user)
-    async_to_sync(channel_layer.group_send)(
-        group_name,
-        {
-            'type': 'send_notification', # Message type for notification consumer
-            'message': {'invite_count': updated_invite_count} # Send updated count
-        }
-    )
-    # --- End Real-Time ---
-    
-    # RT: Return the updated HTML content for the message bubble via HTMX
-    return render(request, 'messaging/partials/message_content.html', {'message': message})
+    return respond_to_session_invite(request, session_id, message_id, SessionInvite.STATUS_DECLINED)
 
 # Shows the session page
 @login_required
@@ -89,6 +89,59 @@ document.addEventListener('DOMContentLoaded', function () {
         refreshAllIndicators(); // Update dots based on initial data
     }
     
+    /*
+    Author: Oju
+    These helpers open the site's WebSockets and read their messages.
+    If the page has the 'ws-protocol' settings (the server has the
+    compact MessagePack protocol switched on), sockets ask for it, and
+    binary frames are decoded and their short field codes turned back
+    into the usual names. Otherwise everything stays plain JSON.
+    RT: Shared real-time wire format handling for every socket.
+    */
+    const wsProtocolData = document.getElementById('ws-protocol');
+    const wsProtocol = wsProtocolData && window.MessagePack ? JSON.parse(wsProtocolData.textContent) : null;
+    const wsFieldNames = {};
+    const wsTypeNames = {};
+    if (wsProtocol) {
+        Object.entries(wsProtocol.fields).forEach(([name, code]) => { wsFieldNames[code] = name; });
+        Object.entries(wsProtocol.types).forEach(([name, code]) => { wsTypeNames[code] = name; });
+    }
+
+    function openSocket(url) {
+        if (!wsProtocol) {
+            return new WebSocket(url);
+        }
+        // The server picks the binary protocol if it's on, or falls back to JSON
+        const socket = new WebSocket(url, [wsProtocol.binary, wsProtocol.json]);
+        socket.binaryType = 'arraybuffer';
+        return socket;
+    }
+
+    function expandWireValue(value) {
+        if (Array.isArray(value)) {
+            return value.map(expandWireValue);
+        }
+        if (value && typeof value === 'object') {
+            const out = {};
+            Object.entries(value).forEach(([key, item]) => {
+                const name = wsFieldNames[key] || key;
+                if (name === 'type' && typeof item === 'number') {
+                    item = wsTypeNames[item] || item;
+                }
+                out[name] = expandWireValue(item);
+            });
+            return out;
+        }
+        return value;
+    }
+
+    function readSocketMessage(e) {
+        if (typeof e.data === 'string') {
+            return JSON.parse(e.data);
+        }
+        return expandWireValue(MessagePack.decode(new Uint8Array(e.data)));
+    }
+
     /*
     This section sets up the main WebSocket connection used for general
     site notifications (like "You Matched!") and for receiving live
@@ -101,7 +154,7 @@ document.addEventListener('DOMContentLoaded', function () {
         // FIX 1: Use secure protocol if on HTTPS
         const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
         // RT: Connect to the '/ws/notifications/' WebSocket endpoint.
-        const notificationSocket = new WebSocket(protocol + window.location.host + '/ws/notifications/');
+        const notificationSocket = openSocket(protocol + window.location.host + '/ws/notifications/');
 
         /*
         Author: Oju
@@ -111,16 +164,29 @@ document.addEventListener('DOMContentLoaded', function () {
           the notification badge count if provided.
         - If it's a 'presence_update', it adds or removes the user from
           the 'onlineUsers' set and updates their green dot.
+        - If it's an 'image_ready', a profile picture we uploaded has been
+          resized, so its thumbnails are pointed at the final file.
         RT: Handles incoming real-time notifications and presence updates.
         */
         notificationSocket.onmessage = function(e) {
-            const data = JSON.parse(e.data); // Parse the incoming message
+            const data = readSocketMessage(e); // Parse the incoming message
             if (data.type === 'notification') {
-                showToast(data.message.text); // Display pop-up
+                if (data.message.text) {
+                    showToast(data.message.text); // Display pop-up
+                }
                 if (data.message.invite_count !== undefined) {
                     // RT: Update the notification badge in the header.
-                    updateNotificationBadge(data.message.invite_count);
+                    updateNotificationBadge({ invites: data.message.invite_count });
                 }
+                if (data.message.unread_total !== undefined) {
+                    // RT: Unread chat messages are part of the same badge.
+                    updateNotificationBadge({ unread: data.message.unread_total });
+                }
+            } else if (data.type === 'image_ready') {
+                // RT: One of our profile pictures finished resizing, show the final file
+                document.querySelectorAll(`img[data-profile-image-id="${data.image_id}"]`).forEach(img => {
+                    img.src = data.image_url;
+                });
             } else if (data.type === 'presence_update') {
                 const userPk = parseInt(data.user_pk, 10);
                 if (data.status === 'online') {
@@ -312,15 +378,21 @@ document.addEventListener('DOMContentLoaded', function () {
     /*
     Author: Cole (Original Logic) / Oju (RT Refactor)
     This function updates the red notification badge that appears
-    next to the "Messages" link in the main navigation. It shows
-    or hides the badge based on the count provided (e.g., the number
-    of unread session invites).
+    next to the "Messages" link in the main navigation. The badge
+    shows pending session invites plus unread chat messages; each
+    update passes whichever of the two counts changed and the badge
+    shows (or hides) their sum.
     RT: Visually updates the notification count based on real-time data.
     */
-    function updateNotificationBadge(count) {
+    function updateNotificationBadge(counts) {
         const badgeContainer = document.getElementById('notification-badge-container');
         const badgeCount = document.getElementById('notification-badge-count');
         if (!badgeContainer || !badgeCount) return; // Make sure elements exist
+
+        if (counts.invites !== undefined) badgeContainer.dataset.inviteCount = counts.invites;
+        if (counts.unread !== undefined) badgeContainer.dataset.unreadCount = counts.unread;
+        const count = (parseInt(badgeContainer.dataset.inviteCount, 10) || 0) +
+                      (parseInt(badgeContainer.dataset.unreadCount, 10) || 0);
         
         if (count > 0) {
             badgeCount.textContent = count; // Set the number
@@ -408,8 +480,22 @@ document.addEventListener('DOMContentLoaded', function () {
 
             // FIX 2: Use secure protocol if on HTTPS
             const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
-            // RT: Connect to the specific chat thread's WebSocket endpoint.
-            const chatSocket = new WebSocket(protocol + window.location.host + '/ws/chat/' + threadId + '/');
+            // RT: The specific chat thread's WebSocket endpoint (connected further down).
+            const chatSocketUrl = protocol + window.location.host + '/ws/chat/' + threadId + '/';
+            let chatSocket;
+            let reconnectDelay = 1000;
+
+            // RT: Sequence numbers of the messages already on screen, and the newest one.
+            // Sent back to the server as 'resume' so it only replays what we missed.
+            const seenSeqs = new Set();
+            let lastSeq = 0;
+            messageList.querySelectorAll('.message[data-seq]').forEach(el => {
+                const seq = parseInt(el.dataset.seq, 10);
+                if (!isNaN(seq)) {
+                    seenSeqs.add(seq);
+                    lastSeq = Math.max(lastSeq, seq);
+                }
+            });
 
             // --- NEW: Call UI Toggle Function ---
             const setInCallUI = (inCall) => {
@@ -575,68 +661,146 @@ document.addEventListener('DOMContentLoaded', function () {
             };
 
 
+            /*
+            Author: Cole (Original Logic) / Oju (RT Refactor)
+            / Refactored by Angie for image handling
+            This function draws one chat message bubble (styled differently
+            if it's sent or received), adds the sender's name if it's a group
+            chat, puts the message text and/or image inside and scrolls down.
+            Messages whose sequence number is already on screen are skipped,
+            so live messages and replayed ones never show up twice.
+            RT: Renders live chat messages and messages replayed after a reconnect.
+            */
+            const renderChatMessage = (data) => {
+                if (data.seq) {
+                    if (seenSeqs.has(data.seq)) return;
+                    seenSeqs.add(data.seq);
+                    lastSeq = Math.max(lastSeq, data.seq);
+                }
+
+                const isSent = data.sender_id == currentUserId;
+                const messageDiv = document.createElement('div');
+                // Apply 'sent' or 'received' class for styling
+                messageDiv.className = 'message ' + (isSent ? 'sent' : 'received');
+                
+                let senderName = '';
+                // Add sender's name above the message in group chats (if received)
+                if (!isSent && chatWindow.dataset.participantCount > 2) {
+                    senderName = `<small class="message-sender-name">${data.sender_first_name}</small>`;
+                }
+
+                // Build the message content. It might be text, an image, or both.
+                let messageContentHTML = '';
+                
+                // Check for an image URL
+                if (data.image_pending) {
+                    // The server is still resizing it; 'image_ready' swaps the picture in
+                    messageContentHTML += '<div class="chat-image-pending">Processing image&hellip;</div>';
+                } else if (data.image_url) {
+                    // Add an image tag.
+                    messageContentHTML += `<img src="${data.image_url}" class="chat-image" alt="User image" style="max-width: 100%; border-radius: 12px; margin-top: 5px;">`;
+                }
+                
+                // Check for text content. 'message_html' was escaped and linkified
+                // by the server when the message was saved.
+                if (data.message_html) {
+                    messageContentHTML += `<p>${data.message_html}</p>`;
+                } else if (data.message) {
+                    const textParagraph = document.createElement('p');
+                    textParagraph.textContent = data.message;
+                    messageContentHTML += textParagraph.outerHTML;
+                }
+                
+                // Add the sender name (if any) and the message content
+                messageDiv.innerHTML = `${senderName}${messageContentHTML}`;
+
+                // Keep the list ordered by seq, replayed messages can arrive after newer live ones
+                if (data.seq) {
+                    messageDiv.dataset.seq = data.seq;
+                    const next = Array.from(messageList.querySelectorAll('.message[data-seq]'))
+                        .find(el => parseInt(el.dataset.seq, 10) > data.seq);
+                    messageList.insertBefore(messageDiv, next || null);
+                } else {
+                    messageList.appendChild(messageDiv);
+                }
+                messageList.scrollTop = messageList.scrollHeight;
+                typingIndicator.style.display = 'none';
+                
+                // Clear the file input after successful send
+                const imageInput = document.getElementById('chat-image-input');
+                if (imageInput) imageInput.value = null;
+            };
+
             /*
             Author: Cole (Original Logic) / Oju (RT Refactor)
             / Refactored by Angie for image handling / Evan for voice
             This function runs when a message is received from the chat WebSocket.
-            - If it's a 'typing' indicator from someone else, it briefly shows
-              the "... is typing" message.
-            - If it's a 'chat_message', it creates a new message bubble (styled
-              differently if it's sent or received), adds the sender's name
-              if it's a group chat, puts the message text inside, appends it
-              to the message list, and scrolls down.
+            - If it's a 'typing' indicator from someone else, it shows the
+              "... is typing" message until a 'typing_stopped' event (sent by
+              the server once they pause) or their message arrives.
+            - If it's a 'chat_message', it draws a new message bubble with
+              'renderChatMessage'.
+            - If it's a 'resume' batch, it renders every missed message in order.
             RT: Handles incoming real-time chat messages and typing indicators.
             */
-            chatSocket.onmessage = function(e) {
-                const data = JSON.parse(e.data);
+            // Fallback timer that hides the typing indicator
+            let typingHideTimer = null;
+
+            const handleChatMessage = function(e) {
+                const data = readSocketMessage(e);
 
                 if (data.type === 'typing') {
                     if (data.sender_id != currentUserId) {
                         typingIndicator.textContent = `${data.sender_first_name} is typing...`;
                         typingIndicator.style.display = 'block';
-                        // Hide it again after 2 seconds
-                        setTimeout(() => {
+                        // The server sends 'typing_stopped' when they stop. This timer is
+                        // only a fallback in case that event never arrives.
+                        clearTimeout(typingHideTimer);
+                        typingHideTimer = setTimeout(() => {
                             typingIndicator.style.display = 'none';
-                        }, 2000);
+                        }, 6000);
                     }
                 }
 
-                else if (data.type === 'chat_message') {
-                    const isSent = data.sender_id == currentUserId;
-                    const messageDiv = document.createElement('div');
-                    // Apply 'sent' or 'received' class for styling
-                    messageDiv.className = 'message ' + (isSent ? 'sent' : 'received');
-                    
-                    let senderName = '';
-                    // Add sender's name above the message in group chats (if received)
-                    if (!isSent && chatWindow.dataset.participantCount > 2) {
-                        senderName = `<small class="message-sender-name">${data.sender_first_name}</small>`;
-                    }
+                else if (data.type === 'rate_limited') {
+                    // The server dropped our last message because we sent too many too fast
+                    showToast('You are sending messages too quickly. Please wait a moment.');
+                }
 
-                    // Build the message content. It might be text, an image, or both.
-                    let messageContentHTML = '';
-                    
-                    // Check for an image URL
-                    if (data.image_url) {
-                        // Add an image tag.
-                        messageContentHTML += `<img src="${data.image_url}" class="chat-image" alt="User image" style="max-width: 100%; border-radius: 12px; margin-top: 5px;">`;
+                else if (data.type === 'typing_stopped') {
+                    if (data.sender_id != currentUserId) {
+                        clearTimeout(typingHideTimer);
+                        typingIndicator.style.display = 'none';
                     }
-                    
-                    // Check for text content
-                    if (data.message) {
-                        messageContentHTML += `<p>${data.message}</p>`;
+                }
+
+                else if (data.type === 'chat_message') {
+                    renderChatMessage(data);
+                    sendReadPointer();
+                }
+
+                else if (data.type === 'image_ready') {
+                    // RT: A picture sent earlier has been resized, replace its placeholder
+                    const placeholder = messageList.querySelector(`.message[data-seq="${data.seq}"] .chat-image-pending`);
+                    if (placeholder) {
+                        const img = document.createElement('img');
+                        img.src = data.image_url;
+                        img.className = 'chat-image';
+                        img.alt = 'User image';
+                        img.style.cssText = 'max-width: 100%; border-radius: 12px; margin-top: 5px;';
+                        placeholder.replaceWith(img);
                     }
-                    
-                    // Add the sender name (if any) and the message content
-                    messageDiv.innerHTML = `${senderName}${messageContentHTML}`;
+                }
 
-                    messageList.appendChild(messageDiv);
-                    messageList.scrollTop = messageList.scrollHeight;
-                    typingIndicator.style.display = 'none';
-                    
-                    // Clear the file input after successful send
-                    const imageInput = document.getElementById('chat-image-input');
-                    if (imageInput) imageInput.value = null;
+                else if (data.type === 'resume') {
+                    // RT: One batch with every message sent while we were disconnected.
+                    if (data.has_more) {
+                        // Too much was missed to replay, fall back to a full reload
+                        window.location.reload();
+                        return;
+                    }
+                    data.messages.forEach(renderChatMessage);
+                    sendReadPointer();
                 }
 
                 else if (data.type === 'webrtc_offer') {
@@ -694,10 +858,44 @@ document.addEventListener('DOMContentLoaded', function () {
                 }
             };
 
-            // Log error if chat connection closes unexpectedly.
-            chatSocket.onclose = function(e) {
-                console.error('Chat socket closed unexpectedly');
+            /*
+            This tells the server how far the user has read in this thread.
+            It only does so while the tab is visible. The server batches
+            these, so sending one per incoming message is cheap.
+            RT: Sends the real-time 'read' event for unread tracking.
+            */
+            const sendReadPointer = () => {
+                if (lastSeq && document.visibilityState === 'visible' &&
+                    chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+                    chatSocket.send(JSON.stringify({ 'type': 'read', 'seq': lastSeq }));
+                }
+            };
+            // Messages that arrived while the tab was hidden count as read once it's shown again
+            document.addEventListener('visibilitychange', sendReadPointer);
+
+            /*
+            This opens the chat WebSocket. As soon as it's open it sends a
+            'resume' request with the newest sequence number we have, so any
+            messages sent while the page was loading or the socket was down
+            are filled in. If the socket drops it reconnects with a growing,
+            randomised delay so a server restart doesn't cause a stampede.
+            RT: Keeps the chat connected and gap-free across reconnects.
+            */
+            const connectChatSocket = () => {
+                chatSocket = openSocket(chatSocketUrl);
+                chatSocket.onopen = function() {
+                    reconnectDelay = 1000;
+                    chatSocket.send(JSON.stringify({ 'type': 'resume', 'last_seq': lastSeq }));
+                };
+                chatSocket.onmessage = handleChatMessage;
+                // Log error and reconnect if chat connection closes unexpectedly.
+                chatSocket.onclose = function(e) {
+                    console.error('Chat socket closed unexpectedly, reconnecting...');
+                    setTimeout(connectChatSocket, reconnectDelay * (0.5 + Math.random()));
+                    reconnectDelay = Math.min(reconnectDelay * 2, 30000);
+                };
             };
+            connectChatSocket();
 
             /*
             Author: Cole (Original Logic) / Oju (RT Refactor)
@@ -742,6 +940,15 @@ document.addEventListener('DOMContentLoaded', function () {
             // Scroll to the bottom of the message list when the page loads
             if (messageList) {
                 messageList.scrollTop = messageList.scrollHeight;
+
+                // Older pages are inserted above what's on screen, so keep the view where it was
+                let heightBeforeHistory = 0;
+                messageList.addEventListener('htmx:beforeSwap', () => {
+                    heightBeforeHistory = messageList.scrollHeight;
+                });
+                messageList.addEventListener('htmx:afterSwap', () => {
+                    messageList.scrollTop += messageList.scrollHeight - heightBeforeHistory;
+                });
             }
 
             if (callButton) {
@@ -760,14 +967,17 @@ document.addEventListener('DOMContentLoaded', function () {
     RT: Manages live updates for new threads and posts in course rooms.
     */
     // --- Course Room Functionality ---
-    const courseDetailPage = document.getElementById('course-detail-page');
-    if (courseDetailPage) { // Only run if on a course detail page
+    // The course page follows the whole room; a thread page only its own thread
+    const courseDetailPage = document.getElementById('course-detail-page') || document.getElementById('thread-detail-page');
+    if (courseDetailPage) { // Only run if on a course detail or thread page
         const roomSlug = courseDetailPage.dataset.roomSlug; // Get the unique ID for the room
+        const threadId = courseDetailPage.dataset.threadId; // Only set on a thread page
         
         // FIX 3: Use secure protocol if on HTTPS
         const protocol = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
-        // RT: Connect to the course room's WebSocket endpoint.
-        const roomSocket = new WebSocket(protocol + window.location.host + '/ws/course_room/' + roomSlug + '/');
+        // RT: Connect to the course room's (or the thread's) WebSocket endpoint.
+        const roomPath = '/ws/course_room/' + roomSlug + '/' + (threadId ? 'thread/' + threadId + '/' : '');
+        const roomSocket = openSocket(protocol + window.location.host + roomPath);
 
         /*
         Author: Oju
@@ -776,17 +986,43 @@ document.addEventListener('DOMContentLoaded', function () {
           thread item and adds it to the top of the thread list.
         - If it's a 'new_post' (for the thread detail page), it takes the
           HTML for the new post and adds it to the bottom of the post list.
+        - If it's a 'thread_bumped' (a reply somewhere in the room), it
+          updates that thread's post count and last post time and moves
+          it to the top of the thread list. A thread that isn't loaded
+          yet (it's on a later page) would never show up, since the pages
+          after the first are counted from the threads already shown, so
+          the first page is loaded again instead; it now starts with it.
+        - If it's 'viewers', it shows how many are watching the room.
         RT: Handles incoming real-time updates for new threads and posts.
         */
         roomSocket.onmessage = function(e) {
-            const data = JSON.parse(e.data);
-            if (data.message_type === 'new_thread') {
+            const data = readSocketMessage(e);
+            if (data.message_type === 'viewers') {
+                const viewers = courseDetailPage.querySelector('.room-viewers');
+                if (viewers) {
+                    viewers.textContent = data.viewers + ' viewing';
+                    viewers.hidden = false;
+                }
+            } else if (data.message_type === 'new_thread') {
                 const threadList = document.getElementById('thread-list');
                 // RT: Insert new thread HTML at the beginning of the list.
-                threadList.insertAdjacentHTML('afterbegin', data.html);
+                if (threadList) {
+                    threadList.insertAdjacentHTML('afterbegin', data.html);
+                }
+            } else if (data.message_type === 'thread_bumped') {
+                const threadList = document.getElementById('thread-list');
+                const threadItem = document.getElementById('thread-' + data.thread_id);
+                if (threadList && threadItem) {
+                    threadItem.querySelector('.thread-post-count').textContent = data.post_count + ' post' + (data.post_count === 1 ? '' : 's');
+                    threadItem.querySelector('.thread-last-post').textContent = data.last_post;
+                    threadList.prepend(threadItem);
+                } else if (threadList && courseDetailPage.dataset.threadsUrl) {
+                    htmx.ajax('GET', courseDetailPage.dataset.threadsUrl, {target: '#thread-list', swap: 'innerHTML'});
+                }
             } else if (data.message_type === 'new_post') {
                 const postList = document.getElementById('post-list');
-                if(postList){
+                // Skip while older replies are still to be loaded (the new one comes with the last page)
+                if(postList && !postList.querySelector('.post-list-more')){
                     // RT: Insert new post HTML at theend of the list.
                     postList.insertAdjacentHTML('beforeend', data.html);
                 }
@@ -846,6 +1082,15 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     });
 
+    // A chat image the server refused (too big, or not an image): say why
+    document.body.addEventListener('htmx:responseError', function(event) {
+        if (event.detail.elt.id === 'messaging-image-upload-form') {
+            showToast(event.detail.xhr.responseText || 'That image could not be sent.');
+            const imageInput = document.getElementById('chat-image-input');
+            if (imageInput) imageInput.value = null;
+        }
+    });
+
     /*
     Author: Evan
     This listens for the 'htmx:afterSwap' event, which fires every
@@ -0,0 +1,101 @@
+/*
+Author: Oju
+A small MessagePack decoder for the binary WebSocket protocol (see
+core/wire.py). The browser only ever decodes frames from our own
+server, so this covers what Python's 'msgpack.packb' writes (nil,
+booleans, integers, floats, strings, binary, arrays and maps; no
+extension types) instead of loading a full library from a CDN.
+It is served from our own static files like main.js, and exposes the
+same 'MessagePack.decode(bytes)' that main.js calls.
+RT: Decodes binary real-time frames when WEBSOCKET_BINARY_PROTOCOL is on.
+*/
+(function () {
+    const textDecoder = new TextDecoder('utf-8');
+
+    function decode(bytes) {
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        let offset = 0;
+
+        function str(length) {
+            const value = textDecoder.decode(bytes.subarray(offset, offset + length));
+            offset += length;
+            return value;
+        }
+
+        function bin(length) {
+            const value = bytes.slice(offset, offset + length);
+            offset += length;
+            return value;
+        }
+
+        function array(length) {
+            const value = new Array(length);
+            for (let i = 0; i < length; i++) {
+                value[i] = read();
+            }
+            return value;
+        }
+
+        function map(length) {
+            const value = {};
+            for (let i = 0; i < length; i++) {
+                const key = read();
+                value[key] = read();
+            }
+            return value;
+        }
+
+        // 64-bit integers come back as Numbers (exact up to 2^53, which covers ids and counts)
+        function uint64() {
+            const value = view.getUint32(offset) * 4294967296 + view.getUint32(offset + 4);
+            offset += 8;
+            return value;
+        }
+
+        function int64() {
+            const value = view.getInt32(offset) * 4294967296 + view.getUint32(offset + 4);
+            offset += 8;
+            return value;
+        }
+
+        function read() {
+            const type = view.getUint8(offset++);
+            let value;
+            if (type <= 0x7f) return type;                        // positive fixint
+            if (type >= 0xe0) return type - 0x100;                // negative fixint
+            if ((type & 0xe0) === 0xa0) return str(type & 0x1f);  // fixstr
+            if ((type & 0xf0) === 0x90) return array(type & 0x0f);
+            if ((type & 0xf0) === 0x80) return map(type & 0x0f);
+            switch (type) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: value = view.getUint8(offset); offset += 1; return bin(value);
+                case 0xc5: value = view.getUint16(offset); offset += 2; return bin(value);
+                case 0xc6: value = view.getUint32(offset); offset += 4; return bin(value);
+                case 0xca: value = view.getFloat32(offset); offset += 4; return value;
+                case 0xcb: value = view.getFloat64(offset); offset += 8; return value;
+                case 0xcc: value = view.getUint8(offset); offset += 1; return value;
+                case 0xcd: value = view.getUint16(offset); offset += 2; return value;
+                case 0xce: value = view.getUint32(offset); offset += 4; return value;
+                case 0xcf: return uint64();
+                case 0xd0: value = view.getInt8(offset); offset += 1; return value;
+                case 0xd1: value = view.getInt16(offset); offset += 2; return value;
+                case 0xd2: value = view.getInt32(offset); offset += 4; return value;
+                case 0xd3: return int64();
+                case 0xd9: value = view.getUint8(offset); offset += 1; return str(value);
+                case 0xda: value = view.getUint16(offset); offset += 2; return str(value);
+                case 0xdb: value = view.getUint32(offset); offset += 4; return str(value);
+                case 0xdc: value = view.getUint16(offset); offset += 2; return array(value);
+                case 0xdd: value = view.getUint32(offset); offset += 4; return array(value);
+                case 0xde: value = view.getUint16(offset); offset += 2; return map(value);
+                case 0xdf: value = view.getUint32(offset); offset += 4; return map(value);
+            }
+            throw new Error('Unsupported MessagePack type 0x' + type.toString(16));
+        }
+
+        return read();
+    }
+
+    window.MessagePack = { decode: decode };
+})();